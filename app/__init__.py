@@ -7,6 +7,8 @@ from flask_login import LoginManager
 from flask_talisman import Talisman
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+import click
+import logging
 import os
 
 
@@ -43,6 +45,10 @@ def create_app():
     })
     limiter.init_app(app)
 
+    from . import metrics
+    metrics.init_app(app)
+    logging.getLogger('app.accounting_service').setLevel(app.config['ACCOUNTING_LOG_LEVEL'])
+
     from .routes import main_bp
     app.register_blueprint(main_bp)
 
@@ -73,32 +79,148 @@ def create_app():
         create_or_get_account('Admin Fee Account', 'agency_income')
         create_or_get_account('VAT Account', 'vat_payable')
         create_or_get_account('Utility Account', 'utility')
+        create_or_get_account('Rent Clearing', 'clearing')
         db.session.commit()
         print("Default accounts initialized.")
 
     @app.cli.command("recalculate-balances")
-    def recalculate_balances_command():
+    @click.option('--dry-run', is_flag=True, help='Only report the accounts whose balance would change.')
+    def recalculate_balances_command(dry_run):
         """Recalculates balances for all accounts."""
-        from .models import Account, Transaction
-        
-        accounts = Account.query.all()
-        if not accounts:
-            print("No accounts found.")
+        from .accounting_service import recalculate_balances
+
+        changes = recalculate_balances(dry_run=dry_run)
+        stale = disagreeing = 0
+        for change in changes:
+            old = f"{change['old']:.2f}" if change['old'] is not None else 'none'
+            line = f"Account '{change['name']}' (ID: {change['id']}): {old} -> {change['new']:.2f} ({change['delta']:+.2f})"
+            if change['delta'] or change['old'] is None:
+                stale += 1
+            if change['transactions'] is not None and abs(change['transactions'] - change['new']) > 0.001:
+                disagreeing += 1
+                line += f"; transactions sum to {change['transactions']:.2f}"
+            print(line)
+        if disagreeing:
+            print(f"\n{disagreeing} accounts have postings that disagree with their transactions.")
+        if dry_run:
+            db.session.rollback()
+            print(f"\nDry run: {stale} account balances do not match the ledger.")
             return
+        db.session.commit()
+        print(f"\nAll account balances have been recalculated from the ledger; {stale} changed.")
+
+    @app.cli.command("learn-allocations")
+    def learn_allocations_command():
+        """Rebuilds learned matches from the allocation history."""
+        from .models import AllocationHistory, Transaction
+        from .matching_service import remember_allocation
+
+        history = db.session.query(AllocationHistory, Transaction).join(
+            Transaction, AllocationHistory.transaction_id == Transaction.id
+        ).order_by(AllocationHistory.allocated_date, AllocationHistory.id).all()
+
+        learned = 0
+        for entry, transaction in history:
+            if remember_allocation(transaction, user_id=entry.user_id):
+                learned += 1
+        db.session.commit()
+        print(f"Learned {learned} allocations from {len(history)} history entries.")
 
-        print(f"Found {len(accounts)} accounts. Recalculating balances...")
-
-        for account in accounts:
-            if account.name == 'Master Bank Account':
-                total_amount = db.session.query(db.func.sum(Transaction.amount)).scalar()
-            else:
-                total_amount = db.session.query(db.func.sum(Transaction.amount)).filter(Transaction.account_id == account.id).scalar()
-
-            new_balance = total_amount if total_amount is not None else 0.0
-            account.balance = new_balance
-            print(f"Account '{account.name}' (ID: {account.id}): New balance = {new_balance:.2f}")
+    @app.cli.command("check-balance-drift")
+    @click.option('--full', is_flag=True, help='Check every account, not only those posted to since the last check.')
+    def check_balance_drift_command(full):
+        """Compares cached account balances with the ledger and records discrepancies."""
+        from .drift_service import check_balance_drift, open_discrepancies
 
+        summary = check_balance_drift(full=full)
         db.session.commit()
-        print("\nAll account balances have been recalculated and updated successfully.")
+        print(f"Checked {summary['checked']} accounts: {summary['drifted']} drifted, {summary['resolved']} resolved "
+              f"(watermark: posting {summary['watermark']}).")
+        for discrepancy in open_discrepancies():
+            print(f"Account '{discrepancy.account.name}' (ID: {discrepancy.account_id}): balance {discrepancy.cached_balance:.2f}, "
+                  f"ledger {discrepancy.ledger_balance:.2f}, difference {discrepancy.difference:+.2f}")
+
+    @app.cli.command("run-payouts")
+    @click.option('--start', 'start_date', type=click.DateTime(formats=['%Y-%m-%d']), required=True, help='First day of the period.')
+    @click.option('--end', 'end_date', type=click.DateTime(formats=['%Y-%m-%d']), required=True, help='Last day of the period.')
+    @click.option('--vat-rate', type=float, default=0.2, show_default=True)
+    @click.option('--payout-date', type=click.DateTime(formats=['%Y-%m-%d']), default=None, help='Date of the payout transactions (default: today).')
+    @click.option('--batch-size', type=int, default=None, help='Landlords paid per commit.')
+    def run_payouts_command(start_date, end_date, vat_rate, payout_date, batch_size):
+        """Pays out all landlords for a period, resuming the period's unfinished run if there is one."""
+        from .payout_service import start_payout_run, process_payout_run, PAYOUT_RUN_BATCH_SIZE
+
+        run = start_payout_run(start_date.date(), end_date.date(), vat_rate,
+                               payout_date=payout_date.date() if payout_date else None)
+        print(f"Payout run {run.id}: VAT rate {run.vat_rate}, payout date {run.payout_date}")
+        summary = process_payout_run(run, batch_size=batch_size or PAYOUT_RUN_BATCH_SIZE)
+        for figure in summary['paid']:
+            print(f"{figure['name']}: rent {figure['rent_income']:.2f}, expenses {figure['expenses']:.2f}, "
+                  f"commission {figure['commission']:.2f}, VAT {figure['vat']:.2f}, payout {figure['payout']:.2f}")
+        for figure in summary['skipped']:
+            print(f"Not paid {figure['name']}: {figure['reason'] or figure['status']}")
+        totals = summary['totals']
+        print(f"\nPaid {len(summary['paid'])} landlords {totals['payout']:.2f} in total "
+              f"(commission {totals['commission']:.2f}, VAT {totals['vat']:.2f}) in {summary['seconds']:.2f}s.")
+
+    @app.cli.command("export-bank-file")
+    @click.option('--run-id', type=int, required=True, help='Id of a completed payout run.')
+    @click.option('--output', type=click.Path(dir_okay=False, writable=True), default=None, help='File to write (default: payout_run_<id>.csv).')
+    def export_bank_file_command(run_id, output):
+        """Writes the bank payment file for a completed payout run."""
+        from .models import PayoutRun
+        from .payout_service import stream_bank_file, bank_file_exceptions
+
+        run = db.session.get(PayoutRun, run_id)
+        if run is None or run.status != 'complete':
+            print(f"Payout run {run_id} not found or not complete.")
+            return
+        output = output or f'payout_run_{run.id}.csv'
+        with open(output, 'w', newline='') as f:
+            for chunk in stream_bank_file(run):
+                f.write(chunk)
+        for name, amount in bank_file_exceptions(run):
+            print(f"Left out {name} ({amount:.2f}): no valid bank details")
+        print(f"Bank file written to {output}")
+
+    @app.cli.command("generate-statements")
+    @click.option('--type', 'statement_type', type=click.Choice(['monthly', 'annual', 'tenant']), default='monthly', show_default=True)
+    @click.option('--start', 'start_date', type=click.DateTime(formats=['%Y-%m-%d']), default=None, help='First day of the period (monthly and tenant).')
+    @click.option('--end', 'end_date', type=click.DateTime(formats=['%Y-%m-%d']), default=None, help='Last day of the period (monthly and tenant).')
+    @click.option('--year', type=int, default=None, help='Year of annual statements.')
+    @click.option('--vat-rate', type=float, default=0.2, show_default=True)
+    @click.option('--workers', type=int, default=None, help='Processes rendering PDFs (default: STATEMENT_WORKERS).')
+    def generate_statements_command(statement_type, start_date, end_date, year, vat_rate, workers):
+        """Generates statements for every landlord, or every current tenant, in one batch."""
+        from .statement_generator import generate_statement_batch, statement_batch_messages
+
+        if statement_type == 'annual' and not year:
+            print("--year is required for annual statements.")
+            return
+        if statement_type != 'annual' and not (start_date and end_date):
+            print("--start and --end are required for monthly and tenant statements.")
+            return
+        report = generate_statement_batch(
+            statement_type,
+            start_date=start_date.date() if start_date else None,
+            end_date=end_date.date() if end_date else None,
+            vat_rate=vat_rate,
+            year=year,
+            workers=workers or app.config['STATEMENT_WORKERS']
+        )
+        for message in statement_batch_messages(report):
+            print(message)
+
+    @app.cli.command("run-worker")
+    @click.option('--poll-interval', type=float, default=None, help='Seconds to wait when the queue is empty.')
+    @click.option('--once', is_flag=True, help='Exit once the queue is empty.')
+    def run_worker_command(poll_interval, once):
+        """Runs a background job worker. Start several to process jobs in parallel."""
+        from .job_service import run_worker
+        run_worker(
+            poll_interval=poll_interval or app.config['JOB_POLL_INTERVAL'],
+            stale_after=app.config['JOB_STALE_AFTER'],
+            once=once
+        )
 
     return app
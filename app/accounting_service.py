@@ -1,29 +1,350 @@
+import logging
+from datetime import date
+from sqlalchemy import case, insert, or_, type_coerce, update
+from sqlalchemy.orm import joinedload
 from app import db
-from app.models import Account, Tenant, Landlord, Property, Transaction, AuditLog
+from app.models import Account, Tenant, Landlord, Property, Transaction, Posting, AuditLog, debit_amount, journal_imbalance, mark_ledger_changed
+from app.money import Money
+from app import money, system_accounts
+from app.metrics import timed
 
+logger = logging.getLogger(__name__)
+
+@timed('recalculate_balances')
+def recalculate_balances(account_ids=None, dry_run=False):
+    """
+    Checks cached account balances against the ledger and against the
+    transactions table, with grouped SUMs instead of querying per account.
+    Returns a list of dicts (id, name, old, new, delta, transactions) for
+    the accounts whose cached balance does not match the sum of their
+    postings, or whose postings disagree with their transactions
+    (transactions is None for accounts kept from postings only). Unless
+    dry_run, mismatched cached balances are set to the ledger figure in one
+    bulk UPDATE. Neither the ledger nor the transactions are adjusted. Does
+    not commit.
+    """
+    query = db.session.query(Account.id, Account.name, Account.balance, Account.type, Account.tenant_id, Account.landlord_id)
+    if account_ids is not None:
+        query = query.filter(Account.id.in_(account_ids))
+    accounts = query.order_by(Account.id).all()
+    ledger_sums = ledger_balances(None if account_ids is None else [account.id for account in accounts])
+    transaction_sums = transaction_balances(accounts, every_account=account_ids is None)
+
+    changes = []
+    disagreements = 0
+    for account in accounts:
+        balance = ledger_sums.get(account.id, 0.0)
+        transactions = transaction_sums.get(account.id)
+        stale = account.balance is None or abs(balance - account.balance) > 1e-9
+        disagrees = transactions is not None and abs(balance - transactions) > 1e-9
+        if disagrees:
+            disagreements += 1
+            logger.warning(f"Account {account.id} ({account.name}): ledger {balance:.2f} but transactions {transactions:.2f}")
+        if stale or disagrees:
+            changes.append({'id': account.id, 'name': account.name, 'old': account.balance, 'new': balance,
+                            'delta': money.round_money(balance - (account.balance or 0.0)), 'transactions': transactions})
+
+    stale_changes = [change for change in changes if change['delta'] or change['old'] is None]
+    if stale_changes and not dry_run:
+        db.session.execute(update(Account), [{'id': change['id'], 'balance': change['new']} for change in stale_changes])
+        # Bulk updates by primary key leave loaded objects alone.
+        changed_ids = {change['id'] for change in stale_changes}
+        for obj in list(db.session.identity_map.values()):
+            if isinstance(obj, Account) and obj.id in changed_ids:
+                db.session.expire(obj, ['balance'])
+    logger.info(f"recalculate_balances accounts={len(accounts)} mismatched={len(stale_changes)} "
+                f"disagreeing={disagreements} dry_run={dry_run}")
+    return changes
+
+def ledger_balance(account_id, as_of=None):
+    """The sum of the account's postings, dated before as_of if given."""
+    query = db.session.query(db.func.sum(Posting.amount)).filter(Posting.account_id == account_id)
+    if as_of is not None:
+        query = query.filter(Posting.date < as_of)
+    return query.scalar() or 0.0
+
+def ledger_balances(account_ids=None, as_of=None):
+    """ledger_balance for many accounts (every account with None) in one grouped query: {account_id: balance}."""
+    query = db.session.query(Posting.account_id, db.func.sum(Posting.amount))
+    if account_ids is not None:
+        if not account_ids:
+            return {}
+        query = query.filter(Posting.account_id.in_(account_ids))
+    if as_of is not None:
+        query = query.filter(Posting.date < as_of)
+    return {account_id: total or 0.0 for account_id, total in query.group_by(Posting.account_id)}
+
+# Accounts whose lines are all the other side of someone else's transaction
+POSTINGS_ONLY_TYPES = ('clearing', 'suspense')
+
+def transaction_balances(accounts, every_account=False):
+    """
+    The balances of accounts worked out from the transactions table, as they
+    were before the posting ledger, with one grouped SUM per kind of account:
+    a tenant's rent charges and rent (on the tenant's first account), a
+    landlord's transactions less commission taken from rent, payments out
+    counted negative (on the landlord's first account), and the coded
+    transactions posted to any other account. accounts are rows with id,
+    type, tenant_id and landlord_id; every_account skips the IN filters when
+    they are all of them. Returns {account_id: balance}, leaving out clearing
+    and suspense accounts.
+    """
+    def owned_by(column, ids):
+        return column.isnot(None) if every_account else column.in_(ids)
+
+    balances = {}
+    tenant_ids = {account.tenant_id for account in accounts if account.tenant_id}
+    if tenant_ids:
+        first = dict(db.session.query(Account.tenant_id, db.func.min(Account.id)).filter(
+            owned_by(Account.tenant_id, tenant_ids)).group_by(Account.tenant_id))
+        balances.update({account_id: 0.0 for account_id in first.values()})
+        sums = db.session.query(Transaction.tenant_id, db.func.sum(Transaction.amount)).filter(
+            owned_by(Transaction.tenant_id, tenant_ids), Transaction.category.in_(('rent_charge', 'rent'))
+        ).group_by(Transaction.tenant_id)
+        for tenant_id, total in sums:
+            if tenant_id in first:
+                balances[first[tenant_id]] = total or 0.0
+
+    landlord_ids = {account.landlord_id for account in accounts if account.landlord_id}
+    if landlord_ids:
+        first = dict(db.session.query(Account.landlord_id, db.func.min(Account.id)).filter(
+            owned_by(Account.landlord_id, landlord_ids)).group_by(Account.landlord_id))
+        balances.update({account_id: 0.0 for account_id in first.values()})
+        amount = type_coerce(case((Transaction.category == 'payment', -db.func.abs(Transaction.amount)),
+                                  else_=Transaction.amount), Money)
+        is_commission = (Transaction.category == 'fee') & Transaction.parent_transaction_id.isnot(None)
+        sums = db.session.query(Transaction.landlord_id, db.func.sum(amount)).filter(
+            owned_by(Transaction.landlord_id, landlord_ids), or_(Transaction.category.is_(None), ~is_commission)
+        ).group_by(Transaction.landlord_id)
+        for landlord_id, total in sums:
+            if landlord_id in first:
+                balances[first[landlord_id]] = total or 0.0
+
+    other_ids = [account.id for account in accounts
+                 if not account.tenant_id and not account.landlord_id and account.type not in POSTINGS_ONLY_TYPES]
+    if other_ids:
+        balances.update({account_id: 0.0 for account_id in other_ids})
+        sums = db.session.query(Transaction.account_id, db.func.sum(Transaction.amount)).filter(
+            Transaction.account_id.in_(other_ids), db.func.coalesce(Transaction.status, 'uncoded') != 'uncoded'
+        ).group_by(Transaction.account_id)
+        balances.update({account_id: total or 0.0 for account_id, total in sums})
+    wanted = {account.id for account in accounts}
+    return {account_id: balance for account_id, balance in balances.items() if account_id in wanted}
+
+def ledger_postings(account_id, start_date=None, end_date=None):
+    """The account's postings between two dates (inclusive), oldest first, with their transactions loaded."""
+    query = Posting.query.options(joinedload(Posting.transaction)).filter(Posting.account_id == account_id)
+    if start_date is not None:
+        query = query.filter(Posting.date >= start_date)
+    if end_date is not None:
+        query = query.filter(Posting.date <= end_date)
+    return query.order_by(Posting.date, Posting.id).all()
+
+def reverse_postings(transaction, description=None):
+    """
+    Posts, against the same transaction, the reversal of what a journal
+    entry has moved on each account, so the ledger and balances no longer
+    include it. The reversal balances as the entry did. Does not commit.
+    """
+    description = description or f'Deleted transaction {transaction.id}'
+    nets = {}
+    for posting in transaction.postings:
+        nets[posting.account] = nets.get(posting.account, 0.0) + posting.amount
+    for account, net in nets.items():
+        net = money.round_money(net)
+        if net:
+            account.update_balance(-net, transaction, description=description)
+
+def balance_postings(postings):
+    """
+    The bulk-insert counterpart of the balance_journal_entries listener:
+    postings are dicts ready for insert(Posting). Each transaction whose
+    lines have unequal debits and credits is logged and gets a Suspense
+    Account line for the difference. Returns the postings with those lines
+    appended.
+    """
+    account_ids = {posting['account_id'] for posting in postings}
+    types = dict(db.session.query(Account.id, Account.type).filter(Account.id.in_(account_ids))) if account_ids else {}
+    entries = {}
+    for posting in postings:
+        entries.setdefault(posting['transaction_id'], []).append(posting)
+    balancing = []
+    suspense = None
+    for lines in entries.values():
+        imbalance = journal_imbalance((types.get(line['account_id']), line['amount']) for line in lines)
+        if not imbalance:
+            continue
+        suspense = suspense or system_accounts.suspense_account()
+        if suspense is None:
+            logger.error(f"Journal entry '{lines[0]['description']}' does not balance by {imbalance:.2f} and there is no Suspense Account")
+            continue
+        logger.warning(f"Journal entry '{lines[0]['description']}' does not balance by {imbalance:.2f}; "
+                       f"posting the difference to {suspense.name}")
+        amount = debit_amount(suspense.type, -imbalance)
+        suspense.adjust_balance(amount)
+        balancing.append(dict(lines[0], account_id=suspense.id, amount=amount))
+    return postings + balancing
+
+def recalculate_account_balance(account):
+    """Recomputes one account's cached balance from the ledger without committing."""
+    recalculate_balances([account.id])
+    return account.balance
+
+class _SessionLedger:
+    """
+    Looks entities up as allocate_transaction needs them and applies balance
+    changes and child transactions to the session straight away.
+    """
+
+    def __init__(self):
+        self.bank_account = system_accounts.bank_account()
+        self.suspense_account = system_accounts.suspense_account()
+        self.agency_income_account = system_accounts.agency_income_account()
+        self.agency_expense_account = system_accounts.agency_expense_account()
+        self.rent_clearing_account = system_accounts.rent_clearing_account()
+
+    def tenant(self, tenant_id):
+        return Tenant.query.get(tenant_id)
+
+    def tenant_account(self, tenant_id):
+        return Account.query.filter_by(tenant_id=tenant_id).first()
+
+    def landlord_account(self, landlord_id):
+        return Account.query.filter_by(landlord_id=landlord_id).first()
+
+    def account(self, account_id):
+        return Account.query.get(account_id)
+
+    def credit(self, account, amount, transaction):
+        account.update_balance(amount, transaction)
+
+    def add_child(self, **fields):
+        db.session.add(Transaction(**fields))
+
+class _BatchLedger(_SessionLedger):
+    """
+    Serves allocate_transactions from entities preloaded with a few IN
+    queries, and collects child transactions and postings so they can be
+    written in bulk by apply(). Balance changes are summed per account by
+    Account.adjust_balance and written at the next flush.
+    """
+
+    def __init__(self, transactions):
+        super().__init__()
+        tenant_ids = {int(t.tenant_id) for t in transactions if t.tenant_id}
+        self._tenants = {tenant.id: tenant for tenant in Tenant.query.filter(Tenant.id.in_(tenant_ids))} if tenant_ids else {}
+
+        property_ids = {tenant.property_id for tenant in self._tenants.values() if tenant.property_id}
+        self._properties = {p.id: p for p in Property.query.filter(Property.id.in_(property_ids))} if property_ids else {}
+
+        landlord_ids = {p.landlord_id for p in self._properties.values() if p.landlord_id}
+        landlord_ids.update(int(t.landlord_id) for t in transactions if t.landlord_id)
+        # Loaded so tenant.property.landlord resolves from the identity map.
+        self._landlords = {l.id: l for l in Landlord.query.filter(Landlord.id.in_(landlord_ids))} if landlord_ids else {}
+
+        # Same pick as .first() on the single-row path: the lowest id per owner.
+        self._tenant_accounts = {}
+        self._landlord_accounts = {}
+        if tenant_ids or landlord_ids:
+            owners = []
+            if tenant_ids:
+                owners.append(Account.tenant_id.in_(tenant_ids))
+            if landlord_ids:
+                owners.append(Account.landlord_id.in_(landlord_ids))
+            for account in Account.query.filter(db.or_(*owners)).order_by(Account.id.desc()):
+                if account.tenant_id in tenant_ids:
+                    self._tenant_accounts[account.tenant_id] = account
+                if account.landlord_id in landlord_ids:
+                    self._landlord_accounts[account.landlord_id] = account
+
+        account_ids = {p.utility_account_id for p in self._properties.values() if p.utility_account_id}
+        self._accounts = {a.id: a for a in Account.query.filter(Account.id.in_(account_ids))} if account_ids else {}
+
+        self.children = []
+        self.postings = []
+
+    def tenant(self, tenant_id):
+        return self._tenants.get(int(tenant_id))
+
+    def tenant_account(self, tenant_id):
+        return self._tenant_accounts.get(int(tenant_id))
+
+    def landlord_account(self, landlord_id):
+        return self._landlord_accounts.get(int(landlord_id))
+
+    def account(self, account_id):
+        return self._accounts.get(account_id)
+
+    def credit(self, account, amount, transaction):
+        account.adjust_balance(amount)
+        self.postings.append({'transaction_id': transaction.id, 'account_id': account.id, 'amount': amount,
+                              'date': transaction.date or date.today(), 'description': transaction.description})
+
+    def add_child(self, **fields):
+        self.children.append(fields)
+
+    def apply(self):
+        if self.children:
+            db.session.execute(insert(Transaction), self.children)
+            mark_ledger_changed(db.session)
+        if self.postings:
+            db.session.execute(insert(Posting), balance_postings(self.postings))
+
+@timed('allocate_transaction')
 def allocate_transaction(transaction):
+    # Lookups must not flush half of the entry's postings, or it would be balanced in parts.
+    with db.session.no_autoflush:
+        _allocate(transaction, _SessionLedger())
+
+@timed('allocate_transactions')
+def allocate_transactions(transactions):
+    """
+    Allocates many transactions with the same per-transaction result as
+    allocate_transaction. Entities are preloaded in a few IN queries,
+    child transactions are bulk-inserted and each touched account gets one
+    balance UPDATE. Returns {transaction: error message} for transactions
+    that raised; their balance changes up to the error are kept, as with
+    allocate_transaction. Does not commit.
+    """
+    if not transactions:
+        return {}
+    # Child transactions need their parent's id, so pending changes are written first.
+    db.session.flush()
+    ledger = _BatchLedger(transactions)
+    errors = {}
+    for transaction in transactions:
+        try:
+            _allocate(transaction, ledger)
+        except Exception as e:
+            errors[transaction] = str(e)
+    ledger.apply()
+    return errors
+
+def _allocate(transaction, ledger):
     # For rent charges, only update the tenant account and do not affect the bank account
     if transaction.category == 'rent_charge' and transaction.tenant_id:
-        tenant_account = Account.query.filter_by(tenant_id=transaction.tenant_id).first()
+        tenant_account = ledger.tenant_account(transaction.tenant_id)
         if tenant_account:
-            tenant_account.update_balance(-abs(transaction.amount))
+            # The tenant owes the rent (debit) until it is received and passed on from Rent Clearing (credit).
+            ledger.credit(tenant_account, -abs(transaction.amount), transaction)
+            if ledger.rent_clearing_account:
+                ledger.credit(ledger.rent_clearing_account, abs(transaction.amount), transaction)
             transaction.status = 'allocated'
         # A rent charge is between the agency and the tenant. It doesn't affect the landlord's balance until the rent is paid.
         # It also doesn't affect the bank account.
         return
 
-    bank_account = Account.query.filter_by(name='Master Bank Account').first()
-    suspense_account = Account.query.filter_by(name='Suspense Account').first()
-    agency_income_account = Account.query.filter_by(name='Agency Income').first()
-    agency_expense_account = Account.query.filter_by(name='Agency Expense').first()
+    bank_account = ledger.bank_account
+    suspense_account = ledger.suspense_account
+    agency_income_account = ledger.agency_income_account
+    agency_expense_account = ledger.agency_expense_account
 
-    print(f"--- allocate_transaction called for transaction {transaction.id} ---")
-    print(f"Initial: status={transaction.status}, account_id={transaction.account_id}, amount={transaction.amount}, category={transaction.category}")
-    print(f"Bank Account ID: {bank_account.id if bank_account else 'None'}")
-    print(f"Suspense Account ID: {suspense_account.id if suspense_account else 'None'}")
+    logger.debug(f"allocate transaction_id={transaction.id} status={transaction.status} account_id={transaction.account_id} "
+                 f"amount={transaction.amount} category={transaction.category} "
+                 f"bank_account_id={bank_account.id if bank_account else None} suspense_account_id={suspense_account.id if suspense_account else None}")
 
     if not all([bank_account, agency_income_account, agency_expense_account]):
-        print("Missing required system accounts.")
+        logger.warning(f"allocate transaction_id={transaction.id} skipped: missing required system accounts")
         return
 
     # All transactions, whether coded or uncoded, should always be linked to the bank account for display.
@@ -31,7 +352,7 @@ def allocate_transaction(transaction):
 
     # Update bank account balance for all transactions that flow through it
     if bank_account:
-        bank_account.update_balance(transaction.amount)
+        ledger.credit(bank_account, transaction.amount, transaction)
         
 
     # If transaction is not yet coded, it remains linked to the bank account but is marked 'uncoded'.
@@ -48,56 +369,58 @@ def allocate_transaction(transaction):
     
 
     if transaction.category == 'rent' and transaction.tenant_id:
-        tenant = Tenant.query.get(transaction.tenant_id)
+        tenant = ledger.tenant(transaction.tenant_id)
         if not tenant:
             pass
             return
-        tenant_account = Account.query.filter_by(tenant_id=tenant.id).first()
+        tenant_account = ledger.tenant_account(tenant.id)
         if not tenant_account:
             pass
             return
 
         # Tenant's account is always credited with the full rent amount to clear their balance.
-        tenant_account.update_balance(transaction.amount)
+        ledger.credit(tenant_account, transaction.amount, transaction)
 
         property_ = tenant.property
         if not property_:
             pass
             return
         landlord = property_.landlord
-        landlord_account = Account.query.filter_by(landlord_id=landlord.id).first()
+        landlord_account = ledger.landlord_account(landlord.id)
         if not landlord_account:
-            print(f"No account found for landlord {landlord.name}")
+            logger.warning(f"allocate transaction_id={transaction.id} skipped: no account for landlord_id={landlord.id}")
             return
 
+        # The rent received is passed on from Rent Clearing (debit) to the landlord, utilities and commission (credits) below.
+        if ledger.rent_clearing_account:
+            ledger.credit(ledger.rent_clearing_account, -transaction.amount, transaction)
+
         # Check for and apply utility split
         if property_.landlord_portion and property_.landlord_portion < 1.0 and property_.utility_account_id:
-            utility_account = Account.query.get(property_.utility_account_id)
+            utility_account = ledger.account(property_.utility_account_id)
             if utility_account:
-                landlord_share = transaction.amount * property_.landlord_portion
-                utility_share = transaction.amount * (1 - property_.landlord_portion)
+                landlord_share, utility_share = money.split(transaction.amount, [property_.landlord_portion, 1 - property_.landlord_portion])
 
-                landlord_account.update_balance(landlord_share)
-                utility_account.update_balance(utility_share)
+                ledger.credit(landlord_account, landlord_share, transaction)
+                ledger.credit(utility_account, utility_share, transaction)
 
                 # Create child transactions for ledger clarity
-                landlord_tx = Transaction(
+                ledger.add_child(
                     date=transaction.date, amount=landlord_share, description=f"Landlord share of rent from {tenant.name}",
                     category='rent_landlord_share', landlord_id=landlord.id, parent_transaction_id=transaction.id,
                     status='allocated', account_id=landlord_account.id, reference_code=transaction.reference_code
                 )
-                utility_tx = Transaction(
+                ledger.add_child(
                     date=transaction.date, amount=utility_share, description=f"Utility share of rent from {tenant.name}",
                     category='rent_utility_share', account_id=utility_account.id, parent_transaction_id=transaction.id,
                     status='allocated', reference_code=transaction.reference_code
                 )
-                db.session.add_all([landlord_tx, utility_tx])
                 
                 transaction.status = 'split' # Mark original transaction as split
                 
             else:
                 # Fallback if utility account is not found, treat as no split
-                landlord_account.update_balance(transaction.amount)
+                ledger.credit(landlord_account, transaction.amount, transaction)
                 transaction.landlord_id = landlord.id
                 transaction.account_id = landlord_account.id
         else:
@@ -105,62 +428,60 @@ def allocate_transaction(transaction):
             commission_rate = landlord.commission_rate or 0.0
             
             if commission_rate > 0:
-                commission = transaction.amount * commission_rate
-                landlord_share = transaction.amount - commission
+                landlord_share, commission = money.split(transaction.amount, [1 - commission_rate, commission_rate])
                 
                 # Update landlord account with their share
-                landlord_account.update_balance(landlord_share)
+                ledger.credit(landlord_account, landlord_share, transaction)
                 
                 # Update agency income account with commission
-                agency_income_account.update_balance(commission)
+                ledger.credit(agency_income_account, commission, transaction)
                 
                 # Create child transactions for ledger clarity
-                landlord_tx = Transaction(
+                ledger.add_child(
                     date=transaction.date, amount=landlord_share, description=f"Landlord share of rent from {tenant.name}",
                     category='rent_landlord_share', landlord_id=landlord.id, parent_transaction_id=transaction.id,
                     status='allocated', account_id=landlord_account.id, reference_code=transaction.reference_code
                 )
-                agency_tx = Transaction(
+                ledger.add_child(
                     date=transaction.date, amount=commission, description=f"Commission from {tenant.name}'s rent",
                     category='fee', landlord_id=landlord.id, parent_transaction_id=transaction.id,
                     status='allocated', account_id=agency_income_account.id, reference_code=transaction.reference_code
                 )
-                db.session.add_all([landlord_tx, agency_tx])
                 
                 transaction.status = 'split' # Mark original transaction as split
             else:
                 # No commission, full amount to landlord
-                landlord_account.update_balance(transaction.amount)
+                ledger.credit(landlord_account, transaction.amount, transaction)
                 transaction.landlord_id = landlord.id # Associate transaction directly with landlord
 
         
 
     elif transaction.category == 'expense' and transaction.landlord_id:
-        landlord_account = Account.query.filter_by(landlord_id=transaction.landlord_id).first()
+        landlord_account = ledger.landlord_account(transaction.landlord_id)
         if not landlord_account:
-            print(f"No account found for landlord {landlord.name}")
+            logger.warning(f"allocate transaction_id={transaction.id} skipped: no account for landlord_id={transaction.landlord_id}")
             return
-        print(f"Landlord account balance BEFORE expense: {landlord_account.balance:.2f}")
-        landlord_account.update_balance(transaction.amount) # transaction.amount is already negative for expenses
-        print(f"Landlord account balance AFTER expense: {landlord_account.balance:.2f}")
-        print(f"Transaction {transaction.id}: Expense. Landlord account updated.")
+        balance_before = landlord_account.balance or 0.0
+        ledger.credit(landlord_account, transaction.amount, transaction) # transaction.amount is already negative for expenses
+        logger.debug(f"allocate transaction_id={transaction.id} expense landlord_account_id={landlord_account.id} "
+                     f"balance_before={balance_before:.2f} balance_after={landlord_account.balance:.2f}")
 
     elif transaction.category == 'payment' and transaction.landlord_id:
-        landlord_account = Account.query.filter_by(landlord_id=transaction.landlord_id).first()
+        landlord_account = ledger.landlord_account(transaction.landlord_id)
         if not landlord_account:
-            print(f"No account found for landlord {landlord.name}")
+            logger.warning(f"allocate transaction_id={transaction.id} skipped: no account for landlord_id={transaction.landlord_id}")
             return
-        print(f"Landlord account balance BEFORE payment: {landlord_account.balance:.2f}")
-        landlord_account.update_balance(-abs(transaction.amount)) # Payment to landlord reduces their balance
-        print(f"Landlord account balance AFTER payment: {landlord_account.balance:.2f}")
-        print(f"Transaction {transaction.id}: Landlord payment. Landlord account updated.")
+        balance_before = landlord_account.balance or 0.0
+        ledger.credit(landlord_account, -abs(transaction.amount), transaction) # Payment to landlord reduces their balance
+        logger.debug(f"allocate transaction_id={transaction.id} payment landlord_account_id={landlord_account.id} "
+                     f"balance_before={balance_before:.2f} balance_after={landlord_account.balance:.2f}")
 
     elif transaction.category == 'payout' and transaction.landlord_id:
-        landlord_account = Account.query.filter_by(landlord_id=transaction.landlord_id).first()
+        landlord_account = ledger.landlord_account(transaction.landlord_id)
         if not landlord_account:
             pass
             return
-        landlord_account.update_balance(transaction.amount)
+        ledger.credit(landlord_account, transaction.amount, transaction)
 
     # Mark transaction as allocated
     transaction.status = 'allocated'
@@ -0,0 +1,113 @@
+import logging
+from datetime import datetime
+from app import db
+from app.models import Account, AccountLedgerCheckpoint, BalanceDiscrepancy, DataVersion, Posting
+from app.money import round_money
+
+logger = logging.getLogger(__name__)
+
+WATERMARK = 'balance_drift_watermark'  # DataVersion row holding the last posting id checked
+TOLERANCE = 0.005  # Differences below half a penny are float noise
+LATE_COMMIT_WINDOW = 1000  # Postings below the newest that each check re-scans
+
+def drift_watermark():
+    row = db.session.get(DataVersion, WATERMARK)
+    return row.version if row else 0
+
+def _set_watermark(posting_id):
+    row = db.session.get(DataVersion, WATERMARK)
+    if row is None:
+        row = DataVersion(name=WATERMARK, version=0)
+        db.session.add(row)
+    row.version = posting_id
+    row.updated_at = datetime.utcnow()
+
+def reset_drift_checks():
+    """Forgets the watermark and ledger checkpoints, for when the postings are wiped. Does not commit."""
+    AccountLedgerCheckpoint.query.delete()
+    DataVersion.query.filter_by(name=WATERMARK).delete()
+
+def check_balance_drift(full=False):
+    """
+    Compares Account.balance with the sum of the account's postings for every
+    account posted to since the watermark (all accounts with full), records
+    or updates a BalanceDiscrepancy for each mismatch and resolves open ones
+    that balance again. Each account's AccountLedgerCheckpoint holds the
+    verified sum up to a posting id, so only newer postings are summed; full
+    recomputes the sums from scratch. The last LATE_COMMIT_WINDOW postings are
+    never folded into a checkpoint and are re-scanned on every check, so
+    postings from a transaction that committed after one with higher ids are
+    still counted. Returns a summary dict. Does not commit.
+    """
+    watermark = 0 if full else drift_watermark()
+    high = db.session.query(db.func.max(Posting.id)).scalar() or 0
+    settled = max(high - LATE_COMMIT_WINDOW, 0)
+    if full:
+        account_ids = None
+    else:
+        touched = db.session.query(Posting.account_id).filter(
+            Posting.id > max(watermark - LATE_COMMIT_WINDOW, 0), Posting.id <= high).distinct()
+        # Open discrepancies are rechecked too, so fixes made outside the ledger resolve them.
+        still_open = db.session.query(BalanceDiscrepancy.account_id).filter(BalanceDiscrepancy.resolved_at.is_(None))
+        account_ids = {account_id for account_id, in touched.union(still_open)}
+
+    query = db.session.query(Account.id, Account.balance)
+    ledger = db.session.query(
+        Posting.account_id, db.func.sum(Posting.amount),
+        db.func.sum(db.case((Posting.id <= settled, Posting.amount), else_=0))
+    ).outerjoin(AccountLedgerCheckpoint, AccountLedgerCheckpoint.account_id == Posting.account_id).filter(Posting.id <= high)
+    checkpoints = AccountLedgerCheckpoint.query
+    if account_ids is not None:
+        if not account_ids:
+            _set_watermark(high)
+            return {'checked': 0, 'drifted': 0, 'resolved': 0, 'watermark': high}
+        query = query.filter(Account.id.in_(account_ids))
+        ledger = ledger.filter(Posting.account_id.in_(account_ids))
+        checkpoints = checkpoints.filter(AccountLedgerCheckpoint.account_id.in_(account_ids))
+    if not full:
+        ledger = ledger.filter(Posting.id > db.func.coalesce(AccountLedgerCheckpoint.posting_id, 0))
+    ledger_sums = {account_id: (newer, newer_settled) for account_id, newer, newer_settled in ledger.group_by(Posting.account_id)}
+    checkpoints = {checkpoint.account_id: checkpoint for checkpoint in checkpoints}
+    open_rows = {row.account_id: row for row in BalanceDiscrepancy.query.filter(
+        BalanceDiscrepancy.resolved_at.is_(None),
+        *([BalanceDiscrepancy.account_id.in_(account_ids)] if account_ids is not None else [])
+    )}
+
+    now = datetime.utcnow()
+    checked = drifted = resolved = 0
+    for account_id, balance in query:
+        checked += 1
+        checkpoint = checkpoints.get(account_id)
+        if checkpoint is None:
+            checkpoint = AccountLedgerCheckpoint(account_id=account_id, posting_id=0, ledger_sum=0.0)
+            db.session.add(checkpoint)
+        base = 0.0 if full else (checkpoint.ledger_sum or 0.0)
+        newer, newer_settled = ledger_sums.get(account_id, (0.0, 0.0))
+        ledger_balance = round_money(base + (newer or 0.0))
+        if full or settled > (checkpoint.posting_id or 0):
+            checkpoint.ledger_sum = round_money(base + (newer_settled or 0.0))
+            checkpoint.posting_id = settled
+        checkpoint.checked_at = now
+
+        difference = (balance or 0.0) - ledger_balance
+        row = open_rows.get(account_id)
+        if abs(difference) < TOLERANCE:
+            if row is not None:
+                row.resolved_at = now
+                row.checked_at = now
+                resolved += 1
+            continue
+        drifted += 1
+        if row is None:
+            row = BalanceDiscrepancy(account_id=account_id, detected_at=now)
+            db.session.add(row)
+        row.cached_balance = balance
+        row.ledger_balance = ledger_balance
+        row.difference = difference
+        row.checked_at = now
+    _set_watermark(high)
+    logger.info(f"Balance drift check: {checked} accounts checked, {drifted} drifted, {resolved} resolved, watermark {high}")
+    return {'checked': checked, 'drifted': drifted, 'resolved': resolved, 'watermark': high}
+
+def open_discrepancies():
+    return BalanceDiscrepancy.query.filter(BalanceDiscrepancy.resolved_at.is_(None)).order_by(BalanceDiscrepancy.detected_at).all()
@@ -78,6 +78,14 @@ class PayoutForm(FlaskForm):
     vat_rate = FloatField('VAT Rate', validators=[DataRequired(), NumberRange(min=0, max=1)], default=0.2)
     submit = SubmitField('Process Payout')
 
+class BulkPayoutForm(PayoutForm):
+    payout_date = DateField('Payout Date', validators=[DataRequired()], format='%Y-%m-%d')
+    submit = SubmitField('Pay All Landlords')
+
+class PayoutPreviewForm(PayoutForm):
+    landlord_id = SelectField('Landlord', coerce=int, default=0)  # 0 previews all landlords
+    submit = SubmitField('Preview')
+
 class StatementGenerationForm(FlaskForm):
     landlord_id = SelectField('Landlord', coerce=int, validators=[DataRequired()])
     statement_type = SelectField('Statement Type', choices=[('monthly', 'Monthly'), ('annual', 'Annual')], validators=[DataRequired()])
@@ -87,6 +95,13 @@ class StatementGenerationForm(FlaskForm):
     vat_rate = FloatField('VAT Rate', validators=[DataRequired(), NumberRange(min=0, max=1)], default=0.2)
     submit = SubmitField('Generate Statement')
 
+class StatementBatchForm(FlaskForm):
+    statement_type = SelectField('Statement Type', choices=[('monthly', 'Monthly landlord statements'), ('annual', 'Annual landlord statements'), ('tenant', 'Tenant statements')], validators=[DataRequired()])
+    start_date = DateField('Start Date', format='%Y-%m-%d', validators=[Optional()])
+    end_date = DateField('End Date', format='%Y-%m-%d', validators=[Optional()])
+    year = StringField('Year', validators=[Optional(), Regexp(r'^\d{4}$', message='Enter a four digit year.')])
+    vat_rate = FloatField('VAT Rate', validators=[DataRequired(), NumberRange(min=0, max=1)], default=0.2)
+    submit = SubmitField('Generate All Statements')
 
 class AddTenantForm(FlaskForm):
     name = StringField('Name', validators=[DataRequired()])
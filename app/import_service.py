@@ -0,0 +1,260 @@
+import hashlib
+import logging
+import os
+import time
+from collections import Counter
+import pandas as pd
+from sqlalchemy import insert, select
+from app import db
+from app.models import Transaction, ImportCheckpoint, mark_ledger_changed
+from app.accounting_service import allocate_transactions
+from app import system_accounts
+from app.metrics import timed
+from app.matching_service import MatchPool, MatchSnapshot, normalize_text
+
+logger = logging.getLogger(__name__)
+
+DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y')
+
+def _column(df, *names):
+    for name in names:
+        if name in df.columns:
+            return df[name]
+    return pd.Series([None] * len(df), index=df.index, dtype='object')
+
+def normalize_bank_frame(df):
+    """
+    Normalizes a raw bank export column by column into date, amount,
+    description and reference_code. Rows with a zero amount or an unreadable
+    date or amount are dropped. The original row number is kept in row_number.
+    """
+    raw_dates = _column(df, 'Date', 'date').astype('string')
+    dates = pd.to_datetime(raw_dates, format=DATE_FORMATS[0], errors='coerce')
+    for date_format in DATE_FORMATS[1:]:
+        dates = dates.fillna(pd.to_datetime(raw_dates, format=date_format, errors='coerce'))
+
+    amounts = pd.to_numeric(_column(df, 'Amount', 'amount'), errors='coerce')
+
+    frame = pd.DataFrame({
+        'row_number': df.index,
+        'date': dates,
+        'amount': amounts,
+        'description': _column(df, 'Memo', 'description').fillna('').astype(str),
+        'reference_code': _column(df, 'Subcategory', 'reference_code').fillna('').astype(str),
+    }, index=df.index)
+
+    frame = frame[frame['date'].notna() & frame['amount'].notna() & (frame['amount'] != 0)]
+    frame['date'] = frame['date'].dt.date
+    frame['amount'] = frame['amount'].astype(float)
+    return frame
+
+def fingerprint_frame(frame, account_id, occurrences):
+    """
+    Returns an import fingerprint per row: a SHA-256 of the account, date,
+    amount, normalized memo and reference, plus an occurrence number so that
+    genuine same-day duplicates within a file stay distinct. occurrences
+    carries the counts across chunks of the same file.
+    """
+    keys = (
+        str(account_id) + '|'
+        + frame['date'].astype(str) + '|'
+        + frame['amount'].map('{:.2f}'.format) + '|'
+        + frame['description'].map(normalize_text) + '|'
+        + frame['reference_code'].map(normalize_text)
+    )
+    numbers = []
+    for key in keys:
+        occurrences[key] += 1
+        numbers.append(occurrences[key])
+    return [
+        hashlib.sha256(f'{key}|{number}'.encode('utf-8')).hexdigest()
+        for key, number in zip(keys, numbers)
+    ]
+
+def existing_fingerprints(fingerprints):
+    if not fingerprints:
+        return set()
+    return set(db.session.scalars(
+        select(Transaction.import_fingerprint).where(Transaction.import_fingerprint.in_(fingerprints))
+    ))
+
+def file_hash(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _insert_transactions(rows):
+    return db.session.scalars(
+        insert(Transaction).returning(Transaction, sort_by_parameter_order=True), rows
+    ).all()
+
+def _import_frame(frame, bank_account, match_pool, messages, stats):
+    """
+    Matches, bulk-inserts and allocates one normalized chunk. Matching runs on
+    match_pool; the inserts and allocations stay in this process. Learned
+    match hits and misses are added to stats. Returns the inserted
+    transactions, how many of them matched and how many rows failed. If the
+    bulk insert fails the chunk is retried row by row, and only the rows
+    that fail are counted and reported.
+    """
+    records = list(frame.itertuples(index=False))
+    results = match_pool.match([(record.description, record.reference_code, record.amount) for record in records])
+
+    rows = []
+    matched_count = failed_count = 0
+    for record, (match_type, match_id, category, method) in zip(records, results):
+        row = {
+            'date': record.date,
+            'amount': record.amount,
+            'description': record.description,
+            'reference_code': record.reference_code,
+            'account_id': bank_account.id,
+            'import_fingerprint': record.import_fingerprint,
+            'status': 'uncoded',
+            'category': None,
+            'tenant_id': None,
+            'landlord_id': None,
+        }
+        if method == 'learned':
+            stats['learned_hits'] += 1
+        elif method != 'exact':
+            stats['learned_misses'] += 1
+        if match_type:
+            matched_count += 1
+            row['status'] = 'coded'
+            row['category'] = category
+            row['tenant_id' if match_type == 'tenant' else 'landlord_id'] = match_id
+        rows.append(row)
+
+    if not rows:
+        return [], matched_count, failed_count
+    try:
+        with db.session.begin_nested():
+            transactions = _insert_transactions(rows)
+    except Exception:
+        # Retry row by row so one bad row doesn't lose the rest of the chunk
+        transactions, inserted = [], []
+        for record, row in zip(records, rows):
+            try:
+                with db.session.begin_nested():
+                    transactions += _insert_transactions([row])
+                inserted.append(row)
+            except Exception as e:
+                messages.append(f"Error processing row {record.row_number}: {str(e)}")
+                failed_count += 1
+                if row['status'] == 'coded':
+                    matched_count -= 1
+        rows = inserted
+    if rows:
+        mark_ledger_changed(db.session)
+
+    errors = allocate_transactions([transaction for transaction in transactions if transaction.status == 'coded'])
+    for transaction, error in errors.items():
+        messages.append(f"Error allocating transaction {transaction.id}: {error}")
+        failed_count += 1
+    return transactions, matched_count, failed_count
+
+@timed('process_csv')
+def process_csv(file_path, chunk_size=None, progress=None, match_workers=1, raise_errors=False):
+    """
+    Imports a bank CSV. With chunk_size the file is streamed and committed
+    chunk by chunk; an ImportCheckpoint keyed by the file's hash records the
+    last committed row, so uploading the same file again resumes after it.
+    Rows whose import fingerprint is already stored (for example from an
+    overlapping earlier export) are skipped.
+    progress, if given, is called after each chunk with a dict of running
+    totals (rows_read, imported, matched, failed, learned_hits, learned_misses,
+    last_row) and the chunk's rows_per_second.
+    match_workers sets how many processes match rows; 1 matches in-process.
+    Errors are reported as messages; with raise_errors they raise ValueError
+    instead, after the checkpoint has recorded the failure.
+    """
+    messages = []
+    bank_account = system_accounts.bank_account()
+    if not bank_account:
+        error = 'Bank Account not found. Please create it in the accounts section.'
+        if raise_errors:
+            raise ValueError(error)
+        messages.append(error)
+        return messages
+
+    checkpoint_hash = file_hash(file_path)
+    checkpoint = ImportCheckpoint.query.filter_by(file_hash=checkpoint_hash).first()
+    if checkpoint and checkpoint.status == 'complete':
+        messages.append(f'This file has already been imported ({checkpoint.rows_imported} transactions).')
+        return messages
+    if not checkpoint:
+        checkpoint = ImportCheckpoint(file_hash=checkpoint_hash, filename=os.path.basename(file_path), last_row=-1, rows_imported=0)
+        db.session.add(checkpoint)
+        db.session.commit()
+    elif checkpoint.last_row >= 0:
+        messages.append(f'Resuming import after row {checkpoint.last_row}.')
+    checkpoint.status = 'in_progress'
+
+    stats = {'rows_read': 0, 'rows_skipped': 0, 'duplicates': 0, 'imported': 0, 'matched': 0, 'failed': 0,
+             'learned_hits': 0, 'learned_misses': 0}
+    occurrences = Counter()
+    started = time.perf_counter()
+    try:
+        if chunk_size:
+            chunks = pd.read_csv(file_path, chunksize=chunk_size)
+        else:
+            chunks = [pd.read_csv(file_path)]
+
+        with MatchPool(MatchSnapshot.build(), workers=match_workers or 1) as match_pool:
+            for chunk_number, df in enumerate(chunks, start=1):
+                chunk_started = time.perf_counter()
+                frame = normalize_bank_frame(df)
+                # Fingerprint rows before the resume cut-off too, so occurrence numbers stay stable.
+                frame['import_fingerprint'] = fingerprint_frame(frame, bank_account.id, occurrences)
+                df = df[df.index > checkpoint.last_row]
+                if df.empty:
+                    continue
+                frame = frame[frame['row_number'] > checkpoint.last_row]
+                valid_rows = len(frame)
+                frame = frame[~frame['import_fingerprint'].isin(existing_fingerprints(frame['import_fingerprint'].tolist()))]
+                transactions, matched, failed = _import_frame(frame, bank_account, match_pool, messages, stats)
+
+                checkpoint.last_row = int(df.index.max())
+                checkpoint.rows_imported += len(transactions)
+                db.session.commit()
+
+                stats['rows_read'] += len(df)
+                stats['rows_skipped'] += len(df) - valid_rows
+                stats['duplicates'] += valid_rows - len(frame)
+                stats['imported'] += len(transactions)
+                stats['matched'] += matched
+                stats['failed'] += failed
+                elapsed = time.perf_counter() - chunk_started
+                rows_per_second = len(df) / elapsed if elapsed else 0.0
+                logger.info(f"Import {checkpoint.filename} chunk {chunk_number}: rows {df.index.min()}-{checkpoint.last_row}, "
+                            f"{len(transactions)} imported, {valid_rows - len(frame)} duplicates, {rows_per_second:.0f} rows/s")
+                if progress:
+                    progress(dict(stats, last_row=checkpoint.last_row, rows_per_second=rows_per_second))
+
+        checkpoint.status = 'complete'
+        db.session.commit()
+
+        if stats['rows_skipped']:
+            messages.append(f"{stats['rows_skipped']} rows skipped (zero amount or unreadable date/amount).")
+        if stats['duplicates']:
+            messages.append(f"{stats['duplicates']} duplicate rows skipped (already imported).")
+        if stats['learned_hits'] or stats['learned_misses']:
+            messages.append(f"Learned matches: {stats['learned_hits']} hits, {stats['learned_misses']} misses.")
+        elapsed = time.perf_counter() - started
+        rate = f" ({stats['rows_read'] / elapsed:.0f} rows/s)" if elapsed and stats['rows_read'] else ''
+        messages.append(f"{stats['imported']} transactions processed successfully{rate}.")
+
+    except Exception as e:
+        db.session.rollback()
+        checkpoint.status = 'failed'
+        checkpoint.error = str(e)
+        db.session.commit()
+        error = f'Error processing CSV after row {checkpoint.last_row}: {str(e)}. Upload the same file again to resume.'
+        if raise_errors:
+            raise ValueError(error) from e
+        messages.append(error)
+
+    return messages
@@ -0,0 +1,155 @@
+import json
+import logging
+import os
+import socket
+import time
+from datetime import date, datetime, timedelta
+from sqlalchemy import update
+from app import db
+from app.models import Job
+from app.accounting_service import recalculate_account_balance
+from app import system_accounts
+
+logger = logging.getLogger(__name__)
+
+JOB_HANDLERS = {}
+
+def job_handler(job_type):
+    """Registers a function(job, payload) as the handler for a job type. It returns a list of messages."""
+    def decorator(f):
+        JOB_HANDLERS[job_type] = f
+        return f
+    return decorator
+
+def enqueue_job(job_type, payload, user_id=None):
+    if job_type not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job type: {job_type}")
+    job = Job(type=job_type, status='queued', payload=json.dumps(payload), user_id=user_id)
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+def job_status(job):
+    return {
+        'id': job.id,
+        'type': job.type,
+        'status': job.status,
+        'rows_processed': job.rows_processed,
+        'rows_matched': job.rows_matched,
+        'rows_failed': job.rows_failed,
+        'messages': json.loads(job.messages) if job.messages else [],
+        'error': job.error,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+def update_job_progress(job, rows_processed=None, rows_matched=None, rows_failed=None):
+    """Records progress and a heartbeat in its own commit so status pages see it straight away."""
+    values = {'heartbeat_at': datetime.utcnow()}
+    if rows_processed is not None:
+        values['rows_processed'] = rows_processed
+    if rows_matched is not None:
+        values['rows_matched'] = rows_matched
+    if rows_failed is not None:
+        values['rows_failed'] = rows_failed
+    db.session.execute(update(Job).where(Job.id == job.id).values(**values))
+    db.session.commit()
+
+def requeue_stale_jobs(stale_after):
+    """Puts running jobs whose worker stopped sending heartbeats back in the queue."""
+    cutoff = datetime.utcnow() - timedelta(seconds=stale_after)
+    result = db.session.execute(
+        update(Job).where(Job.status == 'running', Job.heartbeat_at < cutoff).values(status='queued', worker_id=None)
+    )
+    db.session.commit()
+    return result.rowcount
+
+def claim_next_job(worker_id):
+    """
+    Claims the oldest queued job for this worker. Postgres skips rows other
+    workers have locked; the conditional UPDATE makes the claim safe on SQLite.
+    """
+    job = Job.query.filter_by(status='queued').order_by(Job.id).with_for_update(skip_locked=True).first()
+    if not job:
+        db.session.rollback()
+        return None
+    now = datetime.utcnow()
+    claimed = db.session.execute(
+        update(Job).where(Job.id == job.id, Job.status == 'queued')
+        .values(status='running', worker_id=worker_id, started_at=now, heartbeat_at=now)
+    ).rowcount
+    db.session.commit()
+    if not claimed:
+        return None
+    db.session.refresh(job)
+    return job
+
+def run_job(job):
+    handler = JOB_HANDLERS.get(job.type)
+    try:
+        if not handler:
+            raise ValueError(f"Unknown job type: {job.type}")
+        messages = handler(job, json.loads(job.payload or '{}'))
+        job.status = 'complete'
+        job.messages = json.dumps(messages or [])
+    except Exception as e:
+        logger.exception(f"Job {job.id} ({job.type}) failed")
+        db.session.rollback()
+        job.status = 'failed'
+        job.error = str(e)
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+    return job
+
+def run_worker(poll_interval=2, stale_after=600, once=False):
+    """Processes queued jobs until interrupted. Start one per core to scale throughput."""
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    logger.info(f"Worker {worker_id} started")
+    while True:
+        requeue_stale_jobs(stale_after)
+        job = claim_next_job(worker_id)
+        if job:
+            logger.info(f"Worker {worker_id} running job {job.id} ({job.type})")
+            run_job(job)
+            db.session.remove()
+            continue
+        if once:
+            return
+        time.sleep(poll_interval)
+
+@job_handler('bank_import')
+def bank_import_job(job, payload):
+    from app.import_service import process_csv
+    from app.suggestion_service import refresh_uncoded_suggestions
+
+    def progress(stats):
+        update_job_progress(job, rows_processed=stats['rows_read'], rows_matched=stats['matched'], rows_failed=stats['failed'])
+
+    messages = process_csv(payload['file_path'], chunk_size=payload.get('chunk_size'), progress=progress,
+                           match_workers=payload.get('match_workers', 1), raise_errors=True)
+    bank_account = system_accounts.bank_account()
+    if bank_account:
+        recalculate_account_balance(bank_account)
+        db.session.commit()
+    # Precompute suggestions so the uncoded screen only reads stored rows.
+    refresh_uncoded_suggestions()
+    return messages
+
+@job_handler('statement_batch')
+def statement_batch_job(job, payload):
+    from app.statement_generator import generate_statement_batch, statement_batch_messages
+
+    def progress(done, generated, failed):
+        update_job_progress(job, rows_processed=done, rows_matched=generated, rows_failed=failed)
+
+    report = generate_statement_batch(
+        payload['statement_type'],
+        start_date=date.fromisoformat(payload['start_date']) if payload.get('start_date') else None,
+        end_date=date.fromisoformat(payload['end_date']) if payload.get('end_date') else None,
+        vat_rate=payload.get('vat_rate', 0.2),
+        year=payload.get('year'),
+        workers=payload.get('workers', 1),
+        progress=progress
+    )
+    return statement_batch_messages(report)
@@ -0,0 +1,429 @@
+from collections import Counter, defaultdict, namedtuple
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+import difflib
+import re
+import time
+from sqlalchemy import and_, func, or_
+from app import db
+from app.models import Tenant, Landlord, LandlordReference, LearnedMatch, normalize_reference
+from app.metrics import record_timings, timed
+
+MATCH_THRESHOLD = 85
+
+# One searchable name or reference code. owner_rank orders owners the way the
+# directory was loaded so callers can keep first-match-wins semantics.
+DirectoryEntry = namedtuple('DirectoryEntry', ['kind', 'owner_id', 'owner_name', 'owner_rank', 'field', 'text'])
+
+MONTH_WORDS = {
+    'JAN', 'JANUARY', 'FEB', 'FEBRUARY', 'MAR', 'MARCH', 'APR', 'APRIL', 'MAY', 'JUN', 'JUNE',
+    'JUL', 'JULY', 'AUG', 'AUGUST', 'SEP', 'SEPT', 'SEPTEMBER', 'OCT', 'OCTOBER', 'NOV', 'NOVEMBER', 'DEC', 'DECEMBER',
+}
+
+def normalize_text(value):
+    return ''.join((value or '').upper().split())
+
+# Bank and payment-scheme noise that says nothing about who paid.
+GENERIC_WORDS = {
+    'RENT', 'PAYMENT', 'PAY', 'PMT', 'TRANSFER', 'TFR', 'TRF', 'FPS', 'FP', 'BGC', 'BACS', 'CHAPS',
+    'DD', 'SO', 'STO', 'BP', 'REF', 'FROM', 'TO', 'FOR', 'THE', 'AND', 'OF', 'ON', 'VIA',
+}
+
+# Dates and date-like tokens that change from one month's line to the next:
+# 12/03/2026, 2026-03-12, 12.03.26, 12TH, OCT26, and bare years.
+DATE_PATTERN = re.compile(
+    r'\b(?:\d{1,4}[/.-]\d{1,2}[/.-]\d{1,4}'
+    r'|\d{1,2}(?:ST|ND|RD|TH)'
+    r'|(?:' + '|'.join(sorted(MONTH_WORDS, key=len, reverse=True)) + r')\d{2,4}'
+    r'|(?:19|20)\d{2})\b'
+)
+
+def memo_signature(description, reference_code):
+    """
+    Reduces a bank line to the part that repeats from month to month: the
+    memo's words and numbers with month names and dates dropped, plus the
+    normalized reference code. "FLAT 12 RENT OCT" and "FLAT 12 RENT NOV 2026"
+    share one signature; "FLAT 14 RENT" does not. Returns None when the memo
+    is too generic to identify anyone: no reference code and fewer than two
+    distinctive words.
+    """
+    text = DATE_PATTERN.sub(' ', (description or '').upper())
+    words = [word for word in re.findall(r'[A-Z0-9]+', text) if word not in MONTH_WORDS]
+    reference = normalize_reference(reference_code) or ''
+    if not reference and len([word for word in words if word not in GENERIC_WORDS]) < 2:
+        return None
+    return (' '.join(words) + '|' + reference)[:384]
+
+def match_category(match_type, amount):
+    """Category for a tenant or landlord match, from the direction of the money."""
+    if match_type == 'tenant':
+        return 'rent' if amount > 0 else 'fee'
+    return 'payment' if amount > 0 else 'expense'
+
+def learned_matches():
+    """LearnedMatch rows whose tenant or landlord still exists."""
+    return db.session.query(
+        LearnedMatch.signature, LearnedMatch.match_type, LearnedMatch.match_id, LearnedMatch.category
+    ).outerjoin(
+        Tenant, and_(LearnedMatch.match_type == 'tenant', Tenant.id == LearnedMatch.match_id)
+    ).outerjoin(
+        Landlord, and_(LearnedMatch.match_type == 'landlord', Landlord.id == LearnedMatch.match_id)
+    ).filter(or_(Tenant.id.isnot(None), Landlord.id.isnot(None)))
+
+def remember_allocation(transaction, user_id=None):
+    """
+    Records a manual allocation so later bank lines with the same memo
+    signature are matched the same way. The latest decision wins. Does not commit.
+    """
+    if transaction.tenant_id:
+        match_type, match_id = 'tenant', transaction.tenant_id
+    elif transaction.landlord_id:
+        match_type, match_id = 'landlord', transaction.landlord_id
+    else:
+        return None
+    signature = memo_signature(transaction.description, transaction.reference_code)
+    if not signature:
+        return None
+    learned = LearnedMatch.query.filter_by(signature=signature).first()
+    if not learned:
+        learned = LearnedMatch(signature=signature)
+        db.session.add(learned)
+    learned.match_type = match_type
+    learned.match_id = int(match_id)
+    learned.category = transaction.category
+    learned.user_id = user_id
+    return learned
+
+def trigrams(text):
+    return [text[i:i + 3] for i in range(len(text) - 2)]
+
+def required_shared_trigrams(length):
+    """
+    Lower bound on the trigram positions of a pattern of this length that must
+    also occur in the memo for get_partial_ratio to reach MATCH_THRESHOLD.
+
+    A score of at least 85% leaves at most 15% of the pattern (and of the
+    compared window) unmatched. Each unmatched pattern character breaks at most
+    three pattern trigrams and each unmatched window character at most two more.
+    """
+    max_unmatched = length * (100 - MATCH_THRESHOLD) // 100
+    return (length - 2) - 5 * max_unmatched
+
+class DirectoryIndex:
+    """
+    Trigram inverted index over normalized tenant and landlord names and
+    reference codes. Build it once per import (or page view) and use
+    candidates() to find the few entries worth scoring with get_partial_ratio.
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+        self._postings = defaultdict(list)
+        self._required = []
+        self._always = []
+        for position, entry in enumerate(entries):
+            required = required_shared_trigrams(len(entry.text))
+            self._required.append(required)
+            if required <= 0:
+                # Too short to prune safely as the pattern, always score it against longer memos.
+                self._always.append(position)
+            for gram, count in Counter(trigrams(entry.text)).items():
+                self._postings[gram].append((position, count))
+        self._by_length = sorted((len(entry.text), position) for position, entry in enumerate(entries))
+        self._lengths = [length for length, _ in self._by_length]
+
+    @classmethod
+    def build(cls):
+        entries = []
+        rank = 0
+        tenants = db.session.query(Tenant.id, Tenant.name, Tenant.reference_code_normalized).order_by(Tenant.id).all()
+        for tenant_id, name, reference in tenants:
+            if reference:
+                entries.append(DirectoryEntry('tenant', tenant_id, name, rank, 'ref', reference))
+            if normalize_text(name):
+                entries.append(DirectoryEntry('tenant', tenant_id, name, rank, 'name', normalize_text(name)))
+            rank += 1
+
+        extra_references = defaultdict(list)
+        for landlord_id, reference in db.session.query(LandlordReference.landlord_id, LandlordReference.reference_code_normalized).order_by(LandlordReference.id):
+            if reference:
+                extra_references[landlord_id].append(reference)
+
+        landlords = db.session.query(Landlord.id, Landlord.name, Landlord.reference_code_normalized).order_by(Landlord.id).all()
+        for landlord_id, name, reference in landlords:
+            for ref in ([reference] if reference else []) + extra_references[landlord_id]:
+                entries.append(DirectoryEntry('landlord', landlord_id, name, rank, 'ref', ref))
+            if normalize_text(name):
+                entries.append(DirectoryEntry('landlord', landlord_id, name, rank, 'name', normalize_text(name)))
+            rank += 1
+        return cls(entries)
+
+    def candidates(self, text):
+        """
+        Returns the entries that could score at least MATCH_THRESHOLD against
+        the normalized memo text, most shared trigrams first and in directory
+        order among ties, so the likely matches are scored first. Entries
+        longer than the memo swap roles inside get_partial_ratio: the memo is
+        then the pattern, and enough of its trigrams must occur in the entry.
+        """
+        memo_required = required_shared_trigrams(len(text))
+        shared = defaultdict(int)  # Entry trigram positions that occur in the memo
+        memo_shared = defaultdict(int)  # Memo trigram positions that occur in the entry
+        for gram, memo_count in Counter(trigrams(text)).items():
+            for position, count in self._postings.get(gram, ()):
+                shared[position] += count
+                memo_shared[position] += memo_count
+
+        longer = {position for _, position in self._by_length[bisect_right(self._lengths, len(text)):]}
+        counts = {}
+        for position in longer:
+            if memo_required <= 0 or memo_shared[position] >= memo_required:
+                counts[position] = memo_shared[position]
+        for position, count in shared.items():
+            if position not in longer and count >= self._required[position]:
+                counts[position] = count
+        for position in self._always:
+            if position not in longer:
+                counts[position] = shared[position]
+        return [self.entries[position] for position in sorted(counts, key=lambda position: (-counts[position], position))]
+
+def get_partial_ratio(long_text, pattern):
+    long_text = long_text.upper()
+    pattern = pattern.upper()
+    if len(pattern) > len(long_text):
+        long_text, pattern = pattern, long_text
+    len_p = len(pattern)
+    max_ratio = 0
+    for i in range(len(long_text) - len_p + 1):
+        sub = long_text[i:i + len_p]
+        matcher = difflib.SequenceMatcher(None, sub, pattern)
+        ratio = matcher.ratio()
+        if ratio > max_ratio:
+            max_ratio = ratio
+    return max_ratio * 100
+
+def fuzzy_match(index, text, amount):
+    """
+    Scores the index candidates for a normalized memo in the original pass
+    order: tenant names (receipts only), tenants, then landlords. Returns
+    (match_type, match_id, category), or (None, None, None) if nothing
+    reaches MATCH_THRESHOLD.
+    """
+    if not text:
+        # An empty memo would otherwise score 100% against every entry.
+        return None, None, None
+
+    candidates = index.candidates(text)
+    scores = {}
+
+    def is_match(entry):
+        if entry not in scores:
+            scores[entry] = get_partial_ratio(text, entry.text)
+        return scores[entry] >= MATCH_THRESHOLD
+
+    def first_match(accept):
+        # The first owner in directory order with a matching entry. Candidates
+        # come most likely first, so once one matches only owners ahead of it
+        # are still worth scoring.
+        found = None
+        for entry in candidates:
+            if found is not None and entry.owner_rank >= found.owner_rank:
+                continue
+            if accept(entry) and is_match(entry):
+                found = entry
+        return found
+
+    if amount > 0:
+        entry = first_match(lambda entry: entry.kind == 'tenant' and entry.field == 'name')
+        if entry:
+            return 'tenant', entry.owner_id, 'rent'
+
+    entry = first_match(lambda entry: entry.kind == 'tenant')
+    if entry:
+        return 'tenant', entry.owner_id, 'rent' if amount > 0 else 'fee'
+
+    entry = first_match(lambda entry: entry.kind == 'landlord')
+    if entry:
+        return 'landlord', entry.owner_id, 'payment' if amount > 0 else 'expense'
+
+    return None, None, None
+
+@timed('match_transaction')
+def match_transaction(transaction, index=None):
+    raw_text = ((transaction.description or '') + ' ' + (transaction.reference_code or ''))
+    text = normalize_text(raw_text)
+
+    normalized_trans_ref = normalize_reference(transaction.reference_code)
+    if normalized_trans_ref:
+        # Exact reference matches are resolved through the indexed normalized columns.
+        tenant_id = db.session.query(Tenant.id).filter(
+            Tenant.reference_code_normalized == normalized_trans_ref
+        ).order_by(Tenant.id).limit(1).scalar()
+        if tenant_id:
+            transaction.category = 'rent'
+            return True, 'tenant', tenant_id
+        landlord_id = db.session.query(func.min(Landlord.id)).filter(
+            or_(
+                Landlord.reference_code_normalized == normalized_trans_ref,
+                Landlord.id.in_(
+                    db.session.query(LandlordReference.landlord_id).filter(
+                        LandlordReference.reference_code_normalized == normalized_trans_ref
+                    )
+                )
+            )
+        ).scalar()
+        if landlord_id:
+            if transaction.amount > 0:
+                transaction.category = 'payment'
+            else:
+                transaction.category = 'expense'
+            return True, 'landlord', landlord_id
+
+    # Decisions users made by hand before take precedence over fuzzy scoring.
+    signature = memo_signature(transaction.description, transaction.reference_code)
+    if signature:
+        learned = learned_matches().filter(LearnedMatch.signature == signature).first()
+        if learned:
+            # The learned row says who; the sign says what, so a refund is not coded as rent.
+            transaction.category = match_category(learned.match_type, transaction.amount)
+            return True, learned.match_type, learned.match_id
+
+    if index is None:
+        index = DirectoryIndex.build()
+    match_type, match_id, category = fuzzy_match(index, text, transaction.amount)
+    if not match_type:
+        return False, None, None
+    transaction.category = category
+    return True, match_type, match_id
+
+class MatchSnapshot:
+    """
+    Immutable, picklable copy of everything matching needs: the trigram index,
+    exact-reference lookups built from the normalized reference columns and
+    the learned matches by signature. Built once per import and shipped to
+    matching worker processes.
+    """
+
+    def __init__(self, index, tenant_references, landlord_references, learned=None):
+        self.index = index
+        self.tenant_references = tenant_references
+        self.landlord_references = landlord_references
+        self.learned = learned or {}
+
+    @classmethod
+    def build(cls):
+        tenant_references = {}
+        for tenant_id, reference in db.session.query(Tenant.id, Tenant.reference_code_normalized).filter(
+                Tenant.reference_code_normalized.isnot(None)).order_by(Tenant.id.desc()):
+            tenant_references[reference] = tenant_id
+
+        landlord_references = {}
+        references = db.session.query(Landlord.id, Landlord.reference_code_normalized).filter(
+            Landlord.reference_code_normalized.isnot(None)
+        ).union_all(
+            db.session.query(LandlordReference.landlord_id, LandlordReference.reference_code_normalized).filter(
+                LandlordReference.reference_code_normalized.isnot(None), LandlordReference.landlord_id.isnot(None))
+        )
+        for landlord_id, reference in references:
+            landlord_references[reference] = min(landlord_id, landlord_references.get(reference, landlord_id))
+
+        learned = {signature: (match_type, match_id) for signature, match_type, match_id, category in learned_matches()}
+
+        return cls(DirectoryIndex.build(), tenant_references, landlord_references, learned)
+
+    def match(self, description, reference_code, amount):
+        """
+        Same decision as match_transaction, without touching the database.
+        Returns (match_type, match_id, category, method), where method is
+        'exact', 'learned', 'fuzzy' or None when nothing matched.
+        """
+        normalized_trans_ref = normalize_reference(reference_code)
+        if normalized_trans_ref:
+            if normalized_trans_ref in self.tenant_references:
+                return 'tenant', self.tenant_references[normalized_trans_ref], 'rent', 'exact'
+            if normalized_trans_ref in self.landlord_references:
+                return 'landlord', self.landlord_references[normalized_trans_ref], 'payment' if amount > 0 else 'expense', 'exact'
+        signature = memo_signature(description, reference_code)
+        if signature in self.learned:
+            match_type, match_id = self.learned[signature]
+            return match_type, match_id, match_category(match_type, amount), 'learned'
+        text = normalize_text((description or '') + ' ' + (reference_code or ''))
+        match_type, match_id, category = fuzzy_match(self.index, text, amount)
+        return match_type, match_id, category, 'fuzzy' if match_type else None
+
+_worker_snapshot = None
+
+def _init_match_worker(snapshot):
+    global _worker_snapshot
+    _worker_snapshot = snapshot
+
+def _timed_matches(snapshot, rows):
+    """Matches rows against snapshot, returning the results and the wall time of each match."""
+    results, timings = [], []
+    for row in rows:
+        started = time.perf_counter()
+        results.append(snapshot.match(*row))
+        timings.append(time.perf_counter() - started)
+    return results, timings
+
+def _match_batch(rows):
+    return _timed_matches(_worker_snapshot, rows)
+
+class MatchPool:
+    """
+    Fans (description, reference_code, amount) rows out over a process pool
+    and returns the MatchSnapshot.match results in input order. With one worker, or for
+    batches too small to be worth shipping, rows are matched in-process.
+    Each match's time is recorded under the match_transaction metric.
+    Use as a context manager so the pool is shut down after the import.
+    """
+
+    def __init__(self, snapshot, workers=1, batch_size=250):
+        self.snapshot = snapshot
+        self.workers = workers
+        self.batch_size = batch_size
+        self._executor = None
+
+    def __enter__(self):
+        if self.workers > 1:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_match_worker, initargs=(self.snapshot,))
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._executor:
+            self._executor.shutdown()
+            self._executor = None
+
+    def match(self, rows):
+        if not self._executor or len(rows) <= self.batch_size:
+            results, timings = _timed_matches(self.snapshot, rows)
+        else:
+            batches = [rows[i:i + self.batch_size] for i in range(0, len(rows), self.batch_size)]
+            results, timings = [], []
+            for batch_results, batch_timings in self._executor.map(_match_batch, batches):
+                results.extend(batch_results)
+                timings.extend(batch_timings)
+        # Workers can't reach this process's registry, so their timings are recorded here
+        record_timings('match_transaction', timings)
+        return results
+
+def get_suggestions(transaction, index=None):
+    suggestions = []
+    if index is None:
+        index = DirectoryIndex.build()
+
+    raw_text = ((transaction.description or '') + ' ' + (transaction.reference_code or ''))
+    text = normalize_text(raw_text)
+    if not text:
+        return suggestions
+
+    # Names are listed before reference codes for each tenant or landlord.
+    candidates = sorted(index.candidates(text), key=lambda entry: (entry.owner_rank, entry.field != 'name'))
+    for entry in candidates:
+        score = get_partial_ratio(text, entry.text)
+        if score < MATCH_THRESHOLD:
+            continue
+        match_kind = 'Name' if entry.field == 'name' else 'Ref'
+        suggestions.append((entry.kind, entry.owner_id, f"{entry.kind.capitalize()}: {entry.owner_name} ({match_kind} Match: {score:.2f}%)"))
+
+    return suggestions
@@ -0,0 +1,140 @@
+import math
+import threading
+import time
+from collections import defaultdict, deque
+from functools import wraps
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+SAMPLE_SIZE = 1000  # Most recent samples kept per metric for percentiles
+
+class _Metric:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen=SAMPLE_SIZE)
+        self.queries = 0
+        self.db_time = 0.0
+
+class MetricsRegistry:
+    """
+    In-memory, per-process timings for named functions and request endpoints.
+    Percentiles are taken over the most recent SAMPLE_SIZE samples.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._functions = defaultdict(_Metric)
+        self._endpoints = defaultdict(_Metric)
+        self.started_at = time.time()
+
+    def record_function(self, name, seconds):
+        with self._lock:
+            self._add(self._functions[name], seconds)
+
+    def record_request(self, endpoint, seconds, queries, db_time):
+        with self._lock:
+            metric = self._endpoints[endpoint]
+            self._add(metric, seconds)
+            metric.queries += queries
+            metric.db_time += db_time
+
+    def _add(self, metric, seconds):
+        metric.count += 1
+        metric.total += seconds
+        metric.max = max(metric.max, seconds)
+        metric.samples.append(seconds)
+
+    def reset(self):
+        with self._lock:
+            self._functions.clear()
+            self._endpoints.clear()
+            self.started_at = time.time()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'since': self.started_at,
+                'functions': {name: self._summary(metric) for name, metric in sorted(self._functions.items())},
+                'endpoints': {name: self._summary(metric, per_request=True) for name, metric in sorted(self._endpoints.items())},
+            }
+
+    def _summary(self, metric, per_request=False):
+        samples = sorted(metric.samples)
+        summary = {
+            'count': metric.count,
+            'total_ms': round(metric.total * 1000, 1),
+            'mean_ms': round(metric.total / metric.count * 1000, 2) if metric.count else 0.0,
+            'p50_ms': round(_percentile(samples, 50) * 1000, 2),
+            'p95_ms': round(_percentile(samples, 95) * 1000, 2),
+            'max_ms': round(metric.max * 1000, 2),
+        }
+        if per_request:
+            summary['queries_per_request'] = round(metric.queries / metric.count, 1) if metric.count else 0.0
+            summary['db_ms_per_request'] = round(metric.db_time / metric.count * 1000, 2) if metric.count else 0.0
+        return summary
+
+def _percentile(samples, percent):
+    if not samples:
+        return 0.0
+    # Nearest-rank percentile.
+    return samples[max(0, math.ceil(percent / 100 * len(samples)) - 1)]
+
+registry = MetricsRegistry()
+_enabled = True
+
+def timed(name):
+    """Records the wall time of every call to the decorated function under name."""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return f(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                registry.record_function(name, time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+def record_timings(name, timings):
+    """Records wall times measured elsewhere, such as in a worker process, under name."""
+    if _enabled:
+        for seconds in timings:
+            registry.record_function(name, seconds)
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _enabled and has_request_context() and 'metrics_queries' in g:
+        conn.info['metrics_query_started'] = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop('metrics_query_started', None)
+    if started is not None and has_request_context() and 'metrics_queries' in g:
+        g.metrics_queries += 1
+        g.metrics_db_time += time.perf_counter() - started
+
+def init_app(app):
+    """Counts SQL statements and database time per request, unless METRICS_ENABLED is off."""
+    global _enabled
+    _enabled = app.config.get('METRICS_ENABLED', True)
+    if not _enabled:
+        return
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_started = time.perf_counter()
+        g.metrics_queries = 0
+        g.metrics_db_time = 0.0
+
+    @app.teardown_request
+    def finish_request_metrics(exc):
+        if 'metrics_started' not in g:
+            return
+        endpoint = request.endpoint or 'unmatched'
+        if endpoint != 'static':
+            registry.record_request(endpoint, time.perf_counter() - g.metrics_started, g.metrics_queries, g.metrics_db_time)
@@ -1,10 +1,15 @@
 # app/models.py
-from datetime import datetime
+from datetime import date, datetime
 from app import db
-from sqlalchemy import ForeignKey
-from sqlalchemy.orm import relationship
+from itertools import chain
+from sqlalchemy import ForeignKey, event, inspect, or_
+from sqlalchemy.orm import Session, object_session, relationship, validates
 from flask_login import UserMixin
 import bcrypt
+import logging
+from app.money import Money, round_money
+
+logger = logging.getLogger(__name__)
 
 # Association table for User and Role many-to-many relationship
 user_roles = db.Table('user_roles',
@@ -12,6 +17,12 @@ user_roles = db.Table('user_roles',
     db.Column('role_id', db.Integer, db.ForeignKey('role.id'), primary_key=True)
 )
 
+def normalize_reference(value):
+    """Upper-cases a reference code and strips all whitespace so bank memos can be compared against it."""
+    if not value:
+        return None
+    return ''.join(value.upper().split())
+
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), unique=True, nullable=False)
@@ -45,10 +56,16 @@ class Tenant(db.Model):
     end_date = db.Column(db.Date)
     is_archived = db.Column(db.Boolean, default=False)
     reference_code = db.Column(db.String(64), unique=True, index=True)
+    reference_code_normalized = db.Column(db.String(64), index=True)
     property_id = db.Column(db.Integer, db.ForeignKey('property.id'))
     accounts = db.relationship('Account', backref='tenant', lazy='dynamic')
     transactions = db.relationship('Transaction', backref='tenant_transaction', lazy='dynamic')
 
+    @validates('reference_code')
+    def validate_reference_code(self, key, value):
+        self.reference_code_normalized = normalize_reference(value)
+        return value
+
     def __repr__(self):
         return f'<Tenant {self.name}>'
 
@@ -64,6 +81,7 @@ class Landlord(db.Model):
     bank_account_number = db.Column(db.String(30))
     bank_sort_code = db.Column(db.String(10))
     reference_code = db.Column(db.String(64), unique=True, index=True)
+    reference_code_normalized = db.Column(db.String(64), index=True)
     commission_rate = db.Column(db.Float, default=0.1)
     receives_email_statements = db.Column(db.Boolean, default=True)
     properties = db.relationship('Property', backref='landlord', lazy='dynamic')
@@ -71,14 +89,25 @@ class Landlord(db.Model):
     transactions = db.relationship('Transaction', backref='landlord_transaction', lazy='dynamic')
     references = db.relationship('LandlordReference', backref='landlord', lazy='dynamic')
 
+    @validates('reference_code')
+    def validate_reference_code(self, key, value):
+        self.reference_code_normalized = normalize_reference(value)
+        return value
+
     def __repr__(self):
         return f'<Landlord {self.name}>'
 
 class LandlordReference(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     reference_code = db.Column(db.String(64), unique=True, index=True)
+    reference_code_normalized = db.Column(db.String(64), index=True)
     landlord_id = db.Column(db.Integer, db.ForeignKey('landlord.id'))
 
+    @validates('reference_code')
+    def validate_reference_code(self, key, value):
+        self.reference_code_normalized = normalize_reference(value)
+        return value
+
     def __repr__(self):
         return f'<LandlordReference {self.reference_code}>'
 
@@ -87,7 +116,7 @@ class Property(db.Model):
     address_line_1 = db.Column(db.String(128))
     town = db.Column(db.String(128))
     postcode = db.Column(db.String(20))
-    rent_amount = db.Column(db.Float, default=0.0)  # Monthly rent amount
+    rent_amount = db.Column(Money, default=0.0)  # Monthly rent amount
     landlord_id = db.Column(db.Integer, db.ForeignKey('landlord.id'))
     landlord_portion = db.Column(db.Float, nullable=True)
     utility_account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=True)
@@ -97,27 +126,70 @@ class Property(db.Model):
     def __repr__(self):
         return f'<Property {self.address_line_1}, {self.town}, {self.postcode}>'
 
+# Account types whose balance goes up with debits. Every other account's balance goes up with credits.
+DEBIT_BALANCE_TYPES = ('asset', 'agency_expense')
+
+def debit_amount(account_type, amount):
+    """A balance change on an account of this type as a debit (positive) or a credit (negative), and back."""
+    return amount if account_type in DEBIT_BALANCE_TYPES else -amount
+
+def journal_imbalance(lines):
+    """Debits less credits of a journal entry given as (account type, amount) lines; zero when it balances."""
+    return round_money(sum(debit_amount(account_type, amount or 0.0) for account_type, amount in lines))
+
 class Account(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(128))
-    type = db.Column(db.String(64))  # tenant, landlord, agency_income, agency_expense, suspense, asset, vat_payable, utility
-    balance = db.Column(db.Float, default=0.0)
+    type = db.Column(db.String(64))  # tenant, landlord, agency_income, agency_expense, suspense, asset, vat_payable, utility, clearing
+    balance = db.Column(Money, default=0.0)
     tenant_id = db.Column(db.Integer, db.ForeignKey('tenant.id'))
     landlord_id = db.Column(db.Integer, db.ForeignKey('landlord.id'))
     transactions = db.relationship('Transaction', backref='account', lazy='dynamic')
 
-    def update_balance(self, amount):
-        if self.balance is None:
-            self.balance = 0.0
-        self.balance += amount
+    def adjust_balance(self, amount):
+        """
+        Adds amount to the balance without posting it. For a stored account the
+        change is written at flush as balance = balance + delta, summed over
+        every call in the unit of work, so concurrent workers cannot overwrite
+        each other's updates. The in-memory balance stays current until then.
+        """
+        amount = round_money(amount)
+        session = object_session(self)
+        if session is not None and inspect(self).key is not None:
+            deltas = session.info.setdefault('pending_balance_deltas', {})
+            deltas[self] = round_money(deltas.get(self, 0.0) + amount)
+        self.balance = round_money((self.balance or 0.0) + amount)
+
+    def update_balance(self, amount, transaction=None, description=None):
+        """Adds amount to the balance and records it as a Posting against the journal entry transaction."""
+        self.adjust_balance(amount)
+        session = object_session(self)
+        posting = Posting(
+            account=self, transaction=transaction, amount=round_money(amount),
+            date=(transaction.date if transaction is not None else None) or date.today(),
+            description=description or (transaction.description if transaction is not None else None)
+        )
+        if session is not None:
+            session.add(posting)
 
     def __repr__(self):
         return f'<Account {self.name} Balance: {self.balance}>'
 
 class Transaction(db.Model):
+    # Composite indexes follow the access paths: statements and payouts by
+    # landlord or tenant over a date range, account ledgers, the uncoded
+    # queue and child rows of split transactions.
+    __table_args__ = (
+        db.Index('ix_transaction_landlord_id_date', 'landlord_id', 'date'),
+        db.Index('ix_transaction_tenant_id_category_date', 'tenant_id', 'category', 'date'),
+        db.Index('ix_transaction_account_id_date', 'account_id', 'date'),
+        db.Index('ix_transaction_status', 'status'),
+        db.Index('ix_transaction_parent_transaction_id', 'parent_transaction_id'),
+        db.Index('ix_transaction_category_date', 'category', 'date'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     date = db.Column(db.Date)
-    amount = db.Column(db.Float)
+    amount = db.Column(Money)
     description = db.Column(db.String(256))
     reference_code = db.Column(db.String(128))
     status = db.Column(db.String(64), default='uncoded')  # uncoded, coded, allocated
@@ -132,11 +204,34 @@ class Transaction(db.Model):
     parent_transaction_id = db.Column(db.Integer, db.ForeignKey('transaction.id'), nullable=True)
     property_id = db.Column(db.Integer, db.ForeignKey('property.id'), nullable=True) # Added property_id
     reviewed = db.Column(db.Boolean, default=False, nullable=False)
+    import_fingerprint = db.Column(db.String(64), unique=True, index=True)  # Set for rows imported from bank files
     child_transactions = db.relationship('Transaction', backref=db.backref('parent_transaction', remote_side=[id]), lazy='dynamic')
 
     def __repr__(self):
         return f'<Transaction {self.description} Amount {self.amount}>'
 
+class Posting(db.Model):
+    """
+    One line of the ledger: an amount moved on one account by one journal
+    entry (a transaction). Amounts are signed as the account's balance
+    changes, so whether a line is a debit or a credit follows from the
+    account type (debit_amount). The debits and credits of an entry are equal.
+    """
+    # Covers balance and ledger queries, which filter on account and date and sum amounts.
+    __table_args__ = (db.Index('ix_posting_account_id_date', 'account_id', 'date', 'amount'),)
+    id = db.Column(db.Integer, primary_key=True)
+    transaction_id = db.Column(db.Integer, db.ForeignKey('transaction.id'), index=True)  # Null for adjustments and deleted entries
+    account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    amount = db.Column(Money, nullable=False)  # Signed the same way as Account.balance changes
+    description = db.Column(db.String(256))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    account = db.relationship('Account', backref=db.backref('postings', lazy='dynamic'))
+    transaction = db.relationship('Transaction', backref=db.backref('postings', lazy='dynamic'))
+
+    def __repr__(self):
+        return f'<Posting account {self.account_id} {self.date}: {self.amount}>'
+
 class ExpenseCategory(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64))
@@ -148,7 +243,7 @@ class ExpenseCategory(db.Model):
 class Expense(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     description = db.Column(db.String(256))
-    amount = db.Column(db.Float)
+    amount = db.Column(Money)
     date = db.Column(db.Date)
     property_id = db.Column(db.Integer, db.ForeignKey('property.id'))
     category_id = db.Column(db.Integer, db.ForeignKey('expense_category.id'))
@@ -191,6 +286,154 @@ class RentChargeBatch(db.Model):
     def __repr__(self):
         return f'<RentChargeBatch {self.description} at {self.timestamp}>'
 
+class ImportCheckpoint(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    file_hash = db.Column(db.String(64), unique=True, index=True, nullable=False)  # SHA-256 of the uploaded file
+    filename = db.Column(db.String(256))
+    last_row = db.Column(db.Integer, default=-1, nullable=False)  # Last CSV row committed
+    rows_imported = db.Column(db.Integer, default=0, nullable=False)
+    status = db.Column(db.String(32), default='in_progress')  # in_progress, complete, failed
+    error = db.Column(db.Text)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<ImportCheckpoint {self.filename} row {self.last_row} ({self.status})>'
+
+class Job(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    type = db.Column(db.String(64), nullable=False)  # bank_import, ...
+    status = db.Column(db.String(32), default='queued', index=True)  # queued, running, complete, failed
+    payload = db.Column(db.Text)  # JSON arguments for the job handler
+    messages = db.Column(db.Text)  # JSON list of messages for the user
+    error = db.Column(db.Text)
+    rows_processed = db.Column(db.Integer, default=0, nullable=False)
+    rows_matched = db.Column(db.Integer, default=0, nullable=False)
+    rows_failed = db.Column(db.Integer, default=0, nullable=False)
+    worker_id = db.Column(db.String(64))
+    user_id = db.Column(db.Integer)  # For audit
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<Job {self.id} {self.type} ({self.status})>'
+
+class BalanceDiscrepancy(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=False, index=True)
+    cached_balance = db.Column(Money)  # Account.balance when last checked
+    ledger_balance = db.Column(Money)  # Sum of the account's postings when last checked
+    difference = db.Column(Money)  # cached_balance - ledger_balance
+    detected_at = db.Column(db.DateTime, default=datetime.utcnow)
+    checked_at = db.Column(db.DateTime, default=datetime.utcnow)
+    resolved_at = db.Column(db.DateTime)  # Set once a later check finds the account balanced again
+    account = db.relationship('Account', backref=db.backref('balance_discrepancies', lazy='dynamic'))
+
+    def __repr__(self):
+        return f'<BalanceDiscrepancy account {self.account_id}: {self.difference}>'
+
+class AccountLedgerCheckpoint(db.Model):
+    """Sum of an account's postings up to posting_id as verified by the last drift check."""
+    account_id = db.Column(db.Integer, db.ForeignKey('account.id'), primary_key=True)
+    posting_id = db.Column(db.Integer, nullable=False, default=0)  # Postings with ids up to this one are in ledger_sum
+    ledger_sum = db.Column(Money, nullable=False, default=0.0)
+    checked_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<AccountLedgerCheckpoint account {self.account_id} through posting {self.posting_id}: {self.ledger_sum}>'
+
+class DataVersion(db.Model):
+    name = db.Column(db.String(64), primary_key=True)  # directory, ledger, ...
+    version = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<DataVersion {self.name} {self.version}>'
+
+def bump_data_version(connection, name):
+    """Increments a named version counter on the given connection, creating it on first use."""
+    table = DataVersion.__table__
+    now = datetime.utcnow()
+    updated = connection.execute(
+        table.update().where(table.c.name == name).values(version=table.c.version + 1, updated_at=now)
+    ).rowcount
+    if not updated:
+        connection.execute(table.insert().values(name=name, version=1, updated_at=now))
+
+class SuggestionCache(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    transaction_id = db.Column(db.Integer, db.ForeignKey('transaction.id'), unique=True, index=True, nullable=False)
+    directory_version = db.Column(db.Integer, nullable=False)  # 'directory' DataVersion the suggestions were computed against
+    memo = db.Column(db.Text)  # Normalized memo text the suggestions were computed for
+    suggestions = db.Column(db.Text)  # JSON list of [type, id, label]
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    transaction = db.relationship('Transaction', backref=db.backref('suggestion_cache', uselist=False, cascade='all, delete-orphan'))
+
+    def __repr__(self):
+        return f'<SuggestionCache transaction {self.transaction_id} v{self.directory_version}>'
+
+class LearnedMatch(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    signature = db.Column(db.String(384), unique=True, index=True, nullable=False)  # memo_signature() of the allocated transaction
+    match_type = db.Column(db.String(16), nullable=False)  # tenant, landlord
+    match_id = db.Column(db.Integer, nullable=False)
+    category = db.Column(db.String(64))
+    user_id = db.Column(db.Integer)  # For audit
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<LearnedMatch {self.signature} -> {self.match_type} {self.match_id}>'
+
+class PayoutRun(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    start_date = db.Column(db.Date, nullable=False)
+    end_date = db.Column(db.Date, nullable=False)
+    payout_date = db.Column(db.Date, nullable=False)  # Date of the posted payout transactions
+    vat_rate = db.Column(db.Float, nullable=False)
+    status = db.Column(db.String(32), default='running', nullable=False)  # running, complete, failed
+    error = db.Column(db.Text)
+    user_id = db.Column(db.Integer)  # For audit
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    items = db.relationship('PayoutRunItem', backref='run', lazy='dynamic')
+
+    def __repr__(self):
+        return f'<PayoutRun {self.id} {self.start_date} to {self.end_date} ({self.status})>'
+
+class PayoutRunItem(db.Model):
+    """One landlord's payout for a period. The unique constraint stops a period being paid twice."""
+    __table_args__ = (db.UniqueConstraint('landlord_id', 'start_date', 'end_date'),)
+    id = db.Column(db.Integer, primary_key=True)
+    run_id = db.Column(db.Integer, db.ForeignKey('payout_run.id'), index=True)  # Null for single landlord payouts
+    landlord_id = db.Column(db.Integer, db.ForeignKey('landlord.id'), nullable=False)
+    start_date = db.Column(db.Date, nullable=False)
+    end_date = db.Column(db.Date, nullable=False)
+    status = db.Column(db.String(32), default='pending', nullable=False)  # pending, paid, skipped
+    reason = db.Column(db.String(128))  # Why the landlord was skipped
+    rent_income = db.Column(Money)
+    expenses = db.Column(Money)
+    commission = db.Column(Money)
+    vat = db.Column(Money)
+    payout = db.Column(Money)
+    transaction_id = db.Column(db.Integer, db.ForeignKey('transaction.id'), index=True)  # The posted payout transaction
+    # The commission and VAT entries posted with the payout, deleted with it
+    commission_transaction_id = db.Column(db.Integer, db.ForeignKey('transaction.id'))  # Landlord's commission
+    vat_transaction_id = db.Column(db.Integer, db.ForeignKey('transaction.id'))  # Landlord's VAT on commission
+    agency_income_transaction_id = db.Column(db.Integer, db.ForeignKey('transaction.id'))  # Agency Income's commission
+    vat_income_transaction_id = db.Column(db.Integer, db.ForeignKey('transaction.id'))  # VAT Account's VAT on commission
+    processed_at = db.Column(db.DateTime)
+    landlord = db.relationship('Landlord', backref=db.backref('payout_run_items', lazy='dynamic', cascade='all, delete-orphan'))
+    transaction = db.relationship('Transaction', foreign_keys=[transaction_id], backref=db.backref('payout_run_item', uselist=False))
+
+    ENTRY_FIELDS = ('commission_transaction_id', 'vat_transaction_id', 'agency_income_transaction_id', 'vat_income_transaction_id')
+
+    def __repr__(self):
+        return f'<PayoutRunItem landlord {self.landlord_id} {self.start_date} to {self.end_date} ({self.status})>'
+
 class AuditLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     action = db.Column(db.String(256))
@@ -207,4 +450,139 @@ class Company(db.Model):
     logo = db.Column(db.String(256))  # Path to logo file
 
     def __repr__(self):
-        return f'<Company {self.name}>'
\ No newline at end of file
+        return f'<Company {self.name}>'
+
+
+# Fields that feed the matching directory; changing any of them invalidates cached suggestions.
+DIRECTORY_FIELDS = {
+    Tenant: ('name', 'reference_code'),
+    Landlord: ('name', 'reference_code'),
+    LandlordReference: ('reference_code', 'landlord_id'),
+}
+
+@event.listens_for(Session, 'after_flush')
+def bump_directory_version(session, flush_context):
+    changed = any(type(obj) in DIRECTORY_FIELDS for obj in chain(session.new, session.deleted))
+    if not changed:
+        changed = any(
+            any(inspect(obj).attrs[field].history.has_changes() for field in DIRECTORY_FIELDS[type(obj)])
+            for obj in session.dirty if type(obj) in DIRECTORY_FIELDS
+        )
+    if changed:
+        bump_data_version(session.connection(), 'directory')
+
+# Fields that payout figures are worked out from; changing any of them invalidates cached payout previews.
+LEDGER_FIELDS = {
+    Transaction: ('amount', 'date', 'category', 'landlord_id', 'tenant_id', 'account_id', 'parent_transaction_id'),
+    Landlord: ('name', 'reference_code', 'commission_rate'),
+    Tenant: ('property_id',),
+    Property: ('landlord_id',),
+    Account: ('landlord_id', 'type'),
+}
+
+@event.listens_for(Session, 'after_flush')
+def bump_ledger_version(session, flush_context):
+    changed = any(type(obj) in LEDGER_FIELDS for obj in chain(session.new, session.deleted))
+    if not changed:
+        changed = any(
+            any(inspect(obj).attrs[field].history.has_changes() for field in LEDGER_FIELDS[type(obj)])
+            for obj in session.dirty if type(obj) in LEDGER_FIELDS
+        )
+    if changed:
+        mark_ledger_changed(session)
+
+def mark_ledger_changed(session):
+    """
+    Notes that the session changed what payout figures are worked out from.
+    The 'ledger' version is bumped once the session commits, in a short
+    transaction of its own, so writers don't hold a lock on the shared
+    DataVersion row for the rest of their transaction.
+    """
+    session.info['ledger_changed'] = True
+
+@event.listens_for(Session, 'after_commit')
+def commit_ledger_version(session):
+    if session.info.pop('ledger_changed', False):
+        with session.get_bind().begin() as connection:
+            bump_data_version(connection, 'ledger')
+
+@event.listens_for(Session, 'after_soft_rollback')
+def discard_ledger_change(session, previous_transaction):
+    # A rolled back savepoint leaves the rest of the transaction's changes in place
+    if not previous_transaction.nested:
+        session.info.pop('ledger_changed', None)
+
+@event.listens_for(Session, 'before_flush')
+def balance_journal_entries(session, flush_context, instances):
+    """
+    Checks that every new journal entry (the new postings of one transaction,
+    or a posting without one) has equal debits and credits. An entry that
+    does not is logged and its difference posted to the Suspense Account, so
+    the ledger as a whole stays balanced. Runs before write_balance_deltas so
+    the suspense balance change is written in the same flush.
+    """
+    entries = {}
+    for obj in session.new:
+        if isinstance(obj, Posting) and obj.account is not None:
+            entries.setdefault(obj.transaction if obj.transaction is not None else obj, []).append(obj)
+    unbalanced = []
+    for lines in entries.values():
+        imbalance = journal_imbalance((line.account.type, line.amount) for line in lines)
+        if imbalance:
+            unbalanced.append((lines, imbalance))
+    if not unbalanced:
+        return
+    from app.system_accounts import suspense_account
+    suspense = suspense_account()
+    for lines, imbalance in unbalanced:
+        transaction = lines[0].transaction
+        if suspense is None:
+            logger.error(f"Journal entry '{lines[0].description}' does not balance by {imbalance:.2f} and there is no Suspense Account")
+            continue
+        logger.warning(f"Journal entry '{lines[0].description}' does not balance by {imbalance:.2f}; "
+                       f"posting the difference to {suspense.name}")
+        amount = debit_amount(suspense.type, -imbalance)
+        suspense.adjust_balance(amount)
+        session.add(Posting(account=suspense, transaction=transaction, amount=amount,
+                            date=lines[0].date, description=lines[0].description))
+
+@event.listens_for(Session, 'before_flush')
+def write_balance_deltas(session, flush_context, instances):
+    """Turns the balances changed by Account.adjust_balance into SQL-side increments."""
+    deltas = session.info.pop('pending_balance_deltas', None)
+    for account, delta in (deltas or {}).items():
+        if account not in session or account in session.deleted:
+            continue
+        # Skip accounts whose pending change was discarded (expired or refreshed).
+        if inspect(account).attrs.balance.history.has_changes():
+            account.balance = db.func.coalesce(Account.balance, 0.0) + delta
+
+@event.listens_for(Session, 'before_flush')
+def reopen_deleted_payouts(session, flush_context, instances):
+    """
+    A payout whose transaction is deleted is no longer paid, so the next run
+    for the period pays it again. The delete routes remove the payout's
+    commission and VAT entries with it (payout_service.delete_payout_entries),
+    so the new run does not charge them twice. A deleted entry is unlinked
+    from its payout.
+    """
+    entry_ids = set()
+    for obj in session.deleted:
+        if isinstance(obj, Transaction) and obj.category == 'payout':
+            item = obj.payout_run_item
+            if item is not None and item not in session.deleted:
+                item.status = 'pending'
+                item.transaction = None
+        elif isinstance(obj, Transaction) and obj.category in ('fee', 'vat'):
+            entry_ids.add(obj.id)
+    if entry_ids:
+        with session.no_autoflush:
+            columns = [getattr(PayoutRunItem, field) for field in PayoutRunItem.ENTRY_FIELDS]
+            for item in session.query(PayoutRunItem).filter(or_(*(column.in_(entry_ids) for column in columns))):
+                for field in PayoutRunItem.ENTRY_FIELDS:
+                    if getattr(item, field) in entry_ids:
+                        setattr(item, field, None)
+
+@event.listens_for(Session, 'after_soft_rollback')
+def discard_balance_deltas(session, previous_transaction):
+    session.info.pop('pending_balance_deltas', None)
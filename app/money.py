@@ -0,0 +1,60 @@
+from decimal import Decimal, ROUND_FLOOR, ROUND_HALF_UP
+from sqlalchemy.types import BigInteger, TypeDecorator
+
+def to_pence(amount):
+    """Converts an amount in pounds to whole pence, rounding half away from zero."""
+    if amount is None:
+        return None
+    # str() gives the shortest repr, so 0.1 + 0.2 becomes 30 pence rather than 30.000000000000004.
+    return int(Decimal(str(amount)).scaleb(2).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+def from_pence(pence):
+    """Converts whole pence to pounds as a float."""
+    if pence is None:
+        return None
+    return int(pence) / 100
+
+def round_money(amount):
+    """Rounds an amount in pounds to the nearest penny."""
+    return from_pence(to_pence(amount))
+
+def apply_rate(amount, rate):
+    """amount * rate (a commission or VAT rate), rounded to the nearest penny."""
+    if not rate:
+        return 0.0
+    return from_pence(int((Decimal(to_pence(amount)) * Decimal(str(rate))).quantize(Decimal(1), rounding=ROUND_HALF_UP)))
+
+def split(amount, weights):
+    """
+    Splits amount into parts proportional to weights that add up to amount
+    exactly, to the penny. Pence are floored per part and the pence left over
+    go to the parts with the largest remainders (earlier parts win ties).
+    """
+    total = to_pence(amount)
+    sign = -1 if total < 0 else 1
+    weights = [Decimal(str(weight)) for weight in weights]
+    weight_sum = sum(weights)
+    if not weight_sum:
+        raise ValueError("split weights must not add up to zero")
+    exact = [abs(total) * weight / weight_sum for weight in weights]
+    parts = [int(share.to_integral_value(rounding=ROUND_FLOOR)) for share in exact]
+    leftover = abs(total) - sum(parts)
+    by_remainder = sorted(range(len(parts)), key=lambda i: (-(exact[i] - parts[i]), i))
+    for i in by_remainder[:leftover]:
+        parts[i] += 1
+    return [from_pence(sign * part) for part in parts]
+
+class Money(TypeDecorator):
+    """
+    An amount in pounds stored as integer pence. Python sees floats rounded to
+    the penny, and SQL aggregates such as SUM run on integers and come back in
+    pounds.
+    """
+    impl = BigInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return to_pence(value)
+
+    def process_result_value(self, value, dialect):
+        return from_pence(value)
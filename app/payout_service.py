@@ -1,13 +1,24 @@
 
+import csv
+import io
+import re
+import threading
+import time
 from datetime import date, datetime
 from flask import session
+from sqlalchemy import exists, insert, update
+from sqlalchemy.orm import aliased
 from app import db
-from app.models import Landlord, Transaction, Account
-from app.accounting_service import allocate_transaction
+from app.models import Landlord, Transaction, Account, Tenant, Property, Posting, DataVersion, PayoutRun, PayoutRunItem, mark_ledger_changed
+from app.accounting_service import allocate_transaction, balance_postings, reverse_postings
+from app import system_accounts
+from app.metrics import timed
+from app.money import apply_rate, round_money
 import logging
 
 logging.basicConfig(level=logging.INFO)
 
+@timed('process_landlord_payout')
 def process_landlord_payout(landlord_id, start_date, end_date, vat_rate):
     landlord = Landlord.query.get(landlord_id)
     if not landlord:
@@ -17,50 +28,19 @@ def process_landlord_payout(landlord_id, start_date, end_date, vat_rate):
     if not landlord_account:
         raise ValueError("Landlord account not found")
 
-    # Get all transactions for the landlord within the specified date range to calculate the payout.
-    transactions = Transaction.query.filter(
-        Transaction.landlord_id == landlord.id,
-        Transaction.date.between(start_date, end_date)
-    ).all()
+    paid = PayoutRunItem.query.filter_by(landlord_id=landlord.id, start_date=start_date, end_date=end_date, status='paid').first()
+    if paid:
+        raise ValueError(f"{landlord.name} has already been paid for {start_date} to {end_date}.")
 
-    tenant_ids = [t.id for p in landlord.properties for t in p.tenants]
-    tenant_rent_transactions = Transaction.query.filter(
-        Transaction.tenant_id.in_(tenant_ids),
-        Transaction.category == 'rent',
-        Transaction.date.between(start_date, end_date)
-    ).all()
-
-    transactions.extend(tenant_rent_transactions)
-
-    # Filter out original rent transactions that have been split
-    split_rent_ids = [t.parent_transaction_id for t in transactions if t.category in ['rent_landlord_share', 'rent_utility_share']]
-    
-    final_transactions = [t for t in transactions if not (t.category == 'rent' and t.id in split_rent_ids)]
+    # Rent income, expenses, commission and VAT for the period, from grouped sums.
+    figure = payout_figures(start_date, end_date, vat_rate, [landlord.id])[0]
 
     payout_reference = landlord.reference_code
     logging.info(f"Payout reference for landlord {landlord_id}: {payout_reference}")
 
-    # Calculate rent income for commission calculation based on the landlord's actual share
-    rent_income_for_commission = sum(t.amount for t in final_transactions if t.category == 'rent_landlord_share' or (t.category == 'rent' and t.id not in split_rent_ids))
-
-    # Calculate agency commission and VAT on commission
-    agency_commission = rent_income_for_commission * landlord.commission_rate
-    vat_on_commission = agency_commission * vat_rate
-
-    # Calculate total expenses for the period
-    total_expenses = sum(t.amount for t in final_transactions if t.category == 'expense' and t.landlord_id == landlord_id)
-
-    # The payout amount is the rent income minus expenses, commission, and VAT.
-    # Note: expenses are stored as negative values, so we add them.
-    payout_amount = rent_income_for_commission + total_expenses - agency_commission - vat_on_commission
-
-    agency_income_account = Account.query.filter_by(name='Agency Income').first()
-    if not agency_income_account:
-        raise ValueError("Agency Income account not found")
-
-    vat_account = Account.query.filter_by(name='VAT Account').first()
-    if not vat_account:
-        raise ValueError("VAT account not found")
+    agency_commission = figure['commission']
+    vat_on_commission = figure['vat']
+    payout_amount = figure['payout']
 
     if 'current_date' in session:
         today = datetime.strptime(session['current_date'], '%Y-%m-%d').date()
@@ -68,9 +48,9 @@ def process_landlord_payout(landlord_id, start_date, end_date, vat_rate):
         today = date.today()
 
     # Get all the necessary accounts
-    bank_account = Account.query.filter_by(name='Master Bank Account').first()
-    agency_income_account = Account.query.filter_by(name='Agency Income').first()
-    vat_account = Account.query.filter_by(name='VAT Account').first()
+    bank_account = system_accounts.bank_account()
+    agency_income_account = system_accounts.agency_income_account()
+    vat_account = system_accounts.vat_account()
 
     if not bank_account:
         raise ValueError("Master Bank Account not found.")
@@ -80,64 +60,58 @@ def process_landlord_payout(landlord_id, start_date, end_date, vat_rate):
         raise ValueError("VAT account not found.")
 
     # 1. Landlord account (only negative transactions)
-    if landlord_account:
-        # Update landlord's balance
-        landlord_account.update_balance(-agency_commission)
-        landlord_account.update_balance(-vat_on_commission)
-        landlord_account.update_balance(-payout_amount)
-
-        db.session.add(Transaction(
-            date=today,
-            amount=-agency_commission,
-            description=f'Agency Commission {payout_reference}',
-            category='fee',
-            landlord_id=landlord.id,
-            account_id=landlord_account.id,
-            status='allocated',
-            reference_code=payout_reference
-        ))
-        db.session.add(Transaction(
-            date=today,
-            amount=-vat_on_commission,
-            description=f'VAT on Commission {payout_reference}',
-            category='vat',
-            landlord_id=landlord.id,
-            account_id=landlord_account.id,
-            status='allocated',
-            reference_code=payout_reference
-        ))
+    commission_transaction = Transaction(
+        date=today,
+        amount=-agency_commission,
+        description=f'Agency Commission {payout_reference}',
+        category='fee',
+        landlord_id=landlord.id,
+        account_id=landlord_account.id,
+        status='allocated',
+        reference_code=payout_reference
+    )
+    vat_transaction = Transaction(
+        date=today,
+        amount=-vat_on_commission,
+        description=f'VAT on Commission {payout_reference}',
+        category='vat',
+        landlord_id=landlord.id,
+        account_id=landlord_account.id,
+        status='allocated',
+        reference_code=payout_reference
+    )
+    db.session.add(commission_transaction)
+    db.session.add(vat_transaction)
 
     # 2. Agency Income (only positive, NOT landlord account)
-    if agency_income_account:
-        agency_income_account.update_balance(agency_commission)
-        db.session.add(Transaction(
-            date=today,
-            amount=agency_commission,
-            description=f'Agency Commission {payout_reference}',
-            category='fee',
-            account_id=agency_income_account.id,
-            status='allocated',
-            reference_code=payout_reference
-        ))
+    agency_income_transaction = Transaction(
+        date=today,
+        amount=agency_commission,
+        description=f'Agency Commission {payout_reference}',
+        category='fee',
+        account_id=agency_income_account.id,
+        status='allocated',
+        reference_code=payout_reference
+    )
+    db.session.add(agency_income_transaction)
 
     # 3. VAT (only positive, NOT landlord account)
-    if vat_account:
-        vat_account.update_balance(vat_on_commission)
-        db.session.add(Transaction(
-            date=today,
-            amount=vat_on_commission,
-            description=f'VAT on Commission {payout_reference}',
-            category='vat',
-            account_id=vat_account.id,
-            status='allocated',
-            reference_code=payout_reference
-        ))
+    vat_income_transaction = Transaction(
+        date=today,
+        amount=vat_on_commission,
+        description=f'VAT on Commission {payout_reference}',
+        category='vat',
+        account_id=vat_account.id,
+        status='allocated',
+        reference_code=payout_reference
+    )
+    db.session.add(vat_income_transaction)
 
     # 4. Landlord Payments (only negative, NOT landlord account)
-    landlord_payments_account = Account.query.filter_by(name='Landlord Payments').first()
+    landlord_payments_account = system_accounts.landlord_payments_account()
+    payout_transaction = None
     if landlord_payments_account:
-        landlord_payments_account.update_balance(-payout_amount)
-        db.session.add(Transaction(
+        payout_transaction = Transaction(
             date=today,
             amount=-payout_amount,
             description=f'Payout to {landlord.name}',
@@ -146,6 +120,429 @@ def process_landlord_payout(landlord_id, start_date, end_date, vat_rate):
             account_id=landlord_payments_account.id,
             status='allocated',
             reference_code=payout_reference
-        ))
+        )
+        db.session.add(payout_transaction)
+
+    # Post the landlord's side (debits) against each entry's other side (credits)
+    with db.session.no_autoflush:
+        landlord_account.update_balance(-agency_commission, commission_transaction)
+        agency_income_account.update_balance(agency_commission, commission_transaction)
+        landlord_account.update_balance(-vat_on_commission, vat_transaction)
+        vat_account.update_balance(vat_on_commission, vat_transaction)
+        landlord_account.update_balance(-payout_amount, payout_transaction, description=f'Payout to {landlord.name}')
+        if payout_transaction is not None:
+            landlord_payments_account.update_balance(-payout_amount, payout_transaction)
+
+    # Mark the period paid in the same commit as the postings, linked to the entries posted.
+    db.session.flush()
+    values = dict(_item_values(figure), status='paid', reason=None, processed_at=datetime.utcnow(),
+                  transaction_id=payout_transaction.id if payout_transaction else None,
+                  commission_transaction_id=commission_transaction.id, vat_transaction_id=vat_transaction.id,
+                  agency_income_transaction_id=agency_income_transaction.id,
+                  vat_income_transaction_id=vat_income_transaction.id)
+    period = PayoutRunItem.query.filter_by(landlord_id=landlord.id, start_date=start_date, end_date=end_date)
+    if not period.filter(PayoutRunItem.status != 'paid').update(values, synchronize_session=False):
+        # If a concurrent payout adds the item first, the unique constraint fails this commit.
+        db.session.add(PayoutRunItem(landlord_id=landlord.id, start_date=start_date, end_date=end_date, **values))
+
+    db.session.commit()
+
+SPLIT_CATEGORIES = ('rent_landlord_share', 'rent_utility_share')
+TOTAL_FIELDS = ('rent_income', 'expenses', 'commission', 'vat', 'payout')
+PREVIEW_CACHE_SIZE = 20000  # Landlord figures kept per process for the current ledger version
+PAYOUT_RUN_BATCH_SIZE = 200  # Landlords paid and committed together by a payout run
+BANK_FILE_BATCH_SIZE = 1000  # Payments fetched at a time while a bank file streams
+BANK_FIELD_LENGTH = 18  # Bacs limit for the payee name and the payment reference
+BANK_DISALLOWED = re.compile(r'[^A-Z0-9 .&/-]')  # Characters outside the Bacs character set
+
+_preview_lock = threading.Lock()
+_preview_cache = {}
+_preview_version = None
+
+def payout_entries(payout):
+    """
+    The commission and VAT entries posted together with a payout transaction,
+    as linked from its PayoutRunItem by process_landlord_payout or
+    process_payout_run: the landlord's side and the agency's of each.
+    """
+    item = payout.payout_run_item
+    entry_ids = [getattr(item, field) for field in PayoutRunItem.ENTRY_FIELDS] if item is not None else []
+    entry_ids = [entry_id for entry_id in entry_ids if entry_id is not None]
+    if not entry_ids:
+        return []
+    return Transaction.query.filter(Transaction.id.in_(entry_ids)).order_by(Transaction.id).all()
+
+def delete_payout_entries(payout):
+    """
+    Reverses and deletes the commission and VAT entries of a payout that is
+    being deleted, so the next run for the reopened period does not charge
+    them twice. Does not commit.
+    """
+    for entry in payout_entries(payout):
+        reverse_postings(entry)
+        db.session.delete(entry)
 
+def payout_sum_queries(start_date, end_date, landlord_ids=None):
+    """
+    The grouped sums payout figures are worked out from, as
+    {name: query of (landlord_id, total)}: landlord shares of split rent,
+    unsplit rent from their tenants (or coded to them) and expenses. Each
+    filters on category and date, served by ix_transaction_category_date.
+    """
+    period = Transaction.date.between(start_date, end_date)
+    child = aliased(Transaction)
+    is_split = exists().where(child.parent_transaction_id == Transaction.id, child.category.in_(SPLIT_CATEGORIES))
+    owner = db.func.coalesce(Property.landlord_id, Transaction.landlord_id)
+
+    shares = db.session.query(Transaction.landlord_id, db.func.sum(Transaction.amount)).filter(
+        Transaction.category == 'rent_landlord_share', period)
+    unsplit_rent = db.session.query(owner, db.func.sum(Transaction.amount)).select_from(Transaction).outerjoin(
+        Tenant, Tenant.id == Transaction.tenant_id).outerjoin(Property, Property.id == Tenant.property_id).filter(
+        Transaction.category == 'rent', period, ~is_split)
+    expenses = db.session.query(Transaction.landlord_id, db.func.sum(Transaction.amount)).filter(
+        Transaction.category == 'expense', period)
+    if landlord_ids is not None:
+        shares = shares.filter(Transaction.landlord_id.in_(landlord_ids))
+        unsplit_rent = unsplit_rent.filter(owner.in_(landlord_ids))
+        expenses = expenses.filter(Transaction.landlord_id.in_(landlord_ids))
+    return {
+        'shares': shares.group_by(Transaction.landlord_id),
+        'unsplit_rent': unsplit_rent.group_by(owner),
+        'expenses': expenses.group_by(Transaction.landlord_id),
+    }
+
+def payout_figures(start_date, end_date, vat_rate, landlord_ids=None):
+    """
+    Works out every landlord's payout for a period with three grouped sums,
+    following process_landlord_payout: rent income is the landlord's share of
+    split rent plus unsplit rent from their tenants (or coded to them), less
+    commission and VAT on commission, plus expenses (stored negative).
+    Returns one dict per landlord, ordered by name. account_id is None for
+    landlords without a landlord account.
+    """
+    sums = {name: dict(query.all()) for name, query in payout_sum_queries(start_date, end_date, landlord_ids).items()}
+    shares, unsplit_rent, expenses = sums['shares'], sums['unsplit_rent'], sums['expenses']
+    landlords = db.session.query(Landlord.id, Landlord.name, Landlord.reference_code, Landlord.commission_rate)
+    accounts = db.session.query(Account.landlord_id, db.func.min(Account.id)).filter(Account.type == 'landlord')
+    if landlord_ids is not None:
+        landlords = landlords.filter(Landlord.id.in_(landlord_ids))
+        accounts = accounts.filter(Account.landlord_id.in_(landlord_ids))
+    accounts = dict(accounts.group_by(Account.landlord_id).all())
+
+    figures = []
+    for landlord_id, name, reference_code, commission_rate in landlords.order_by(Landlord.name, Landlord.id):
+        rent_income = round_money((shares.get(landlord_id) or 0.0) + (unsplit_rent.get(landlord_id) or 0.0))
+        total_expenses = expenses.get(landlord_id) or 0.0
+        commission = apply_rate(rent_income, commission_rate)
+        vat = apply_rate(commission, vat_rate)
+        figures.append({
+            'landlord_id': landlord_id,
+            'name': name,
+            'reference_code': reference_code,
+            'account_id': accounts.get(landlord_id),
+            'rent_income': rent_income,
+            'expenses': total_expenses,
+            'commission': commission,
+            'vat': vat,
+            'payout': round_money(rent_income + total_expenses - commission - vat),
+        })
+    return figures
+
+def skip_reason(figure):
+    """Why a bulk run would not pay this landlord, or None if it would."""
+    if not figure['account_id']:
+        return 'No landlord account'
+    if not figure['rent_income'] and not figure['expenses']:
+        return 'Nothing to pay'
+    return None
+
+def payout_totals(figures):
+    return {key: round_money(sum(figure[key] for figure in figures)) for key in TOTAL_FIELDS}
+
+def ledger_version():
+    return db.session.query(DataVersion.version).filter_by(name='ledger').scalar() or 0
+
+@timed('preview_payouts')
+def preview_payouts(start_date, end_date, vat_rate, landlord_ids=None):
+    """
+    What a payout would post for every landlord (or those in landlord_ids),
+    without writing anything. Figures come from payout_figures and are kept
+    in memory per (landlord, period, VAT rate) for the current 'ledger'
+    version, so a repeated preview costs two small queries. Returns a dict
+    with the figures (each with its skip_reason), totals over the landlords
+    that would be paid and how many figures came from the cache.
+    """
+    global _preview_version
+    # Read the version first, so figures computed during a concurrent change are stored as stale.
+    version = ledger_version()
+    landlords = db.session.query(Landlord.id).order_by(Landlord.name, Landlord.id)
+    if landlord_ids is not None:
+        landlords = landlords.filter(Landlord.id.in_(landlord_ids))
+    ordered_ids = [landlord_id for landlord_id, in landlords]
+
+    period = (start_date, end_date, vat_rate)
+    with _preview_lock:
+        if _preview_version != version:
+            _preview_cache.clear()
+            _preview_version = version
+        cached = {landlord_id: _preview_cache.get(period + (landlord_id,)) for landlord_id in ordered_ids}
+    missing = [landlord_id for landlord_id, figure in cached.items() if figure is None]
+    if missing:
+        # An all-landlords preview with nothing cached reads every landlord without a long IN list.
+        wanted = None if landlord_ids is None and len(missing) == len(ordered_ids) else missing
+        computed = payout_figures(start_date, end_date, vat_rate, wanted)
+        for figure in computed:
+            figure['skip_reason'] = skip_reason(figure)
+            cached[figure['landlord_id']] = figure
+        with _preview_lock:
+            if _preview_version == version:
+                if len(_preview_cache) + len(computed) > PREVIEW_CACHE_SIZE:
+                    _preview_cache.clear()
+                _preview_cache.update((period + (figure['landlord_id'],), figure) for figure in computed)
+
+    # Paid status is read on every call: the cached figures only know what the ledger held
+    paid = {landlord_id for landlord_id, in db.session.query(PayoutRunItem.landlord_id).filter_by(
+        start_date=start_date, end_date=end_date, status='paid')}
+    figures = [dict(cached[landlord_id]) for landlord_id in ordered_ids if cached.get(landlord_id)]
+    for figure in figures:
+        if figure['landlord_id'] in paid:
+            figure['skip_reason'] = 'Already paid'
+    return {'start_date': start_date, 'end_date': end_date, 'vat_rate': vat_rate, 'ledger_version': version,
+            'figures': figures, 'totals': payout_totals([figure for figure in figures if not figure['skip_reason']]),
+            'cached': len(ordered_ids) - len(missing)}
+
+def _payout_entries(figure, payout_date, agency_income_account_id, vat_account_id, landlord_payments_account_id):
+    """
+    The transactions process_landlord_payout posts for one landlord, each with
+    its (account id, amount) postings. As there, the commission and VAT lines
+    are posted against the landlord's entries and the agency's are display rows.
+    The first four are the entries of PayoutRunItem.ENTRY_FIELDS, in that order,
+    and the payout comes last.
+    """
+    reference = figure['reference_code']
+    landlord_account_id = figure['account_id']
+    entry = dict(date=payout_date, landlord_id=None, status='allocated', reference_code=reference)
+    return [
+        (dict(entry, amount=-figure['commission'], description=f'Agency Commission {reference}', category='fee',
+              landlord_id=figure['landlord_id'], account_id=landlord_account_id),
+         [(landlord_account_id, -figure['commission']), (agency_income_account_id, figure['commission'])]),
+        (dict(entry, amount=-figure['vat'], description=f'VAT on Commission {reference}', category='vat',
+              landlord_id=figure['landlord_id'], account_id=landlord_account_id),
+         [(landlord_account_id, -figure['vat']), (vat_account_id, figure['vat'])]),
+        (dict(entry, amount=figure['commission'], description=f'Agency Commission {reference}', category='fee',
+              account_id=agency_income_account_id), []),
+        (dict(entry, amount=figure['vat'], description=f'VAT on Commission {reference}', category='vat',
+              account_id=vat_account_id), []),
+        (dict(entry, amount=-figure['payout'], description=f"Payout to {figure['name']}", category='payout',
+              landlord_id=figure['landlord_id'], account_id=landlord_payments_account_id),
+         [(landlord_payments_account_id, -figure['payout']), (landlord_account_id, -figure['payout'])]),
+    ]
+
+@timed('run_bulk_payout')
+def run_bulk_payout(start_date, end_date, vat_rate, payout_date=None, landlord_ids=None):
+    """
+    Pays out every landlord (or those in landlord_ids) for a period in one
+    unit of work: figures come from payout_figures, the payout transactions
+    and postings are bulk-inserted and each account balance gets one UPDATE.
+    Landlords without an account or with no rent and no expenses in the
+    period are skipped. Returns a summary dict for the report, with the ids
+    of each paid landlord's payout transaction and its commission and VAT
+    entries. Does not commit, and does not mark the period paid:
+    process_payout_run does that.
+    """
+    started = time.perf_counter()
+    payout_date = payout_date or date.today()
+    agency_income_account = system_accounts.agency_income_account()
+    vat_account = system_accounts.vat_account()
+    landlord_payments_account = system_accounts.landlord_payments_account()
+    if not agency_income_account:
+        raise ValueError("Agency Income account not found.")
+    if not vat_account:
+        raise ValueError("VAT account not found.")
+    if not landlord_payments_account:
+        raise ValueError("Landlord Payments account not found.")
+
+    paid, skipped, entries, payout_positions = [], [], [], []
+    for figure in payout_figures(start_date, end_date, vat_rate, landlord_ids):
+        reason = skip_reason(figure)
+        if reason:
+            skipped.append(dict(figure, reason=reason))
+        else:
+            paid.append(figure)
+            entries.extend(_payout_entries(figure, payout_date, agency_income_account.id, vat_account.id,
+                                           landlord_payments_account.id))
+            payout_positions.append(len(entries) - 1)  # The payout transaction comes last
+
+    if entries:
+        rows = [fields for fields, _ in entries]
+        transaction_ids = db.session.scalars(
+            insert(Transaction).returning(Transaction.id, sort_by_parameter_order=True), rows
+        ).all()
+        mark_ledger_changed(db.session)
+        account_ids = {account_id for _, postings in entries for account_id, _ in postings}
+        accounts = {account.id: account for account in Account.query.filter(Account.id.in_(account_ids))}
+        postings = []
+        for transaction_id, (fields, entry_postings) in zip(transaction_ids, entries):
+            for account_id, amount in entry_postings:
+                accounts[account_id].adjust_balance(amount)
+                postings.append({'transaction_id': transaction_id, 'account_id': account_id, 'date': payout_date,
+                                 'amount': amount, 'description': fields['description']})
+        db.session.execute(insert(Posting), balance_postings(postings))
+        for figure, position in zip(paid, payout_positions):
+            figure['transaction_id'] = transaction_ids[position]
+            figure['entry_ids'] = dict(zip(PayoutRunItem.ENTRY_FIELDS, transaction_ids[position - 4:position]))
+
+    totals = payout_totals(paid)
+    elapsed = time.perf_counter() - started
+    logging.info(f"Bulk payout {start_date} to {end_date}: {len(paid)} landlords paid, {len(skipped)} skipped, "
+                 f"{totals['payout']:.2f} paid out in {elapsed:.2f}s")
+    return {'start_date': start_date, 'end_date': end_date, 'payout_date': payout_date, 'vat_rate': vat_rate,
+            'paid': paid, 'skipped': skipped, 'totals': totals, 'transactions': len(entries), 'seconds': elapsed}
+
+def _item_values(figure):
+    return {key: figure[key] for key in TOTAL_FIELDS}
+
+def start_payout_run(start_date, end_date, vat_rate, payout_date=None, user_id=None):
+    """
+    Returns the unfinished run for the period, to be resumed with its own VAT
+    rate and payout date, or starts a new one. Unpaid items for the period
+    move to the run as pending, and every landlord without an item for the
+    period gets one. Commits.
+    """
+    run = PayoutRun.query.filter(
+        PayoutRun.start_date == start_date, PayoutRun.end_date == end_date, PayoutRun.status != 'complete'
+    ).order_by(PayoutRun.id.desc()).first()
+    if run is None:
+        run = PayoutRun(start_date=start_date, end_date=end_date, vat_rate=vat_rate,
+                        payout_date=payout_date or date.today(), user_id=user_id)
+        db.session.add(run)
+        db.session.flush()
+
+    period = (PayoutRunItem.start_date == start_date) & (PayoutRunItem.end_date == end_date)
+    PayoutRunItem.query.filter(period, PayoutRunItem.status != 'paid').update(
+        {'run_id': run.id, 'status': 'pending', 'reason': None}, synchronize_session=False)
+    has_item = exists().where(PayoutRunItem.landlord_id == Landlord.id, period)
+    new_ids = [landlord_id for landlord_id, in db.session.query(Landlord.id).filter(~has_item)]
+    if new_ids:
+        db.session.execute(insert(PayoutRunItem), [
+            {'run_id': run.id, 'landlord_id': landlord_id, 'start_date': start_date, 'end_date': end_date, 'status': 'pending'}
+            for landlord_id in new_ids
+        ])
+    db.session.commit()
+    return run
+
+@timed('process_payout_run')
+def process_payout_run(run, batch_size=PAYOUT_RUN_BATCH_SIZE):
+    """
+    Pays the run's pending landlords with run_bulk_payout, batch_size at a
+    time. Each batch commits together with its items, so a run that dies part
+    way has no half-paid landlords and is resumed by running it again: paid
+    landlords are skipped and the rest are processed. Returns the run report.
+    """
+    started = time.perf_counter()
+    run.status = 'running'
+    run.error = None
+    db.session.commit()
+    try:
+        while True:
+            pending = [item_id for item_id, in db.session.query(PayoutRunItem.id).filter(
+                PayoutRunItem.run_id == run.id, PayoutRunItem.status == 'pending'
+            ).order_by(PayoutRunItem.id).limit(batch_size)]
+            if not pending:
+                break
+            # Claim the batch. A concurrent resume of the run waits on these rows, then finds them taken.
+            claimed = dict(db.session.execute(
+                update(PayoutRunItem).where(PayoutRunItem.id.in_(pending), PayoutRunItem.status == 'pending')
+                .values(status='processing').returning(PayoutRunItem.landlord_id, PayoutRunItem.id),
+                execution_options={'synchronize_session': False}
+            ).all())
+            if not claimed:
+                db.session.commit()
+                continue
+            summary = run_bulk_payout(run.start_date, run.end_date, run.vat_rate, run.payout_date, list(claimed))
+            now = datetime.utcnow()
+            rows = {landlord_id: {'id': item_id, 'status': 'skipped', 'reason': 'Landlord not found', 'processed_at': now}
+                    for landlord_id, item_id in claimed.items()}
+            for figure in summary['paid']:
+                rows[figure['landlord_id']].update(_item_values(figure), status='paid', reason=None,
+                                                   transaction_id=figure['transaction_id'], **figure['entry_ids'])
+            for figure in summary['skipped']:
+                rows[figure['landlord_id']].update(_item_values(figure), reason=figure['reason'])
+            db.session.execute(update(PayoutRunItem), list(rows.values()))
+            db.session.commit()
+            logging.info(f"Payout run {run.id}: {len(summary['paid'])} paid, {len(summary['skipped'])} skipped in this batch")
+    except Exception as e:
+        db.session.rollback()
+        run.status = 'failed'
+        run.error = str(e)
+        run.finished_at = datetime.utcnow()
+        db.session.commit()
+        raise
+
+    run.status = 'complete'
+    run.finished_at = datetime.utcnow()
     db.session.commit()
+    return payout_run_report(run, seconds=time.perf_counter() - started)
+
+def payout_run_report(run, seconds=None):
+    """The run's items as a summary dict for the payout report, paid and skipped landlords ordered by name."""
+    paid, skipped = [], []
+    items = db.session.query(PayoutRunItem, Landlord.name).join(Landlord, Landlord.id == PayoutRunItem.landlord_id).filter(
+        PayoutRunItem.run_id == run.id).order_by(Landlord.name, Landlord.id)
+    for item, name in items:
+        figure = {'landlord_id': item.landlord_id, 'name': name, 'status': item.status, 'reason': item.reason,
+                  'transaction_id': item.transaction_id}
+        figure.update({key: getattr(item, key) or 0.0 for key in TOTAL_FIELDS})
+        (paid if item.status == 'paid' else skipped).append(figure)
+    return {'run': run, 'start_date': run.start_date, 'end_date': run.end_date, 'payout_date': run.payout_date,
+            'vat_rate': run.vat_rate, 'paid': paid, 'skipped': skipped, 'totals': payout_totals(paid),
+            'transactions': 5 * len(paid), 'seconds': seconds}
+
+def bank_details(sort_code, account_number):
+    """The sort code and account number as digits, or None unless they are the 6 and 8 digits a Bacs payment needs."""
+    sort_code = re.sub(r'\D', '', sort_code or '')
+    account_number = re.sub(r'\D', '', account_number or '')
+    if len(sort_code) != 6 or len(account_number) != 8:
+        return None
+    return sort_code, account_number
+
+def _bank_field(value):
+    return BANK_DISALLOWED.sub('', (value or '').upper())[:BANK_FIELD_LENGTH].strip()
+
+def _run_payments(run):
+    """The run's posted payout transactions that pay money out, with the landlord's bank details."""
+    return db.session.query(
+        Landlord.name, Landlord.bank_sort_code, Landlord.bank_account_number, Transaction.amount, Transaction.reference_code
+    ).select_from(PayoutRunItem).join(Transaction, Transaction.id == PayoutRunItem.transaction_id).join(
+        Landlord, Landlord.id == PayoutRunItem.landlord_id
+    ).filter(PayoutRunItem.run_id == run.id, PayoutRunItem.status == 'paid', Transaction.amount < 0).order_by(PayoutRunItem.id)
+
+def bank_file_rows(run):
+    """
+    Yields the run's bank payment file one row at a time, in Bacs bulk
+    payment CSV layout: sort code, account number, payee name, amount and
+    reference. Rows are read from the posted payout transactions
+    BANK_FILE_BATCH_SIZE at a time. Landlords without valid bank details are
+    left out and logged; bank_file_exceptions lists them.
+    """
+    for name, sort_code, account_number, amount, reference in _run_payments(run).yield_per(BANK_FILE_BATCH_SIZE):
+        details = bank_details(sort_code, account_number)
+        if details is None:
+            logging.warning(f"Payout run {run.id}: no valid bank details for {name}, left out of the bank file")
+            continue
+        yield [details[0], details[1], _bank_field(name), f'{-amount:.2f}', _bank_field(reference)]
+
+def stream_bank_file(run):
+    """bank_file_rows as CSV text, one line per chunk."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\r\n')
+    for row in bank_file_rows(run):
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+def bank_file_exceptions(run):
+    """[(landlord name, payout)] for paid landlords the bank file leaves out for missing or invalid bank details."""
+    return [(name, -amount) for name, sort_code, account_number, amount, _ in _run_payments(run)
+            if bank_details(sort_code, account_number) is None]
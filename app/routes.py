@@ -1,32 +1,42 @@
 # app/routes.py
 from functools import wraps
-from flask import render_template, flash, redirect, url_for, request, jsonify, Blueprint, send_from_directory, current_app, session
+from flask import render_template, flash, redirect, url_for, request, jsonify, Blueprint, send_from_directory, current_app, session, Response, stream_with_context
 from urllib.parse import urlsplit
-from . import db
+from . import db, metrics, system_accounts
 from app.forms import (
     LoginForm, RegistrationForm, ManualExpenseForm, ManualRentForm, ChangeDateForm,
     AddTenantForm, AddLandlordForm, AddPropertyForm, EditTenantForm, DeleteTenantForm,
     EditLandlordForm, DeleteLandlordForm, EditPropertyForm, DeletePropertyForm,
     PayoutForm, DateRangeForm, CompanyForm, EditUserForm, AddAccountForm,
-    StatementGenerationForm, AddLandlordReferenceForm
+    StatementGenerationForm, AddLandlordReferenceForm, BulkPayoutForm, PayoutPreviewForm, StatementBatchForm
 )
 from flask_login import current_user, login_user, logout_user, login_required
 from app.models import (
     User, Transaction, Tenant, Landlord, Property, Account, AllocationHistory,
-    Statement, AuditLog, Expense, RentChargeBatch, Company, Role, LandlordReference
+    Statement, AuditLog, Expense, RentChargeBatch, Company, Role, LandlordReference,
+    ImportCheckpoint, Job, SuggestionCache, LearnedMatch, Posting,
+    BalanceDiscrepancy, PayoutRun, PayoutRunItem, mark_ledger_changed
 )
 from werkzeug.utils import secure_filename
 import os
-import pandas as pd
+import uuid
 from datetime import datetime, timedelta, date
-from app.accounting_service import allocate_transaction
+from app.accounting_service import allocate_transaction, allocate_transactions, ledger_postings, reverse_postings
+from app.accounting_service import recalculate_balances as recalculate_all_balances
+from app.matching_service import remember_allocation
+from app.suggestion_service import cached_suggestions
+from app.drift_service import check_balance_drift, open_discrepancies, reset_drift_checks
+from app.job_service import enqueue_job, job_status
 from sqlalchemy import or_, func, extract
-from app.payout_service import process_landlord_payout
+from app.payout_service import (
+    process_landlord_payout, preview_payouts, start_payout_run, process_payout_run, payout_run_report,
+    stream_bank_file, bank_file_exceptions, delete_payout_entries
+)
 from app.statement_generator import generate_monthly_statement, generate_annual_statement, generate_tenant_statement
 from sqlalchemy.exc import IntegrityError
 import calendar
+import math
 import sqlalchemy as sa
-import difflib
 from app.db_routes import role_required
 
 
@@ -59,37 +69,26 @@ def log_action(action, details=''):
 @role_required('admin')
 def recalculate_balances(account_id=None):
     """
-    Temporary route to recalculate all account balances.
+    Recalculates account balances from the ledger. With ?dry_run=1 it only
+    shows which accounts would change and by how much, and which disagree
+    with their transactions.
     """
     try:
         if account_id:
-            accounts = [Account.query.get_or_404(account_id)]
-        else:
-            accounts = Account.query.all()
-        
-        for account in accounts:
-            if account.name == 'Master Bank Account':
-                continue # Calculate this last
-
-            balance = 0
-            if account.tenant_id:
-                rent_charges = db.session.query(func.sum(Transaction.amount)).filter(Transaction.tenant_id == account.tenant_id, Transaction.category == 'rent_charge').scalar() or 0
-                rent_paid = db.session.query(func.sum(Transaction.amount)).filter(Transaction.tenant_id == account.tenant_id, Transaction.category == 'rent').scalar() or 0
-                balance = rent_paid + rent_charges
-            elif account.landlord_id:
-                balance = db.session.query(func.sum(Transaction.amount)).filter(Transaction.landlord_id == account.landlord_id).scalar() or 0
-            else:
-                balance = db.session.query(func.sum(Transaction.amount)).filter(Transaction.account_id == account.id).scalar() or 0.0
-            
-            account.balance = balance
-
-        master_bank = Account.query.filter_by(name='Master Bank Account').first()
-        if master_bank and (not account_id or master_bank.id == account_id):
-            total_bank_amount = db.session.query(func.sum(Transaction.amount)).filter(Transaction.account_id == master_bank.id).scalar() or 0.0
-            master_bank.balance = total_bank_amount
+            Account.query.get_or_404(account_id)
+        account_ids = [account_id] if account_id else None
+        if request.args.get('dry_run'):
+            changes = recalculate_all_balances(account_ids, dry_run=True)
+            return render_template('admin/recalculate_balances.html', changes=changes, account_id=account_id)
 
+        changes = recalculate_all_balances(account_ids)
         db.session.commit()
         flash('All account balances have been successfully recalculated.', 'success')
+        disagreeing = [change['name'] for change in changes
+                       if change['transactions'] is not None and abs(change['transactions'] - change['new']) > 0.001]
+        if disagreeing:
+            flash(f"The ledger disagrees with the transactions for: {', '.join(disagreeing)}. "
+                  f"Use the dry run to compare them.", 'warning')
     except Exception as e:
         db.session.rollback()
         flash(f'An error occurred during recalculation: {str(e)}', 'danger')
@@ -115,211 +114,29 @@ def upload_file():
             return redirect(request.url)
         if file and allowed_file(file.filename):
             filename = secure_filename(file.filename)
-            file_path = os.path.join(os.getcwd(), 'app', 'uploads', filename)
+            # A unique name keeps a second upload of the same file name from replacing one still queued.
+            file_path = os.path.join(os.getcwd(), 'app', 'uploads', f'{uuid.uuid4().hex}_{filename}')
             file.save(file_path)
-            messages = process_csv(file_path)
-            for message in messages:
-                flash(message)
-            recalculate_balances(account_id=Account.query.filter_by(name='Master Bank Account').first().id)
-            return redirect(url_for('main.uncoded_transactions'))
+            job = enqueue_job('bank_import', {
+                'file_path': file_path,
+                'chunk_size': current_app.config['IMPORT_CHUNK_SIZE'],
+                'match_workers': current_app.config['MATCH_WORKERS']
+            }, user_id=current_user.id)
+            flash(f'{filename} has been queued for import.')
+            return redirect(url_for('main.job_detail', job_id=job.id))
     return render_template('upload.html', title='Upload CSV')
 
-def process_csv(file_path):
-    messages = []
-    bank_account = Account.query.filter_by(name='Master Bank Account').first()
-    if not bank_account:
-        messages.append('Bank Account not found. Please create it in the accounts section.')
-        return messages
-
-    try:
-        df = pd.read_csv(file_path)
-        for index, row in df.iterrows():
-            try:
-                date_str = row.get('Date', row.get('date'))
-                if not isinstance(date_str, str) or pd.isna(date_str):
-                    continue
-
-                amount = row.get('Amount', row.get('amount'))
-                if pd.isna(amount):
-                    continue
-                amount = float(amount)
-
-                description = row.get('Memo', row.get('description', ''))
-                reference_code = row.get('Subcategory', row.get('reference_code', ''))
-
-                try:
-                    date = datetime.strptime(date_str, '%Y-%m-%d').date()
-                except ValueError:
-                    try:
-                        date = datetime.strptime(date_str, '%d/%m/%Y').date()
-                    except ValueError:
-                        continue
-
-                if amount == 0:
-                    continue
-
-                transaction = Transaction(
-                    date=date,
-                    amount=amount,
-                    description=description,
-                    reference_code=reference_code,
-                    account_id=bank_account.id
-                )
-
-                matched, match_type, match_id = match_transaction(transaction)
-                if matched:
-                    transaction.status = 'coded'
-                    if match_type == 'tenant':
-                        transaction.tenant_id = match_id
-                    else:
-                        transaction.landlord_id = match_id
-                else:
-                    transaction.status = 'uncoded'
-
-                db.session.add(transaction)
-
-                if transaction.status == 'coded':
-                    allocate_transaction(transaction)
-
-            except Exception as e:
-                messages.append(f"Error processing row {index}: {str(e)}")
-                continue
-        db.session.commit()
-        messages.append(f'{len(df)} transactions processed successfully.')
-
-    except Exception as e:
-        messages.append(f'Error processing CSV: {str(e)}')
-    
-    return messages
-
-def get_partial_ratio(long_text, pattern):
-    long_text = long_text.upper()
-    pattern = pattern.upper()
-    if len(pattern) > len(long_text):
-        long_text, pattern = pattern, long_text
-    len_p = len(pattern)
-    max_ratio = 0
-    for i in range(len(long_text) - len_p + 1):
-        sub = long_text[i:i + len_p]
-        matcher = difflib.SequenceMatcher(None, sub, pattern)
-        ratio = matcher.ratio()
-        if ratio > max_ratio:
-            max_ratio = ratio
-    return max_ratio * 100
-
-def match_transaction(transaction):
-    tenants = Tenant.query.all()
-    landlords = Landlord.query.all()
-
-    raw_text = ((transaction.description or '') + ' ' + (transaction.reference_code or ''))
-    text = ''.join(raw_text.upper().split())
-
-    if transaction.reference_code:
-        normalized_trans_ref = ''.join(transaction.reference_code.upper().split())
-        for tenant in tenants:
-            if tenant.reference_code and normalized_trans_ref == ''.join(tenant.reference_code.upper().split()):
-                transaction.category = 'rent'
-                return True, 'tenant', tenant.id
-        for landlord in landlords:
-            all_refs = [landlord.reference_code] + [ref.reference_code for ref in landlord.references]
-            for ref_code in all_refs:
-                if ref_code and normalized_trans_ref == ''.join(ref_code.upper().split()):
-                    if transaction.amount > 0:
-                        transaction.category = 'payment'
-                    else:
-                        transaction.category = 'expense'
-                    return True, 'landlord', landlord.id
-
-    if transaction.amount > 0:
-        for tenant in tenants:
-            if tenant.name:
-                name_norm = ''.join(tenant.name.upper().split())
-                name_score = get_partial_ratio(text, name_norm)
-                if name_score >= 85:
-                    transaction.category = 'rent'
-                    return True, 'tenant', tenant.id
-
-    for tenant in tenants:
-        if tenant.reference_code:
-            ref_norm = ''.join(tenant.reference_code.upper().split())
-            ref_score = get_partial_ratio(text, ref_norm)
-            if ref_score >= 85:
-                if transaction.amount > 0:
-                    transaction.category = 'rent'
-                else:
-                    transaction.category = 'fee'
-                return True, 'tenant', tenant.id
-        if tenant.name:
-            name_norm = ''.join(tenant.name.upper().split())
-            name_score = get_partial_ratio(text, name_norm)
-            if name_score >= 85:
-                if transaction.amount > 0:
-                    transaction.category = 'rent'
-                else:
-                    transaction.category = 'fee'
-                return True, 'tenant', tenant.id
-
-    for landlord in landlords:
-        all_refs = [landlord.reference_code] + [ref.reference_code for ref in landlord.references]
-        for ref_code in all_refs:
-            if ref_code:
-                ref_norm = ''.join(ref_code.upper().split())
-                ref_score = get_partial_ratio(text, ref_norm)
-                if ref_score >= 85:
-                    if transaction.amount > 0:
-                        transaction.category = 'payment'
-                    else:
-                        transaction.category = 'expense'
-                    return True, 'landlord', landlord.id
-        if landlord.name:
-            name_norm = ''.join(landlord.name.upper().split())
-            name_score = get_partial_ratio(text, name_norm)
-            if name_score >= 85:
-                if transaction.amount > 0:
-                    transaction.category = 'payment'
-                else:
-                    transaction.category = 'expense'
-                return True, 'landlord', landlord.id
-
-    return False, None, None
-
-def get_suggestions(transaction):
-    suggestions = []
-    tenants = Tenant.query.all()
-    landlords = Landlord.query.all()
+@main_bp.route('/jobs/<int:job_id>')
+@login_required
+def job_detail(job_id):
+    job = Job.query.get_or_404(job_id)
+    return render_template('job_status.html', job=job, status=job_status(job))
 
-    raw_text = ((transaction.description or '') + ' ' + (transaction.reference_code or ''))
-    text = ''.join(raw_text.upper().split())
-
-    # Tenant suggestions
-    for tenant in tenants:
-        if tenant.name:
-            name_norm = ''.join(tenant.name.upper().split())
-            name_score = get_partial_ratio(text, name_norm)
-            if name_score >= 85:
-                suggestions.append(('tenant', tenant.id, f"Tenant: {tenant.name} (Name Match: {name_score:.2f}%)"))
-        if tenant.reference_code:
-            ref_norm = ''.join(tenant.reference_code.upper().split())
-            ref_score = get_partial_ratio(text, ref_norm)
-            if ref_score >= 85:
-                suggestions.append(('tenant', tenant.id, f"Tenant: {tenant.name} (Ref Match: {ref_score:.2f}%)"))
-
-    # Landlord suggestions
-    for landlord in landlords:
-        if landlord.name:
-            name_norm = ''.join(landlord.name.upper().split())
-            name_score = get_partial_ratio(text, name_norm)
-            if name_score >= 85:
-                suggestions.append(('landlord', landlord.id, f"Landlord: {landlord.name} (Name Match: {name_score:.2f}%)"))
-        if landlord.reference_code:
-            all_refs = [landlord.reference_code] + [ref.reference_code for ref in landlord.references]
-            for ref_code in all_refs:
-                ref_norm = ''.join(ref_code.upper().split())
-                ref_score = get_partial_ratio(text, ref_norm)
-                if ref_score >= 85:
-                    suggestions.append(('landlord', landlord.id, f"Landlord: {landlord.name} (Ref Match: {ref_score:.2f}%)"))
-
-    return suggestions
+@main_bp.route('/jobs/<int:job_id>/status')
+@login_required
+def job_status_json(job_id):
+    job = Job.query.get_or_404(job_id)
+    return jsonify(job_status(job))
 
 @main_bp.route('/uncoded')
 @login_required
@@ -327,7 +144,7 @@ def uncoded_transactions():
     uncoded = Transaction.query.filter_by(status='uncoded').all()
     tenants = Tenant.query.all()
     landlords = Landlord.query.all()
-    transactions_with_suggestions = [(trans, get_suggestions(trans)) for trans in uncoded]
+    transactions_with_suggestions = cached_suggestions(uncoded)
     return render_template('uncoded.html', transactions_with_suggestions=transactions_with_suggestions, tenants=tenants, landlords=landlords)
 
 @main_bp.route('/allocate', methods=['POST'])
@@ -346,10 +163,12 @@ def allocate():
         transaction.category = 'expense'
 
     transaction.status = 'coded'
+    db.session.add(AllocationHistory(transaction_id=transaction.id, allocated_to=f'{allocation_type}:{target_id}',
+                                     user_id=current_user.id, notes=request.form.get('notes')))
+    remember_allocation(transaction, user_id=current_user.id)
     allocate_transaction(transaction)
+    recalculate_all_balances(account_ids=[system_accounts.bank_account().id, transaction.account_id])
     db.session.commit()
-    recalculate_balances(account_id=Account.query.filter_by(name='Master Bank Account').first().id)
-    recalculate_balances(account_id=transaction.account_id)
 
     flash('Transaction allocated successfully')
     return redirect(url_for('main.uncoded_transactions'))
@@ -396,6 +215,38 @@ def statements():
 
     return render_template('statements.html', landlords=landlords, form=form)
 
+@main_bp.route('/admin/statements/batch', methods=['GET', 'POST'])
+@login_required
+@role_required('admin')
+def statement_batch():
+    form = StatementBatchForm()
+    if form.validate_on_submit():
+        statement_type = form.statement_type.data
+        if statement_type == 'annual' and not form.year.data:
+            flash('Enter the year of the annual statements.', 'danger')
+        elif statement_type != 'annual' and not (form.start_date.data and form.end_date.data):
+            flash('Enter the start and end dates of the statements.', 'danger')
+        else:
+            job = enqueue_job('statement_batch', {
+                'statement_type': statement_type,
+                'start_date': form.start_date.data.isoformat() if form.start_date.data else None,
+                'end_date': form.end_date.data.isoformat() if form.end_date.data else None,
+                'year': int(form.year.data) if form.year.data else None,
+                'vat_rate': form.vat_rate.data,
+                'workers': current_app.config['STATEMENT_WORKERS']
+            }, user_id=current_user.id)
+            flash('Statement batch has been queued.')
+            return redirect(url_for('main.job_detail', job_id=job.id))
+
+    if request.method == 'GET':
+        current_date_str = session.get('current_date')
+        today = datetime.strptime(current_date_str, '%Y-%m-%d').date() if current_date_str else date.today()
+        form.start_date.data = today.replace(day=1)
+        form.end_date.data = today.replace(day=calendar.monthrange(today.year, today.month)[1])
+        form.year.data = str(today.year)
+
+    return render_template('admin/statement_batch.html', form=form)
+
 @main_bp.route('/tenant_statement', methods=['GET', 'POST'])
 @login_required
 def tenant_statement():
@@ -433,6 +284,7 @@ def generate_rent_charges():
         db.session.commit()
 
         tenants = Tenant.query.filter(Tenant.property_id.isnot(None)).all()
+        rent_charges = []
         for tenant in tenants:
             existing_charge = Transaction.query.filter(
                 Transaction.tenant_id == tenant.id,
@@ -452,7 +304,8 @@ def generate_rent_charges():
                     rent_charge_batch_id=batch.id
                 )
                 db.session.add(rent_charge)
-                allocate_transaction(rent_charge)
+                rent_charges.append(rent_charge)
+        allocate_transactions(rent_charges)
         
         db.session.commit()
         flash(f'Rent charges generated for {len(tenants)} tenants.')
@@ -476,10 +329,7 @@ def rent_charge_batches():
 def rollback_rent_charges(batch_id):
     batch = RentChargeBatch.query.get_or_404(batch_id)
     for transaction in batch.transactions:
-        if transaction.tenant_id:
-            tenant_account = Account.query.filter_by(tenant_id=transaction.tenant_id).first()
-            if tenant_account:
-                tenant_account.update_balance(-transaction.amount)
+        reverse_postings(transaction, description=f'Rollback of rent charge batch {batch.id}')
         db.session.delete(transaction)
     
     db.session.delete(batch)
@@ -499,7 +349,21 @@ def accounts():
     main_accounts = Account.query.filter(Account.tenant_id.is_(None), Account.landlord_id.is_(None)).order_by(Account.name).all()
     tenant_accounts = Account.query.filter(Account.tenant_id.isnot(None)).order_by(Account.name).all()
     landlord_accounts = Account.query.filter(Account.landlord_id.isnot(None)).order_by(Account.name).all()
-    return render_template('accounts.html', main_accounts=main_accounts, tenant_accounts=tenant_accounts, landlord_accounts=landlord_accounts)
+    return render_template('accounts.html', main_accounts=main_accounts, tenant_accounts=tenant_accounts, landlord_accounts=landlord_accounts,
+                           discrepancies=open_discrepancies())
+
+@main_bp.route('/admin/balance-drift/check', methods=['POST'])
+@login_required
+@role_required('admin')
+def check_balance_drift_route():
+    try:
+        summary = check_balance_drift(full=bool(request.form.get('full')))
+        db.session.commit()
+        flash(f"Checked {summary['checked']} accounts: {summary['drifted']} drifted, {summary['resolved']} resolved.", 'success')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'An error occurred during the balance check: {str(e)}', 'danger')
+    return redirect(url_for('main.accounts'))
 
 @main_bp.route('/account_transactions/<int:account_id>')
 @login_required
@@ -538,42 +402,13 @@ def delete_transaction_from_account(transaction_id):
     tenant_id = transaction.tenant_id
     landlord_id = transaction.landlord_id
 
-    # Reverse amounts from other affected accounts if necessary
-    if transaction.category == 'fee':
-        agency_income_account = Account.query.filter_by(name='Agency Income').first()
-        if agency_income_account:
-            agency_income_account.update_balance(-transaction.amount) # Reverse the fee
-    elif transaction.category == 'vat':
-        vat_account = Account.query.filter_by(name='VAT Account').first()
-        if vat_account:
-            vat_account.update_balance(-transaction.amount) # Reverse the VAT
-    elif transaction.category == 'payout':
-        landlord_payments_account = Account.query.filter_by(name='Landlord Payments').first()
-        if landlord_payments_account:
-            landlord_payments_account.update_balance(-transaction.amount) # Reverse the payout
-
+    # Reverse every line the transaction posted, on whichever accounts it touched
+    if transaction.category == 'payout':
+        delete_payout_entries(transaction)
+    reverse_postings(transaction)
     db.session.delete(transaction)
     db.session.commit()
 
-    if account_id:
-        recalculate_balances(account_id=account_id)
-    if tenant_id:
-        tenant_account = Account.query.filter_by(tenant_id=tenant_id).first()
-        if tenant_account:
-            recalculate_balances(account_id=tenant_account.id)
-    if landlord_id:
-        landlord_account = Account.query.filter_by(landlord_id=landlord_id).first()
-        if landlord_account:
-            recalculate_balances(account_id=landlord_account.id)
-
-    # Recalculate balances for other affected accounts
-    if transaction.category == 'fee':
-        recalculate_balances(account_id=Account.query.filter_by(name='Agency Income').first().id)
-    elif transaction.category == 'vat':
-        recalculate_balances(account_id=Account.query.filter_by(name='VAT Account').first().id)
-    elif transaction.category == 'payout':
-        recalculate_balances(account_id=Account.query.filter_by(name='Landlord Payments').first().id)
-
     flash('Transaction deleted successfully!', 'success')
 
     if tenant_id:
@@ -887,6 +722,102 @@ def landlord_payout(landlord_id):
 
     return render_template('landlord_payout.html', form=form, landlord=landlord)
 
+@main_bp.route('/admin/payouts', methods=['GET', 'POST'])
+@login_required
+@role_required('admin')
+def bulk_payout():
+    form = BulkPayoutForm()
+    if form.validate_on_submit():
+        run = start_payout_run(form.start_date.data, form.end_date.data, form.vat_rate.data,
+                               payout_date=form.payout_date.data, user_id=current_user.id)
+        if (run.vat_rate, run.payout_date) != (form.vat_rate.data, form.payout_date.data):
+            flash(f'Resuming payout run {run.id} with its VAT rate {run.vat_rate} and payout date {run.payout_date}.', 'info')
+        return process_run_and_report(run)
+
+    if request.method == 'GET':
+        current_date_str = session.get('current_date')
+        today = datetime.strptime(current_date_str, '%Y-%m-%d').date() if current_date_str else date.today()
+        form.start_date.data = today.replace(day=1)
+        form.end_date.data = today.replace(day=calendar.monthrange(today.year, today.month)[1])
+        form.payout_date.data = today
+
+    runs = PayoutRun.query.order_by(PayoutRun.id.desc()).limit(20).all()
+    return render_template('admin/bulk_payout.html', form=form, runs=runs)
+
+def process_run_and_report(run):
+    try:
+        summary = process_payout_run(run)
+        flash(f"Payout run {run.id} complete: {len(summary['paid'])} landlords paid.", 'success')
+        return render_template('admin/payout_report.html', summary=summary, bank_exceptions=bank_file_exceptions(run))
+    except ValueError as e:
+        flash(f'Payout run {run.id} stopped: {e} Landlords paid so far stay paid; resume the run to pay the rest.', 'danger')
+        return redirect(url_for('main.bulk_payout'))
+
+@main_bp.route('/admin/payouts/runs/<int:run_id>')
+@login_required
+@role_required('admin')
+def payout_run(run_id):
+    run = PayoutRun.query.get_or_404(run_id)
+    return render_template('admin/payout_report.html', summary=payout_run_report(run),
+                           bank_exceptions=bank_file_exceptions(run))
+
+@main_bp.route('/admin/payouts/runs/<int:run_id>/bank_file')
+@login_required
+@role_required('admin')
+def payout_run_bank_file(run_id):
+    run = PayoutRun.query.get_or_404(run_id)
+    if run.status != 'complete':
+        flash(f'Payout run {run.id} is not complete; resume it before downloading the bank file.', 'warning')
+        return redirect(url_for('main.payout_run', run_id=run.id))
+    log_action('Downloaded bank payment file', f'Payout run {run.id}')
+    filename = f'payout_run_{run.id}_{run.payout_date:%Y%m%d}.csv'
+    return Response(stream_with_context(stream_bank_file(run)), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+@main_bp.route('/admin/payouts/runs/<int:run_id>/resume', methods=['POST'])
+@login_required
+@role_required('admin')
+def resume_payout_run(run_id):
+    run = PayoutRun.query.get_or_404(run_id)
+    if run.status == 'complete':
+        flash(f'Payout run {run.id} is already complete.', 'info')
+        return redirect(url_for('main.payout_run', run_id=run.id))
+    return process_run_and_report(start_payout_run(run.start_date, run.end_date, run.vat_rate, run.payout_date))
+
+@main_bp.route('/payouts/preview')
+@login_required
+def payout_preview():
+    if 'start_date' in request.args:
+        form = PayoutPreviewForm(request.args, meta={'csrf': False})
+    else:
+        current_date_str = session.get('current_date')
+        today = datetime.strptime(current_date_str, '%Y-%m-%d').date() if current_date_str else date.today()
+        form = PayoutPreviewForm(formdata=None, meta={'csrf': False}, start_date=today.replace(day=1),
+                                 end_date=today.replace(day=calendar.monthrange(today.year, today.month)[1]),
+                                 landlord_id=request.args.get('landlord_id', 0, type=int))
+    form.landlord_id.choices = [(0, 'All landlords')] + [(l.id, l.name) for l in Landlord.query.order_by(Landlord.name)]
+
+    preview = None
+    if form.validate():
+        preview = preview_payouts(form.start_date.data, form.end_date.data, form.vat_rate.data,
+                                  [form.landlord_id.data] if form.landlord_id.data else None)
+    return render_template('payout_preview.html', form=form, preview=preview)
+
+@main_bp.route('/payouts/preview.json')
+@login_required
+def payout_preview_json():
+    try:
+        start_date = datetime.strptime(request.args['start_date'], '%Y-%m-%d').date()
+        end_date = datetime.strptime(request.args['end_date'], '%Y-%m-%d').date()
+        vat_rate = float(request.args.get('vat_rate', 0.2))
+        if not math.isfinite(vat_rate) or not 0 <= vat_rate <= 1:
+            raise ValueError(vat_rate)
+    except (KeyError, ValueError):
+        return jsonify({'error': 'start_date and end_date (YYYY-MM-DD) are required and vat_rate must be a number between 0 and 1.'}), 400
+    landlord_id = request.args.get('landlord_id', type=int)
+    preview = preview_payouts(start_date, end_date, vat_rate, [landlord_id] if landlord_id else None)
+    return jsonify(dict(preview, start_date=start_date.isoformat(), end_date=end_date.isoformat()))
+
 @main_bp.route('/landlord/<int:id>/account')
 @login_required
 def landlord_account(id):
@@ -894,28 +825,10 @@ def landlord_account(id):
     account = Account.query.filter_by(landlord_id=id).first_or_404()
     balance = account.balance
 
-    # Get tenant_ids for all properties of the landlord
-    tenant_ids = [tenant.id for prop in landlord.properties for tenant in prop.tenants]
-
-    # Query for transactions related to the landlord
-    transactions_query = Transaction.query.filter(
-        or_(
-            Transaction.landlord_id == id,
-            Transaction.tenant_id.in_(tenant_ids)
-        )
-    )
-
-    # Filter out original rent transactions that have been split and rent_charge transactions
-    all_transactions = transactions_query.filter(Transaction.category != 'rent_charge').order_by(Transaction.date.desc()).all()
-    
-    final_transactions = []
-    for t in all_transactions:
-        # If a transaction is a 'rent' transaction and has children, skip it
-        if t.category == 'rent' and t.child_transactions.count() > 0:
-            continue
-        final_transactions.append(t)
+    # The account's ledger, newest first
+    postings = ledger_postings(account.id)[::-1]
 
-    return render_template('landlord_account.html', landlord=landlord, account=account, balance=balance, transactions=final_transactions)
+    return render_template('landlord_account.html', landlord=landlord, account=account, balance=balance, postings=postings)
 
 @main_bp.route('/login', methods=['GET', 'POST'])
 def login():
@@ -949,7 +862,7 @@ def admin():
 @login_required
 def banking():
     form = DateRangeForm()
-    bank_account = Account.query.filter_by(name='Master Bank Account').first()
+    bank_account = system_accounts.bank_account()
     
     if not bank_account:
         flash('Master Bank Account not found.', 'danger')
@@ -990,10 +903,11 @@ def banking():
 @login_required
 def delete_transaction(transaction_id):
     transaction = Transaction.query.get_or_404(transaction_id)
-    account_id = transaction.account_id
+    if transaction.category == 'payout':
+        delete_payout_entries(transaction)
+    reverse_postings(transaction)
     db.session.delete(transaction)
     db.session.commit()
-    recalculate_balances(account_id=account_id)
     flash('Transaction deleted successfully!', 'success')
     return redirect(url_for('main.banking'))
 
@@ -1110,6 +1024,14 @@ def admin_reset_data():
         db.session.execute(sa.text("UPDATE property SET utility_account_id = NULL"))
         db.session.commit()
         AllocationHistory.query.delete()
+        ImportCheckpoint.query.delete()
+        SuggestionCache.query.delete()
+        LearnedMatch.query.delete()
+        BalanceDiscrepancy.query.delete()
+        reset_drift_checks()
+        PayoutRunItem.query.delete()
+        PayoutRun.query.delete()
+        Posting.query.delete()
         Transaction.query.delete()
         Statement.query.delete()
         Expense.query.delete()
@@ -1118,6 +1040,7 @@ def admin_reset_data():
         Tenant.query.delete()
         Property.query.delete()
         Landlord.query.delete()
+        mark_ledger_changed(db.session)
         db.session.commit()
         flash('All data has been deleted successfully.', 'success')
     except Exception as e:
@@ -1128,7 +1051,7 @@ def admin_reset_data():
 @main_bp.route('/agency_fees')
 @login_required
 def agency_fees():
-    agency_income_account = Account.query.filter_by(name='Agency Income').first()
+    agency_income_account = system_accounts.agency_income_account()
     if not agency_income_account:
         flash('Agency Income account not found.', 'danger')
         return redirect(url_for('main.index'))
@@ -1157,7 +1080,7 @@ def download_generated_statement(statement_id):
 def add_manual_rent():
     form = ManualRentForm()
     form.tenant_id.choices = [(t.id, t.name) for t in Tenant.query.all()]
-    bank_account = Account.query.filter_by(name='Master Bank Account').first()
+    bank_account = system_accounts.bank_account()
     if not bank_account:
         flash('Bank Account not found. Please create it in the accounts section.')
         return redirect(url_for('main.banking'))
@@ -1181,9 +1104,9 @@ def add_manual_rent():
         )
         db.session.add(transaction)
         allocate_transaction(transaction)
+        tenant_account = Account.query.filter_by(tenant_id=transaction.tenant_id).first()
+        recalculate_all_balances(account_ids=[bank_account.id] + ([tenant_account.id] if tenant_account else []))
         db.session.commit()
-        recalculate_balances(account_id=bank_account.id)
-        recalculate_balances(account_id=transaction.tenant.accounts.first().id)
         flash('Manual rent payment added successfully.', 'success')
         return redirect(url_for('main.tenant_account', id=form.tenant_id.data))
     return render_template('add_manual_rent.html', form=form)
@@ -1193,7 +1116,7 @@ def add_manual_rent():
 def add_manual_expense():
     form = ManualExpenseForm()
     form.landlord_id.choices = [(l.id, l.name) for l in Landlord.query.all()]
-    bank_account = Account.query.filter_by(name='Master Bank Account').first()
+    bank_account = system_accounts.bank_account()
     if not bank_account:
         flash('Bank Account not found. Please create it in the accounts section.')
         return redirect(url_for('main.banking'))
@@ -1217,9 +1140,9 @@ def add_manual_expense():
         )
         db.session.add(transaction)
         allocate_transaction(transaction)
+        landlord_account = Account.query.filter_by(landlord_id=transaction.landlord_id).first()
+        recalculate_all_balances(account_ids=[bank_account.id] + ([landlord_account.id] if landlord_account else []))
         db.session.commit()
-        recalculate_balances(account_id=bank_account.id)
-        recalculate_balances(account_id=transaction.landlord.accounts.first().id)
         flash('Manual expense added successfully.', 'success')
         return redirect(url_for('main.landlord_account', id=form.landlord_id.data))
     return render_template('add_manual_expense.html', form=form)
@@ -1260,6 +1183,27 @@ def change_date():
         return redirect(url_for('main.index'))
     return render_template('change_date.html', form=form)
 
+@main_bp.route('/admin/metrics')
+@login_required
+@role_required('admin')
+def admin_metrics():
+    return render_template('admin/metrics.html', metrics=metrics.registry.snapshot(),
+                           enabled=current_app.config['METRICS_ENABLED'])
+
+@main_bp.route('/admin/metrics.json')
+@login_required
+@role_required('admin')
+def admin_metrics_json():
+    return jsonify(metrics.registry.snapshot())
+
+@main_bp.route('/admin/metrics/reset', methods=['POST'])
+@login_required
+@role_required('admin')
+def admin_metrics_reset():
+    metrics.registry.reset()
+    flash('Metrics have been reset.')
+    return redirect(url_for('main.admin_metrics'))
+
 @main_bp.route('/admin/users')
 @login_required
 @role_required('admin')
@@ -1362,25 +1306,13 @@ def mark_as_uncoded(transaction_id):
                 flash('Cannot uncode. Landlord has been paid out since this transaction.', 'danger')
                 return redirect(url_for('main.coded_transactions'))
 
-    # Reverse financial effects of child transactions and delete them
+    # Reverse every line the transaction and its children posted, then delete the children
+    description = f'Uncoded transaction {main_transaction.id}'
+    reverse_postings(main_transaction, description=description)
     for child in main_transaction.child_transactions:
-        if child.landlord_id:
-            landlord_account = Account.query.filter_by(landlord_id=child.landlord_id).first()
-            if landlord_account:
-                landlord_account.update_balance(-child.amount)
-        if child.account_id:
-            # This handles agency fees, utility splits, etc.
-            account = Account.query.get(child.account_id)
-            if account and account.type != 'landlord': # Avoid double-counting landlord accounts
-                account.update_balance(-child.amount)
+        reverse_postings(child, description=description)
         db.session.delete(child)
 
-    # Reverse financial effect on the tenant's account from the main transaction
-    if main_transaction.tenant_id:
-        tenant_account = Account.query.filter_by(tenant_id=main_transaction.tenant_id).first()
-        if tenant_account:
-            tenant_account.update_balance(-main_transaction.amount)
-
     # Reset the main transaction to its original uncoded state
     main_transaction.status = 'uncoded'
     main_transaction.tenant_id = None
@@ -1,32 +1,54 @@
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
 from fpdf import FPDF
-from app.models import Landlord, Property, Tenant, Transaction, Expense, Account, Company, Statement
-from datetime import datetime, timedelta
+from app.models import Landlord, Property, Tenant, Transaction, Expense, Account, Company, Statement, Posting
+from datetime import date, datetime, timedelta
 from flask import current_app, session
 from app import db
+from app.metrics import timed
+from app.accounting_service import ledger_balance, ledger_balances, ledger_postings
 import os
-from sqlalchemy import not_, and_
+from collections import namedtuple
+from sqlalchemy import not_, and_, func, insert
+
+logger = logging.getLogger(__name__)
+
+STATEMENT_TYPES = ('monthly', 'annual', 'tenant')
+STATEMENT_INSERT_BATCH_SIZE = 500  # Statement rows written and committed together by a batch
 
 def get_opening_balance(account, start_date):
-    balance = 0
-    if account.landlord_id:
-        transactions = Transaction.query.filter(
-            Transaction.landlord_id == account.landlord_id,
-            Transaction.date < start_date
-        ).all()
-        balance += sum(t.amount for t in transactions)
-    elif account.tenant_id:
-        trans = Transaction.query.filter(
-            Transaction.tenant_id == account.tenant_id,
-            Transaction.date < start_date
-        ).all()
-        balance += sum(t.amount for t in trans)
-    else:
-        trans = Transaction.query.filter(
-            Transaction.account_id == account.id,
-            Transaction.date < start_date
-        ).all()
-        balance += sum(t.amount for t in trans)
-    return balance
+    """The account's balance from its postings dated before start_date."""
+    return ledger_balance(account.id, as_of=start_date)
+
+# Plain, picklable copies of what the renderers read, so rendering can run in worker processes.
+StatementLine = namedtuple('StatementLine', 'date category description amount property_id')
+StatementParty = namedtuple('StatementParty', 'id name email address_line_1 town postcode reference_code commission_rate')
+CompanyHeader = namedtuple('CompanyHeader', 'name address')
+PropertyHeader = namedtuple('PropertyHeader', 'id address_line_1 town postcode')
+
+def statement_lines(postings):
+    """An account's postings as StatementLines, taking the category and property from each posting's transaction."""
+    return [StatementLine(p.date, p.transaction.category if p.transaction else 'adjustment', p.description, p.amount,
+                          p.transaction.property_id if p.transaction else None) for p in postings]
+
+def statement_party(owner):
+    """A landlord or tenant (or a row with the same columns) as a StatementParty."""
+    return StatementParty(*(getattr(owner, field, None) for field in StatementParty._fields))
+
+def company_header(company):
+    return CompanyHeader(company.name, company.address) if company else None
+
+def property_header(prop):
+    return PropertyHeader(prop.id, prop.address_line_1, prop.town, prop.postcode)
+
+def logo_path(company):
+    """Path of the company logo to print on statements, or None."""
+    if company and company.logo:
+        path = os.path.join(current_app.config['UPLOAD_FOLDER'], company.logo)
+        if os.path.exists(path):
+            return path
+    return None
 
 class PDF(FPDF):
     def header(self):
@@ -36,6 +58,7 @@ class PDF(FPDF):
         self.set_font('Arial', 'I', 8)
         self.cell(0, 10, f'Page {self.page_no()}', 0, 0, 'C')
 
+@timed('generate_monthly_statement')
 def generate_monthly_statement(landlord_id, start_date, end_date, vat_rate):
     landlord = Landlord.query.get(landlord_id)
     if not landlord:
@@ -53,20 +76,25 @@ def generate_monthly_statement(landlord_id, start_date, end_date, vat_rate):
     if not landlord_account:
         return None, "Landlord account not found"
     opening_balance = get_opening_balance(landlord_account, start_date)
-    landlord_payments_account = Account.query.filter_by(name='Landlord Payments').first()
-    landlord_payments_account_id = landlord_payments_account.id if landlord_payments_account else -1
-    transactions = Transaction.query.filter(
-        Transaction.landlord_id == landlord_id,
-        Transaction.date.between(start_date, end_date)
-    ).all()
-    transactions.sort(key=lambda t: t.date)
+    postings = ledger_postings(landlord_account.id, start_date, end_date)
+    file_path = monthly_statement_path(landlord_id, start_date)
+    render_monthly_statement(file_path, statement_party(landlord), logo_path(company), opening_balance,
+                             statement_lines(postings), start_date, end_date, vat_rate)
+    statement = Statement(type='monthly', start_date=start_date, end_date=end_date, landlord_id=landlord_id, pdf_path=file_path)
+    db.session.add(statement)
+    db.session.commit()
+    return file_path, None
+
+def monthly_statement_path(landlord_id, start_date):
+    return f"statements/landlord_{landlord_id}_{start_date.strftime('%Y-%m-%d')}.pdf"
+
+def render_monthly_statement(file_path, landlord, logo, opening_balance, transactions, start_date, end_date, vat_rate):
+    """Writes a monthly landlord statement PDF. Takes plain data only, so it can run in a worker process."""
     pdf = PDF()
     pdf.add_page()
     pdf.set_font("Arial", size=10)
-    if company and company.logo:
-        logo_path = os.path.join(current_app.config['UPLOAD_FOLDER'], company.logo)
-        if os.path.exists(logo_path):
-            pdf.image(logo_path, 10, 8, 33)
+    if logo:
+        pdf.image(logo, 10, 8, 33)
     pdf.set_font('Arial', '', 11)
     pdf.set_xy(10, 40)
     pdf.multi_cell(0, 5, f"{landlord.name}\n{landlord.address_line_1 or ''}\n{landlord.town or ''}\n{landlord.postcode or ''}\n\nRef: {landlord.reference_code or ''}")
@@ -129,13 +157,9 @@ def generate_monthly_statement(landlord_id, start_date, end_date, vat_rate):
     pdf.cell(40, 7, f'{closing_balance:.2f}', 'T,R', 0, 'R')
     pdf.set_x(170)
     pdf.cell(30, 7, f'{closing_balance:.2f}', 'T,R', 1, 'R')
-    file_path = f"statements/landlord_{landlord_id}_{start_date.strftime('%Y-%m-%d')}.pdf"
     pdf.output(file_path)
-    statement = Statement(type='monthly', start_date=start_date, end_date=end_date, landlord_id=landlord_id, pdf_path=file_path)
-    db.session.add(statement)
-    db.session.commit()
-    return file_path, None
 
+@timed('generate_tenant_statement')
 def generate_tenant_statement(tenant_id, start_date, end_date):
     tenant = Tenant.query.get(tenant_id)
     tenant_account = Account.query.filter_by(tenant_id=tenant.id).first()
@@ -145,12 +169,21 @@ def generate_tenant_statement(tenant_id, start_date, end_date):
         return None, "Tenant account not found"
 
     opening_balance = get_opening_balance(tenant_account, start_date)
+    postings = ledger_postings(tenant_account.id, start_date, end_date)
 
-    transactions = Transaction.query.filter(
-        Transaction.tenant_id == tenant_id,
-        Transaction.date.between(start_date, end_date)
-    ).order_by(Transaction.date).all()
+    file_path = tenant_statement_path(tenant_id, start_date)
+    render_tenant_statement(file_path, statement_party(tenant), company_header(company), opening_balance,
+                            statement_lines(postings), start_date, end_date)
+    statement = Statement(type='tenant', start_date=start_date, end_date=end_date, tenant_id=tenant_id, pdf_path=file_path)
+    db.session.add(statement)
+    db.session.commit()
+    return file_path, None
 
+def tenant_statement_path(tenant_id, start_date):
+    return f"statements/tenant_{tenant_id}_{start_date.strftime('%Y-%m-%d')}.pdf"
+
+def render_tenant_statement(file_path, tenant, company, opening_balance, transactions, start_date, end_date):
+    """Writes a tenant statement PDF. Takes plain data only, so it can run in a worker process."""
     pdf = PDF()
     pdf.add_page()
     pdf.set_font("Arial", size=10)
@@ -180,9 +213,10 @@ def generate_tenant_statement(tenant_id, start_date, end_date):
     pdf.cell(80, 7, 'Description', 1, 0, 'L', 1)
     pdf.cell(40, 7, 'Amount', 1, 1, 'R', 1)
 
-    rent_charged = sum(t.amount for t in transactions if t.category == 'rent_charge')
+    # Charges are posted to the tenant's account as negative amounts.
+    rent_charged = -sum(t.amount for t in transactions if t.category == 'rent_charge')
     rent_paid = sum(t.amount for t in transactions if t.category == 'rent')
-    closing_balance = opening_balance - rent_charged + rent_paid
+    closing_balance = opening_balance + sum(t.amount for t in transactions)
 
     pdf.cell(80, 7, 'Opening Balance', 1)
     pdf.cell(40, 7, f'{opening_balance:.2f}', 1, 1, 'R')
@@ -210,24 +244,34 @@ def generate_tenant_statement(tenant_id, start_date, end_date):
         pdf.cell(30, 6, t.category, 1)
         pdf.cell(30, 6, f'{t.amount:.2f}', 1, 1, 'R')
 
-    file_path = f"statements/tenant_{tenant_id}_{start_date.strftime('%Y-%m-%d')}.pdf"
     pdf.output(file_path)
-    statement = Statement(type='tenant', start_date=start_date, end_date=end_date, tenant_id=tenant_id, pdf_path=file_path)
-    db.session.add(statement)
-    db.session.commit()
-    return file_path, None
 
+@timed('generate_annual_statement')
 def generate_annual_statement(landlord_id, year):
     landlord = Landlord.query.get(landlord_id)
     start_date = datetime(int(year), 1, 1).date()
     end_date = datetime(int(year), 12, 31).date()
     company = Company.query.first()
+    landlord_account = Account.query.filter_by(landlord_id=landlord_id).first()
+    if not landlord_account:
+        return None, "Landlord account not found"
 
-    transactions = Transaction.query.filter(
-        Transaction.landlord_id == landlord_id,
-        Transaction.date.between(start_date, end_date)
-    ).order_by(Transaction.date).all()
+    postings = ledger_postings(landlord_account.id, start_date, end_date)
+    properties = Property.query.filter_by(landlord_id=landlord_id).all()
 
+    file_path = annual_statement_path(landlord_id, year)
+    render_annual_statement(file_path, statement_party(landlord), company_header(company), year,
+                            statement_lines(postings), [property_header(prop) for prop in properties])
+    statement = Statement(type='annual', start_date=start_date, end_date=end_date, landlord_id=landlord_id, pdf_path=file_path)
+    db.session.add(statement)
+    db.session.commit()
+    return file_path, None
+
+def annual_statement_path(landlord_id, year):
+    return f"statements/landlord_{landlord_id}_{year}_annual.pdf"
+
+def render_annual_statement(file_path, landlord, company, year, transactions, properties):
+    """Writes an annual landlord statement PDF. Takes plain data only, so it can run in a worker process."""
     pdf = PDF()
     pdf.add_page()
     pdf.set_font("Arial", size=10)
@@ -277,7 +321,6 @@ def generate_annual_statement(landlord_id, year):
     pdf.cell(0, 10, 'Property Breakdown', 0, 1)
     pdf.set_font('Arial', size=10)
 
-    properties = Property.query.filter_by(landlord_id=landlord_id).all()
     for prop in properties:
         pdf.set_font('Arial', 'B', 10)
         pdf.cell(0, 10, f"Property: {prop.address_line_1}, {prop.town}, {prop.postcode}", 0, 1)
@@ -293,9 +336,189 @@ def generate_annual_statement(landlord_id, year):
         pdf.cell(0, 7, f'{prop_expenses:.2f}', 1, 1, 'R')
         pdf.ln(5)
 
-    file_path = f"statements/landlord_{landlord_id}_{year}_annual.pdf"
     pdf.output(file_path)
-    statement = Statement(type='annual', start_date=start_date, end_date=end_date, landlord_id=landlord_id, pdf_path=file_path)
-    db.session.add(statement)
-    db.session.commit()
-    return file_path, None
+
+def _grouped(rows, key):
+    groups = {}
+    for row in rows:
+        groups.setdefault(getattr(row, key), []).append(row)
+    return groups
+
+def _landlords(landlord_ids):
+    landlords = db.session.query(*(getattr(Landlord, field) for field in StatementParty._fields)).order_by(Landlord.id)
+    if landlord_ids is not None:
+        landlords = landlords.filter(Landlord.id.in_(landlord_ids))
+    return landlords.all()
+
+def _period_lines(accounts, start_date, end_date):
+    """
+    The postings of every owner's account ({owner id: account id}) in the
+    period in one query, as statement_lines would give them, grouped by owner
+    and ordered by date.
+    """
+    if not accounts:
+        return {}
+    lines = db.session.query(
+        Posting.account_id, Posting.date, func.coalesce(Transaction.category, 'adjustment'), Posting.description,
+        Posting.amount, Transaction.property_id
+    ).outerjoin(Transaction, Posting.transaction_id == Transaction.id).filter(
+        Posting.account_id.in_(accounts.values()), Posting.date.between(start_date, end_date))
+    groups = _grouped(lines.order_by(Posting.account_id, Posting.date, Posting.id), 'account_id')
+    owners = {account_id: owner_id for owner_id, account_id in accounts.items()}
+    return {owners[account_id]: [StatementLine(*line[1:]) for line in account_lines] for account_id, account_lines in groups.items()}
+
+def _opening_balances(accounts, start_date):
+    """get_opening_balance for every owner's account ({owner id: account id}): {owner id: balance}."""
+    balances = ledger_balances(list(accounts.values()), as_of=start_date)
+    return {owner_id: balances.get(account_id, 0.0) for owner_id, account_id in accounts.items()}
+
+def _first_accounts(column, owner_ids):
+    """{owner id: lowest account id}, the account .first() picks on the single statement path."""
+    accounts = db.session.query(column, func.min(Account.id)).filter(column.isnot(None))
+    if owner_ids is not None:
+        accounts = accounts.filter(column.in_(owner_ids))
+    return dict(accounts.group_by(column).all())
+
+def gather_statement_batch(statement_type, start_date=None, end_date=None, vat_rate=0.2, year=None, owner_ids=None):
+    """
+    Reads everything a batch of statements needs with a few bulk queries.
+    owner_ids are landlord ids (tenant ids for tenant statements); None
+    means every landlord, or every current tenant. Returns (tasks, failed):
+    a task is (label, Statement row, render function, render arguments) and
+    failed lists (label, error) for owners that cannot have a statement.
+    """
+    tasks, failed = [], []
+    company = Company.query.first()
+    if statement_type == 'monthly':
+        accounts = _first_accounts(Account.landlord_id, owner_ids)
+        balances = _opening_balances(accounts, start_date)
+        lines = _period_lines(accounts, start_date, end_date)
+        logo = logo_path(company)
+        for landlord in _landlords(owner_ids):
+            if landlord.id not in accounts:
+                failed.append((landlord.name, "Landlord account not found"))
+                continue
+            file_path = monthly_statement_path(landlord.id, start_date)
+            row = {'type': 'monthly', 'start_date': start_date, 'end_date': end_date, 'landlord_id': landlord.id, 'pdf_path': file_path}
+            tasks.append((landlord.name, row, render_monthly_statement, (
+                file_path, statement_party(landlord), logo, balances.get(landlord.id, 0.0),
+                lines.get(landlord.id, []), start_date, end_date, vat_rate)))
+    elif statement_type == 'annual':
+        start_date, end_date = date(int(year), 1, 1), date(int(year), 12, 31)
+        accounts = _first_accounts(Account.landlord_id, owner_ids)
+        lines = _period_lines(accounts, start_date, end_date)
+        properties = db.session.query(Property.landlord_id, Property.id, Property.address_line_1, Property.town, Property.postcode)
+        properties = properties.filter(Property.landlord_id.isnot(None) if owner_ids is None else Property.landlord_id.in_(owner_ids))
+        properties = _grouped(properties.order_by(Property.landlord_id, Property.id), 'landlord_id')
+        header = company_header(company)
+        for landlord in _landlords(owner_ids):
+            if landlord.id not in accounts:
+                failed.append((landlord.name, "Landlord account not found"))
+                continue
+            file_path = annual_statement_path(landlord.id, year)
+            row = {'type': 'annual', 'start_date': start_date, 'end_date': end_date, 'landlord_id': landlord.id, 'pdf_path': file_path}
+            tasks.append((landlord.name, row, render_annual_statement, (
+                file_path, statement_party(landlord), header, year, lines.get(landlord.id, []),
+                [PropertyHeader(*prop[1:]) for prop in properties.get(landlord.id, [])])))
+    elif statement_type == 'tenant':
+        tenants = db.session.query(Tenant.id, Tenant.name, Tenant.email).order_by(Tenant.id)
+        tenants = tenants.filter(Tenant.is_archived.is_(False)) if owner_ids is None else tenants.filter(Tenant.id.in_(owner_ids))
+        accounts = _first_accounts(Account.tenant_id, owner_ids)
+        balances = _opening_balances(accounts, start_date)
+        lines = _period_lines(accounts, start_date, end_date)
+        header = company_header(company)
+        for tenant in tenants:
+            if tenant.id not in accounts:
+                failed.append((tenant.name, "Tenant account not found"))
+                continue
+            file_path = tenant_statement_path(tenant.id, start_date)
+            row = {'type': 'tenant', 'start_date': start_date, 'end_date': end_date, 'tenant_id': tenant.id, 'pdf_path': file_path}
+            tasks.append((tenant.name, row, render_tenant_statement, (
+                file_path, statement_party(tenant), header, balances.get(tenant.id, 0.0),
+                lines.get(tenant.id, []), start_date, end_date)))
+    else:
+        raise ValueError(f"Unknown statement type: {statement_type}")
+    return tasks, failed
+
+def _render_task(task):
+    """Renders one statement. Runs in a worker process, so failures come back as messages rather than exceptions."""
+    _, _, render, args = task
+    try:
+        render(*args)
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+    return None
+
+@timed('generate_statement_batch')
+def generate_statement_batch(statement_type, start_date=None, end_date=None, vat_rate=0.2, year=None, owner_ids=None,
+                             workers=1, progress=None):
+    """
+    Generates a statement for every landlord (or tenant) in one run. Data is
+    gathered in this process with gather_statement_batch, the PDFs are
+    rendered by a pool of worker processes (in-process with one worker) and
+    the Statement rows are bulk-inserted STATEMENT_INSERT_BATCH_SIZE at a
+    time. progress(done, generated, failed) is called after each insert.
+    Returns a report dict with timings, statements per second and failures.
+    """
+    started = time.perf_counter()
+    tasks, failed = gather_statement_batch(statement_type, start_date, end_date, vat_rate, year, owner_ids)
+    gathered = time.perf_counter()
+    os.makedirs('statements', exist_ok=True)
+
+    generated = 0
+    rows = []
+
+    def write_rows():
+        nonlocal generated
+        if rows:
+            db.session.execute(insert(Statement), rows)
+            db.session.commit()
+            generated += len(rows)
+            rows.clear()
+        if progress:
+            progress(generated + len(failed), generated, len(failed))
+
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 and len(tasks) > 1 else None
+    try:
+        # Chunks keep the inter-process overhead small next to rendering a PDF.
+        chunksize = max(1, min(50, len(tasks) // (workers * 4))) if executor else 1
+        results = executor.map(_render_task, tasks, chunksize=chunksize) if executor else map(_render_task, tasks)
+        for (label, row, _, _), error in zip(tasks, results):
+            if error:
+                failed.append((label, error))
+            else:
+                rows.append(row)
+            if len(rows) >= STATEMENT_INSERT_BATCH_SIZE:
+                write_rows()
+        write_rows()
+    finally:
+        if executor:
+            executor.shutdown()
+
+    finished = time.perf_counter()
+    render_seconds = finished - gathered
+    report = {
+        'type': statement_type,
+        'generated': generated,
+        'failed': failed,
+        'workers': workers if executor else 1,
+        'gather_seconds': gathered - started,
+        'render_seconds': render_seconds,
+        'seconds': finished - started,
+        'per_second': generated / render_seconds if render_seconds else 0.0,
+    }
+    logger.info(f"Generated {generated} {statement_type} statements ({len(failed)} failed) in {report['seconds']:.2f}s, "
+                f"{report['per_second']:.1f} per second in {report['workers']} processes")
+    return report
+
+def statement_batch_messages(report):
+    """The batch report as lines for the job page and the CLI."""
+    messages = [
+        f"Generated {report['generated']} {report['type']} statements in {report['seconds']:.2f}s: "
+        f"{report['gather_seconds']:.2f}s reading data, {report['render_seconds']:.2f}s rendering in "
+        f"{report['workers']} process{'es' if report['workers'] != 1 else ''} ({report['per_second']:.1f} statements per second)."
+    ]
+    if report['failed']:
+        messages.append(f"{len(report['failed'])} statements failed.")
+        messages.extend(f"{label}: {error}" for label, error in report['failed'])
+    return messages
@@ -0,0 +1,60 @@
+import json
+import logging
+from datetime import datetime
+from app import db
+from app.models import DataVersion, SuggestionCache, Transaction
+from app.matching_service import DirectoryIndex, get_suggestions, normalize_text
+
+logger = logging.getLogger(__name__)
+
+LOOKUP_BATCH_SIZE = 500
+
+def directory_version():
+    return db.session.query(DataVersion.version).filter_by(name='directory').scalar() or 0
+
+def cached_suggestions(transactions):
+    """
+    Returns [(transaction, suggestions)] for the given transactions, reading
+    stored SuggestionCache rows. A row is recomputed only if it is missing,
+    was computed against an older directory version, or the transaction's
+    memo has changed since.
+    """
+    # Read the version before building the index, so a concurrent directory
+    # change leaves these rows stamped as stale rather than current.
+    version = directory_version()
+    ids = [transaction.id for transaction in transactions]
+    cached = {}
+    for start in range(0, len(ids), LOOKUP_BATCH_SIZE):
+        for row in SuggestionCache.query.filter(SuggestionCache.transaction_id.in_(ids[start:start + LOOKUP_BATCH_SIZE])):
+            cached[row.transaction_id] = row
+
+    directory_index = None
+    recomputed = 0
+    results = []
+    for transaction in transactions:
+        memo = normalize_text((transaction.description or '') + ' ' + (transaction.reference_code or ''))
+        row = cached.get(transaction.id)
+        if row and row.directory_version == version and row.memo == memo:
+            suggestions = [tuple(suggestion) for suggestion in json.loads(row.suggestions or '[]')]
+        else:
+            if directory_index is None:
+                directory_index = DirectoryIndex.build()
+            suggestions = get_suggestions(transaction, directory_index)
+            if not row:
+                row = SuggestionCache(transaction_id=transaction.id)
+                db.session.add(row)
+            row.directory_version = version
+            row.memo = memo
+            row.suggestions = json.dumps(suggestions)
+            row.computed_at = datetime.utcnow()
+            recomputed += 1
+        results.append((transaction, suggestions))
+
+    if recomputed:
+        db.session.commit()
+        logger.info(f"Recomputed suggestions for {recomputed} of {len(transactions)} transactions (directory version {version})")
+    return results
+
+def refresh_uncoded_suggestions():
+    """Brings the stored suggestions for every uncoded transaction up to date, e.g. after an import."""
+    return len(cached_suggestions(Transaction.query.filter_by(status='uncoded').all()))
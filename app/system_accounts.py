@@ -0,0 +1,88 @@
+import threading
+from itertools import chain
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from app import db
+from app.models import Account
+
+BANK = 'Master Bank Account'
+SUSPENSE = 'Suspense Account'
+AGENCY_INCOME = 'Agency Income'
+AGENCY_EXPENSE = 'Agency Expense'
+VAT = 'VAT Account'
+LANDLORD_PAYMENTS = 'Landlord Payments'
+UTILITY = 'Utility Account'
+RENT_CLEARING = 'Rent Clearing'
+
+SYSTEM_ACCOUNT_NAMES = (BANK, SUSPENSE, AGENCY_INCOME, AGENCY_EXPENSE, VAT, LANDLORD_PAYMENTS, UTILITY, RENT_CLEARING)
+
+_lock = threading.Lock()
+_account_ids = {}
+
+def _resolve():
+    """Loads the ids of all system accounts in one query. With duplicate names the lowest id wins."""
+    ids = {}
+    for account_id, name in db.session.query(Account.id, Account.name).filter(
+            Account.name.in_(SYSTEM_ACCOUNT_NAMES)).order_by(Account.id.desc()):
+        ids[name] = account_id
+    with _lock:
+        _account_ids.clear()
+        _account_ids.update(ids)
+    return ids
+
+def invalidate():
+    with _lock:
+        _account_ids.clear()
+
+def get_system_account(name):
+    """
+    Returns the system account with this name, or None if it does not exist.
+    Ids are resolved once per process, and the accounts are pinned to the
+    current session, so repeated calls within a request do not query again.
+    """
+    pinned = db.session.info.setdefault('system_accounts', {})
+    account_id = _account_ids.get(name)
+    if account_id is not None:
+        account = db.session.get(Account, account_id)
+        # Accounts can be removed or renamed outside this process (or by bulk deletes).
+        if account is not None and account.name == name:
+            pinned[name] = account
+            return account
+    account_id = _resolve().get(name)
+    account = db.session.get(Account, account_id) if account_id is not None else None
+    pinned[name] = account
+    return account
+
+def bank_account():
+    return get_system_account(BANK)
+
+def suspense_account():
+    return get_system_account(SUSPENSE)
+
+def agency_income_account():
+    return get_system_account(AGENCY_INCOME)
+
+def agency_expense_account():
+    return get_system_account(AGENCY_EXPENSE)
+
+def vat_account():
+    return get_system_account(VAT)
+
+def landlord_payments_account():
+    return get_system_account(LANDLORD_PAYMENTS)
+
+def utility_account():
+    return get_system_account(UTILITY)
+
+def rent_clearing_account():
+    """Rent charged to tenants and not yet passed on to landlords, utilities and commission."""
+    return get_system_account(RENT_CLEARING)
+
+@event.listens_for(Session, 'after_flush')
+def _invalidate_on_account_change(session, flush_context):
+    """Drops the cached ids when an account is added, deleted or renamed."""
+    changed = any(isinstance(obj, Account) for obj in chain(session.new, session.deleted)) or any(
+        isinstance(obj, Account) and inspect(obj).attrs.name.history.has_changes() for obj in session.dirty
+    )
+    if changed:
+        invalidate()
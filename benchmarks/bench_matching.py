@@ -0,0 +1,160 @@
+# benchmarks/bench_matching.py
+"""
+Benchmarks the bank matching pipeline on a seeded synthetic data set in a
+throwaway SQLite database.
+
+    python benchmarks/bench_matching.py
+    python benchmarks/bench_matching.py --tenants 2000 --lines 10000 --workers 4
+    python benchmarks/bench_matching.py --update-baseline
+    python benchmarks/bench_matching.py --check
+
+Each stage reports rows per second and the process's peak resident memory
+so far (not available on Windows).
+Throughput depends on the machine, so no baseline is shipped. Record one
+locally with --update-baseline (benchmarks/baseline.json is git-ignored),
+then --check compares a run against it and exits with status 1 if any
+stage's throughput falls more than --threshold below the baseline. Runs are
+only compared when recorded with the same sizes, seed and worker count on
+the same platform and Python version.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+MIN_COMPARABLE_SECONDS = 0.5  # Shorter stages are too noisy to hold to a threshold
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark bank matching and import.')
+    parser.add_argument('--tenants', type=int, default=500)
+    parser.add_argument('--landlords', type=int, default=100)
+    parser.add_argument('--lines', type=int, default=2000, help='Bank lines in the synthetic export.')
+    parser.add_argument('--sample', type=int, default=200, help='Lines timed through match_transaction and get_suggestions.')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workers', type=int, default=1, help='Matching processes used by process_csv.')
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--threshold', type=float, default=0.2, help='Allowed throughput drop, as a fraction of the baseline.')
+    parser.add_argument('--update-baseline', action='store_true', help='Store this run as the new baseline.')
+    parser.add_argument('--check', action='store_true', help='Fail if throughput regressed against the baseline.')
+    return parser.parse_args()
+
+def peak_memory_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def run_stage(name, rows, func):
+    """Runs func() with application output captured and returns its timings."""
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        func()
+    elapsed = time.perf_counter() - started
+    result = {
+        'rows': rows,
+        'seconds': round(elapsed, 3),
+        'rows_per_second': round(rows / elapsed, 1) if elapsed else 0.0,
+        'peak_memory_mb': peak_memory_mb(),
+    }
+    memory = f"{result['peak_memory_mb']:>8.1f} MB" if result['peak_memory_mb'] is not None else ''
+    print(f"{name:<18} {rows:>7} rows {result['seconds']:>9.3f}s {result['rows_per_second']:>10.1f} rows/s {memory}")
+    return result
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for stage, result in results['stages'].items():
+        expected = baseline['stages'].get(stage)
+        if not expected or not expected['rows_per_second']:
+            continue
+        if expected['seconds'] < MIN_COMPARABLE_SECONDS:
+            print(f"{stage:<18} too short to compare ({expected['seconds']:.3f}s in baseline)")
+            continue
+        change = result['rows_per_second'] / expected['rows_per_second'] - 1
+        print(f"{stage:<18} {change:+.1%} vs baseline ({expected['rows_per_second']:.1f} rows/s)")
+        if change < -threshold:
+            regressions.append(stage)
+    return regressions
+
+def main():
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix='bench_matching_')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'bench.db')
+    sys.path.insert(0, ROOT)
+
+    from app import create_app, db
+    from app.models import Transaction
+    from app.matching_service import DirectoryIndex, match_transaction, get_suggestions
+    from app.import_service import normalize_bank_frame, process_csv
+    from benchmarks.synthetic_data import seed_directory, write_bank_csv
+    import pandas as pd
+
+    app = create_app()
+    csv_path = os.path.join(workdir, 'bank.csv')
+    settings = {key: getattr(args, key) for key in ('tenants', 'landlords', 'lines', 'sample', 'seed', 'workers', 'chunk_size')}
+    machine = {'platform': platform.platform(), 'python': platform.python_version()}
+    results = {'settings': settings, 'machine': machine, 'stages': {}}
+    stages = results['stages']
+
+    with app.app_context():
+        db.create_all()
+        with contextlib.redirect_stdout(io.StringIO()):
+            tenants, landlords = seed_directory(args.tenants, args.landlords, seed=args.seed)
+        write_bank_csv(csv_path, tenants, landlords, args.lines, seed=args.seed)
+        entries = len(DirectoryIndex.build().entries)
+        print(f"{args.tenants} tenants, {args.landlords} landlords ({entries} directory entries), {args.lines} bank lines")
+
+        frame = normalize_bank_frame(pd.read_csv(csv_path)).head(args.sample)
+        probes = [Transaction(description=row.description, reference_code=row.reference_code, amount=row.amount)
+                  for row in frame.itertuples(index=False)]
+        index = {}
+
+        stages['build_index'] = run_stage('build_index', entries, lambda: index.setdefault('index', DirectoryIndex.build()))
+        stages['match_transaction'] = run_stage('match_transaction', len(probes),
+                                                lambda: [match_transaction(probe, index['index']) for probe in probes])
+        stages['get_suggestions'] = run_stage('get_suggestions', len(probes),
+                                              lambda: [get_suggestions(probe, index['index']) for probe in probes])
+        stages['process_csv'] = run_stage('process_csv', args.lines,
+                                          lambda: process_csv(csv_path, chunk_size=args.chunk_size, match_workers=args.workers))
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+            f.write('\n')
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if not args.check:
+        return 0
+    if not os.path.exists(args.baseline):
+        print('No baseline found; run with --update-baseline on this machine to record one.')
+        return 1
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get('settings') != settings:
+        print(f"Baseline was recorded with different settings ({baseline.get('settings')}); not comparing.")
+        return 1
+    if baseline.get('machine') != machine:
+        print(f"Baseline was recorded on {baseline.get('machine')}, not {machine}; record one here with --update-baseline.")
+        return 1
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"Throughput regressed more than {args.threshold:.0%} in: {', '.join(regressions)}")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,114 @@
+# benchmarks/synthetic_data.py
+"""
+Seeded synthetic directory and bank export for benchmarking the matching
+pipeline. The same seed always produces the same tenants, landlords,
+references and bank lines.
+"""
+import csv
+import random
+from datetime import date, timedelta
+from app import db
+from app.models import Tenant, Landlord, LandlordReference, Property, Account
+
+FIRST_NAMES = ['JOHN', 'MARY', 'ALI', 'PRIYA', 'TOM', 'ANNA', 'LUKE', 'SARA', 'OWEN', 'ZOE', 'RAJ', 'EMMA',
+               'LIAM', 'NOOR', 'JACK', 'ELLA', 'HUGO', 'MIA', 'SEAN', 'LUCY']
+LAST_NAMES = ['SMITH', 'JONES', 'KHAN', 'PATEL', 'BROWN', 'TAYLOR', 'EVANS', 'WILSON', 'WRIGHT', 'HALL',
+              'WALKER', 'GREEN', 'HUGHES', 'EDWARDS', 'MORRIS', 'CLARKE', 'AHMED', 'COOPER', 'WARD', 'BAKER']
+LANDLORD_SUFFIXES = ['PROPERTIES', 'LETTINGS', 'ESTATES', 'HOLDINGS', 'HOMES']
+MEMO_PREFIXES = ['', 'FPI ', 'BGC ', 'SO ', 'TFR ', 'BACS ']
+MEMO_SUFFIXES = ['', ' RENT', ' RENT {month}', ' {month} {year}', ' REF {number}', ' PAYMENT']
+MONTHS = ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC']
+NOISE_MEMOS = ['TESCO STORES {number}', 'AMAZON MKTPLACE {number}', 'BANK CHARGES', 'HMRC VAT {number}',
+               'BRITISH GAS {number}', 'COUNCIL TAX {number}', 'INTEREST PAID', 'CARD PAYMENT {number}']
+SYSTEM_ACCOUNTS = [
+    ('Master Bank Account', 'asset'), ('Suspense Account', 'suspense'), ('Agency Income', 'agency_income'),
+    ('Agency Expense', 'agency_expense'), ('Admin Fee Account', 'agency_income'), ('VAT Account', 'vat_payable'),
+    ('Utility Account', 'utility'), ('Rent Clearing', 'clearing'),
+]
+
+def seed_directory(tenants, landlords, seed=42):
+    """Creates the system accounts and N landlords and tenants with properties, accounts and reference codes."""
+    rnd = random.Random(seed)
+    for name, account_type in SYSTEM_ACCOUNTS:
+        db.session.add(Account(name=name, type=account_type, balance=0.0))
+
+    landlord_rows = []
+    for i in range(landlords):
+        landlord = Landlord(
+            name=f'{rnd.choice(FIRST_NAMES)} {rnd.choice(LAST_NAMES)} {rnd.choice(LANDLORD_SUFFIXES)} {i}',
+            reference_code=f'LL{i:05d}',
+            commission_rate=rnd.choice([0.08, 0.1, 0.12]),
+        )
+        db.session.add(landlord)
+        landlord_rows.append(landlord)
+    db.session.flush()
+    for i, landlord in enumerate(landlord_rows):
+        db.session.add(Account(name=f'{landlord.name} Account', type='landlord', landlord_id=landlord.id))
+        if i % 4 == 0:
+            db.session.add(LandlordReference(reference_code=f'LX{i:05d}', landlord_id=landlord.id))
+
+    tenant_rows = []
+    for i in range(tenants):
+        landlord = landlord_rows[i % landlords] if landlords else None
+        prop = Property(address_line_1=f'{i + 1} {rnd.choice(LAST_NAMES).title()} Road', town='Town', postcode='AB1 2CD',
+                        rent_amount=rnd.randrange(450, 1800, 25), landlord_id=landlord.id if landlord else None)
+        db.session.add(prop)
+        db.session.flush()
+        tenant = Tenant(name=f'{rnd.choice(FIRST_NAMES)} {rnd.choice(LAST_NAMES)}', reference_code=f'TN{i:06d}', property_id=prop.id)
+        db.session.add(tenant)
+        tenant_rows.append(tenant)
+    db.session.flush()
+    for tenant in tenant_rows:
+        db.session.add(Account(name=f'{tenant.name} Account', type='tenant', tenant_id=tenant.id))
+    db.session.commit()
+    return [(t.id, t.name, t.reference_code) for t in tenant_rows], [(l.id, l.name, l.reference_code) for l in landlord_rows]
+
+def _typo(rnd, text):
+    """Drops, doubles or swaps one character, the way hand-keyed bank references go wrong."""
+    if len(text) < 4:
+        return text
+    i = rnd.randrange(1, len(text) - 1)
+    kind = rnd.choice(['drop', 'double', 'swap'])
+    if kind == 'drop':
+        return text[:i] + text[i + 1:]
+    if kind == 'double':
+        return text[:i] + text[i] + text[i:]
+    return text[:i - 1] + text[i] + text[i - 1] + text[i + 1:]
+
+def _memo(rnd, text):
+    month = rnd.choice(MONTHS)
+    suffix = rnd.choice(MEMO_SUFFIXES).format(month=month, year=rnd.choice([2025, 2026]), number=rnd.randrange(10000, 99999))
+    if rnd.random() < 0.3:
+        text = _typo(rnd, text)
+    return (rnd.choice(MEMO_PREFIXES) + text + suffix)[:256]
+
+def write_bank_csv(path, tenants, landlords, lines, seed=42):
+    """
+    Writes M bank lines in the bank's export format (Date, Amount, Memo,
+    Subcategory): exact references, noisy tenant and landlord names, unrelated
+    card and utility lines, and a few zero or unreadable rows.
+    """
+    rnd = random.Random(seed)
+    start = date(2026, 1, 1)
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Date', 'Amount', 'Memo', 'Subcategory'])
+        for _ in range(lines):
+            day = start + timedelta(days=rnd.randrange(365))
+            when = day.strftime('%Y-%m-%d') if rnd.random() < 0.7 else day.strftime('%d/%m/%Y')
+            roll = rnd.random()
+            if roll < 0.25 and tenants:
+                _, name, reference = rnd.choice(tenants)
+                row = [when, rnd.randrange(450, 1800, 25), _memo(rnd, name), reference]
+            elif roll < 0.55 and tenants:
+                _, name, reference = rnd.choice(tenants)
+                row = [when, rnd.randrange(450, 1800, 25), _memo(rnd, name), 'RENT']
+            elif roll < 0.7 and landlords:
+                _, name, reference = rnd.choice(landlords)
+                row = [when, -rnd.randrange(100, 3000), _memo(rnd, name), rnd.choice([reference, 'PAYMENT'])]
+            elif roll < 0.97:
+                memo = rnd.choice(NOISE_MEMOS).format(number=rnd.randrange(1000, 9999))
+                row = [when, -round(rnd.uniform(1, 400), 2), memo, rnd.choice(['CARD', 'DD', 'CHG'])]
+            else:
+                row = [rnd.choice([when, 'not a date']), rnd.choice([0, 'n/a']), 'ADJUSTMENT', 'MISC']
+            writer.writerow(row)
@@ -13,6 +13,13 @@ class Config:
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     UPLOAD_FOLDER = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'uploads')
     STATEMENTS_FOLDER = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'statements')
+    IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE') or 1000)
+    MATCH_WORKERS = int(os.environ.get('MATCH_WORKERS') or 1)  # Processes used to match imported rows; 1 matches in-process
+    STATEMENT_WORKERS = int(os.environ.get('STATEMENT_WORKERS') or os.cpu_count() or 1)  # Processes used to render batch statements; 1 renders in-process
+    JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL') or 2)
+    JOB_STALE_AFTER = int(os.environ.get('JOB_STALE_AFTER') or 600)  # Seconds without a heartbeat before a running job is requeued
+    METRICS_ENABLED = (os.environ.get('METRICS_ENABLED') or 'true').lower() in ('1', 'true', 'yes')
+    ACCOUNTING_LOG_LEVEL = os.environ.get('ACCOUNTING_LOG_LEVEL') or 'INFO'  # DEBUG logs every allocation
     MAIL_SERVER = os.environ.get('MAIL_SERVER') or 'smtp.gmail.com'
     MAIL_PORT = int(os.environ.get('MAIL_PORT') or 587)
     MAIL_USE_TLS = True
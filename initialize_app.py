@@ -17,7 +17,7 @@ def reset_database():
             "user_roles", "user", "role", "tenant", "landlord", "property",
             "account", "transaction", "expense_category", "expense",
             "allocation_history", "statement", "rent_charge_batch",
-            "audit_log", "company", "alembic_version"
+            "audit_log", "company", "import_checkpoint", "job", "data_version", "suggestion_cache", "learned_match", "posting", "balance_discrepancy", "account_ledger_checkpoint", "payout_run", "payout_run_item", "alembic_version"
         ]
 
         with db.engine.connect() as connection:
@@ -84,7 +84,8 @@ def setup_initial_accounts():
             Account(name='Master Bank Account', type='asset', balance=90000.0),
             Account(name='Utility Account', type='utility'),
             Account(name='VAT Account', type='vat_payable'),
-            Account(name='Landlord Payments', type='liability')
+            Account(name='Landlord Payments', type='asset'),  # Payouts leave the agency through it, like a bank account
+            Account(name='Rent Clearing', type='clearing')
         ]
         
         db.session.add_all(accounts_to_add)
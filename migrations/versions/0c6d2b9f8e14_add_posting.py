@@ -0,0 +1,122 @@
+"""Add posting table
+
+Revision ID: 0c6d2b9f8e14
+Revises: b2e8f4a61c93
+Create Date: 2026-10-17 21:18:52.630941
+
+"""
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0c6d2b9f8e14'
+down_revision = 'b2e8f4a61c93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    posting = op.create_table('posting',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('transaction_id', sa.Integer(), nullable=True),
+    sa.Column('account_id', sa.Integer(), nullable=False),
+    sa.Column('date', sa.Date(), nullable=False),
+    sa.Column('amount', sa.Float(), nullable=False),
+    sa.Column('description', sa.String(length=256), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['account_id'], ['account.id'], ),
+    sa.ForeignKeyConstraint(['transaction_id'], ['transaction.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('posting', schema=None) as batch_op:
+        batch_op.create_index('ix_posting_account_id_date', ['account_id', 'date', 'amount'], unique=False)
+        batch_op.create_index(batch_op.f('ix_posting_transaction_id'), ['transaction_id'], unique=False)
+
+    # Backfill the ledger from the existing transactions, dated as they
+    # happened, as double entries following allocate_transaction: the bank
+    # (or whichever account a transaction was posted to) against the tenant
+    # or landlord, rent charges against Rent Clearing and rent passed on to
+    # landlords, utilities and commission out of Rent Clearing. Lines that
+    # cannot be paired this way, such as the two sides of an old payout's
+    # commission, which are separate transactions, are balanced against the
+    # Suspense Account.
+    connection = op.get_bind()
+    account = sa.table('account', sa.column('id', sa.Integer), sa.column('name', sa.String), sa.column('type', sa.String),
+                       sa.column('balance', sa.Float), sa.column('tenant_id', sa.Integer), sa.column('landlord_id', sa.Integer))
+    transaction = sa.table('transaction', sa.column('id', sa.Integer), sa.column('date', sa.Date), sa.column('amount', sa.Float),
+                           sa.column('description', sa.String), sa.column('category', sa.String), sa.column('status', sa.String),
+                           sa.column('tenant_id', sa.Integer), sa.column('landlord_id', sa.Integer), sa.column('account_id', sa.Integer),
+                           sa.column('parent_transaction_id', sa.Integer))
+    created_at = sa.literal(datetime.utcnow(), sa.DateTime)
+    posted_on = sa.func.coalesce(transaction.c.date, sa.func.current_date())
+    columns = ['transaction_id', 'account_id', 'date', 'amount', 'description', 'created_at']
+
+    def system_account(name, type_):
+        account_id = connection.execute(sa.select(sa.func.min(account.c.id)).where(account.c.name == name)).scalar()
+        if account_id is None:
+            connection.execute(account.insert().values(name=name, type=type_, balance=0.0))
+            account_id = connection.execute(sa.select(sa.func.min(account.c.id)).where(account.c.name == name)).scalar()
+        return account_id
+
+    def backfill(account_id, amount, *criteria):
+        lines = sa.select(transaction.c.id, account_id, posted_on, amount, transaction.c.description, created_at)
+        connection.execute(posting.insert().from_select(columns, lines.where(transaction.c.amount.isnot(None), *criteria)))
+
+    # Payouts leave the agency through Landlord Payments, so its balance goes up with debits like a bank account's.
+    connection.execute(account.update().where(account.c.name == 'Landlord Payments', account.c.type == 'liability').values(type='asset'))
+    rent_clearing_id = system_account('Rent Clearing', 'clearing')
+    suspense_id = system_account('Suspense Account', 'suspense')
+    rent_clearing = sa.literal(rent_clearing_id, sa.Integer)
+
+    # The account .first() finds for a tenant or landlord: the lowest id.
+    tenant_accounts = sa.select(account.c.tenant_id, sa.func.min(account.c.id).label('account_id')).where(
+        account.c.tenant_id.isnot(None)).group_by(account.c.tenant_id).subquery()
+    landlord_accounts = sa.select(account.c.landlord_id, sa.func.min(account.c.id).label('account_id')).where(
+        account.c.landlord_id.isnot(None)).group_by(account.c.landlord_id).subquery()
+    is_commission = (transaction.c.category == 'fee') & transaction.c.parent_transaction_id.isnot(None)
+    passed_on = transaction.c.category.in_(['rent_landlord_share', 'rent_utility_share']) | is_commission | (
+        (transaction.c.category == 'rent') & transaction.c.tenant_id.isnot(None) & transaction.c.landlord_id.isnot(None))
+    first_id = connection.execute(sa.select(sa.func.coalesce(sa.func.max(posting.c.id), 0))).scalar()
+
+    # The lines the cached balances were worked out from...
+    backfill(tenant_accounts.c.account_id, transaction.c.amount, tenant_accounts.c.tenant_id == transaction.c.tenant_id,
+             transaction.c.category.in_(['rent_charge', 'rent']))
+    # A payment to a landlord lowers their balance whatever the sign it was imported with.
+    backfill(landlord_accounts.c.account_id,
+             sa.case((transaction.c.category == 'payment', -sa.func.abs(transaction.c.amount)), else_=transaction.c.amount),
+             landlord_accounts.c.landlord_id == transaction.c.landlord_id, ~is_commission)
+    backfill(account.c.id, transaction.c.amount, account.c.id == transaction.c.account_id, account.c.tenant_id.is_(None),
+             account.c.landlord_id.is_(None), sa.func.coalesce(transaction.c.status, 'uncoded') != 'uncoded')
+
+    # ...and their other sides, which no balance includes yet.
+    opposite_from = connection.execute(sa.select(sa.func.coalesce(sa.func.max(posting.c.id), 0))).scalar()
+    backfill(rent_clearing, -transaction.c.amount, transaction.c.category == 'rent_charge',
+             transaction.c.tenant_id.in_(sa.select(tenant_accounts.c.tenant_id)))
+    backfill(rent_clearing, -transaction.c.amount, passed_on)
+    debit = sa.case((account.c.type.in_(['asset', 'agency_expense']), posting.c.amount), else_=-posting.c.amount)
+    imbalance = sa.func.sum(debit)
+    # Suspense balances go up with credits, so a line of the imbalance's amount credits it.
+    balancing = sa.select(
+        posting.c.transaction_id, sa.literal(suspense_id, sa.Integer), sa.func.min(posting.c.date), imbalance,
+        sa.func.min(posting.c.description), created_at
+    ).select_from(posting.join(account, account.c.id == posting.c.account_id)).where(
+        posting.c.id > first_id).group_by(posting.c.transaction_id).having(sa.func.abs(imbalance) >= 0.005)
+    connection.execute(posting.insert().from_select(columns, balancing))
+    added = sa.select(sa.func.coalesce(sa.func.sum(posting.c.amount), 0.0)).where(
+        posting.c.account_id == account.c.id, posting.c.id > opposite_from).scalar_subquery()
+    connection.execute(account.update().where(account.c.id.in_([rent_clearing_id, suspense_id])).values(
+        balance=sa.func.coalesce(account.c.balance, 0.0) + added))
+
+
+def downgrade():
+    with op.batch_alter_table('posting', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_posting_transaction_id'))
+        batch_op.drop_index('ix_posting_account_id_date')
+
+    op.drop_table('posting')
+
+    account = sa.table('account', sa.column('name', sa.String), sa.column('type', sa.String))
+    op.execute(account.update().where(account.c.name == 'Landlord Payments', account.c.type == 'asset').values(type='liability'))
+    op.execute(account.delete().where(account.c.name == 'Rent Clearing'))
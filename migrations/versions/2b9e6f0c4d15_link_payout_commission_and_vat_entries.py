@@ -0,0 +1,84 @@
+"""Link payout commission and VAT entries
+
+Revision ID: 2b9e6f0c4d15
+Revises: 7c2d4e9f1a38
+Create Date: 2026-10-18 12:17:30.664218
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2b9e6f0c4d15'
+down_revision = '7c2d4e9f1a38'
+branch_labels = None
+depends_on = None
+
+# Linked entry column, category, and whether it is the landlord's side
+ENTRY_COLUMNS = [
+    ('commission_transaction_id', 'fee', True),
+    ('vat_transaction_id', 'vat', True),
+    ('agency_income_transaction_id', 'fee', False),
+    ('vat_income_transaction_id', 'vat', False),
+]
+
+
+def upgrade():
+    with op.batch_alter_table('payout_run_item', schema=None) as batch_op:
+        for column, _, _ in ENTRY_COLUMNS:
+            batch_op.add_column(sa.Column(column, sa.Integer(), nullable=True))
+            batch_op.create_foreign_key(f'fk_payout_run_item_{column}', 'transaction', [column], ['id'])
+
+    # Link the entries of existing payouts. Both payout paths insert them just
+    # before the payout, with its date and reference, so the latest ones below
+    # the payout's id are taken.
+    connection = op.get_bind()
+    item = sa.table('payout_run_item',
+        sa.column('id', sa.Integer),
+        sa.column('transaction_id', sa.Integer),
+        *(sa.column(column, sa.Integer) for column, _, _ in ENTRY_COLUMNS)
+    )
+    transaction = sa.table('transaction',
+        sa.column('id', sa.Integer),
+        sa.column('date', sa.Date),
+        sa.column('amount', sa.BigInteger),
+        sa.column('description', sa.String),
+        sa.column('reference_code', sa.String),
+        sa.column('category', sa.String),
+        sa.column('landlord_id', sa.Integer)
+    )
+    payouts = connection.execute(
+        sa.select(item.c.id, transaction.c.id, transaction.c.date, transaction.c.reference_code, transaction.c.landlord_id)
+        .join(transaction, transaction.c.id == item.c.transaction_id)
+    ).all()
+    for item_id, payout_id, payout_date, reference, landlord_id in payouts:
+        candidates = connection.execute(
+            sa.select(transaction.c.id, transaction.c.category, transaction.c.landlord_id, transaction.c.amount).where(
+                transaction.c.id < payout_id,
+                transaction.c.date == payout_date,
+                transaction.c.reference_code == reference if reference is not None else transaction.c.reference_code.is_(None),
+                transaction.c.category.in_(('fee', 'vat')),
+                transaction.c.description.in_((f'Agency Commission {reference}', f'VAT on Commission {reference}')),
+                sa.or_(transaction.c.landlord_id == landlord_id, transaction.c.landlord_id.is_(None))
+            ).order_by(transaction.c.id.desc())
+        ).all()
+        values = {}
+        for column, category, landlord_side in ENTRY_COLUMNS:
+            if landlord_side:
+                found = next((row for row in candidates if row.category == category and row.landlord_id == landlord_id), None)
+            else:
+                landlord_row = next((row for row in candidates if row.category == category and row.landlord_id == landlord_id), None)
+                found = landlord_row and next((row for row in candidates if row.category == category and row.landlord_id is None
+                                               and row.amount == -landlord_row.amount), None)
+            if found is not None:
+                values[column] = found.id
+        if values:
+            connection.execute(item.update().where(item.c.id == item_id).values(**values))
+
+
+def downgrade():
+    with op.batch_alter_table('payout_run_item', schema=None) as batch_op:
+        for column, _, _ in reversed(ENTRY_COLUMNS):
+            batch_op.drop_constraint(f'fk_payout_run_item_{column}', type_='foreignkey')
+            batch_op.drop_column(column)
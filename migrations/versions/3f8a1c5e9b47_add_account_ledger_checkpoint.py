@@ -0,0 +1,31 @@
+"""Add account ledger checkpoint
+
+Revision ID: 3f8a1c5e9b47
+Revises: b6f1d9a4c302
+Create Date: 2026-10-18 09:41:05.127804
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f8a1c5e9b47'
+down_revision = 'b6f1d9a4c302'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('account_ledger_checkpoint',
+    sa.Column('account_id', sa.Integer(), nullable=False),
+    sa.Column('posting_id', sa.Integer(), nullable=False),
+    sa.Column('ledger_sum', sa.BigInteger(), nullable=False),
+    sa.Column('checked_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['account_id'], ['account.id'], ),
+    sa.PrimaryKeyConstraint('account_id')
+    )
+
+
+def downgrade():
+    op.drop_table('account_ledger_checkpoint')
@@ -0,0 +1,46 @@
+"""Add normalized reference code columns
+
+Revision ID: 4b7e1c9a2d10
+Revises: 300e2f6324ea
+Create Date: 2026-10-17 09:12:44.310512
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b7e1c9a2d10'
+down_revision = '300e2f6324ea'
+branch_labels = None
+depends_on = None
+
+
+TABLES = ('tenant', 'landlord', 'landlord_reference')
+
+
+def upgrade():
+    for table_name in TABLES:
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('reference_code_normalized', sa.String(length=64), nullable=True))
+            batch_op.create_index(batch_op.f(f'ix_{table_name}_reference_code_normalized'), ['reference_code_normalized'], unique=False)
+
+    # Backfill with the same normalization the models apply on write.
+    connection = op.get_bind()
+    for table_name in TABLES:
+        table = sa.table(table_name,
+            sa.column('id', sa.Integer),
+            sa.column('reference_code', sa.String),
+            sa.column('reference_code_normalized', sa.String)
+        )
+        rows = connection.execute(sa.select(table.c.id, table.c.reference_code).where(table.c.reference_code.isnot(None))).fetchall()
+        for row_id, reference_code in rows:
+            normalized = ''.join(reference_code.upper().split()) or None
+            connection.execute(table.update().where(table.c.id == row_id).values(reference_code_normalized=normalized))
+
+
+def downgrade():
+    for table_name in reversed(TABLES):
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            batch_op.drop_index(batch_op.f(f'ix_{table_name}_reference_code_normalized'))
+            batch_op.drop_column('reference_code_normalized')
@@ -0,0 +1,40 @@
+"""Add balance discrepancy table
+
+Revision ID: 5e7b0a3c9d26
+Revises: 9a4e6c1d3b72
+Create Date: 2026-10-17 22:09:41.553807
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e7b0a3c9d26'
+down_revision = '9a4e6c1d3b72'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('balance_discrepancy',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('account_id', sa.Integer(), nullable=False),
+    sa.Column('cached_balance', sa.Float(), nullable=True),
+    sa.Column('ledger_balance', sa.Float(), nullable=True),
+    sa.Column('difference', sa.Float(), nullable=True),
+    sa.Column('detected_at', sa.DateTime(), nullable=True),
+    sa.Column('checked_at', sa.DateTime(), nullable=True),
+    sa.Column('resolved_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['account_id'], ['account.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('balance_discrepancy', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_balance_discrepancy_account_id'), ['account_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('balance_discrepancy', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_balance_discrepancy_account_id'))
+
+    op.drop_table('balance_discrepancy')
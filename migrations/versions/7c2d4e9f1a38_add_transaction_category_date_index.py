@@ -0,0 +1,26 @@
+"""Add transaction category and date index
+
+Revision ID: 7c2d4e9f1a38
+Revises: 3f8a1c5e9b47
+Create Date: 2026-10-18 11:02:44.531906
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c2d4e9f1a38'
+down_revision = '3f8a1c5e9b47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('transaction', schema=None) as batch_op:
+        batch_op.create_index('ix_transaction_category_date', ['category', 'date'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('transaction', schema=None) as batch_op:
+        batch_op.drop_index('ix_transaction_category_date')
@@ -0,0 +1,40 @@
+"""Add import checkpoint table
+
+Revision ID: 8d2f5a61c3e7
+Revises: 4b7e1c9a2d10
+Create Date: 2026-10-17 11:03:27.845120
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d2f5a61c3e7'
+down_revision = '4b7e1c9a2d10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('import_checkpoint',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('file_hash', sa.String(length=64), nullable=False),
+    sa.Column('filename', sa.String(length=256), nullable=True),
+    sa.Column('last_row', sa.Integer(), nullable=False),
+    sa.Column('rows_imported', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(length=32), nullable=True),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('started_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('import_checkpoint', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_import_checkpoint_file_hash'), ['file_hash'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('import_checkpoint', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_import_checkpoint_file_hash'))
+
+    op.drop_table('import_checkpoint')
@@ -0,0 +1,34 @@
+"""Add transaction access path indexes
+
+Revision ID: 9a4e6c1d3b72
+Revises: 0c6d2b9f8e14
+Create Date: 2026-10-17 21:47:05.118392
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a4e6c1d3b72'
+down_revision = '0c6d2b9f8e14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('transaction', schema=None) as batch_op:
+        batch_op.create_index('ix_transaction_landlord_id_date', ['landlord_id', 'date'], unique=False)
+        batch_op.create_index('ix_transaction_tenant_id_category_date', ['tenant_id', 'category', 'date'], unique=False)
+        batch_op.create_index('ix_transaction_account_id_date', ['account_id', 'date'], unique=False)
+        batch_op.create_index('ix_transaction_status', ['status'], unique=False)
+        batch_op.create_index('ix_transaction_parent_transaction_id', ['parent_transaction_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('transaction', schema=None) as batch_op:
+        batch_op.drop_index('ix_transaction_parent_transaction_id')
+        batch_op.drop_index('ix_transaction_status')
+        batch_op.drop_index('ix_transaction_account_id_date')
+        batch_op.drop_index('ix_transaction_tenant_id_category_date')
+        batch_op.drop_index('ix_transaction_landlord_id_date')
@@ -0,0 +1,48 @@
+"""Add data version counters and suggestion cache
+
+Revision ID: a7c3d9e2f615
+Revises: e1f3b7d84a09
+Create Date: 2026-10-17 17:05:31.442107
+
+"""
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c3d9e2f615'
+down_revision = 'e1f3b7d84a09'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    data_version = op.create_table('data_version',
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.bulk_insert(data_version, [{'name': 'directory', 'version': 1, 'updated_at': datetime.utcnow()}])
+
+    op.create_table('suggestion_cache',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('transaction_id', sa.Integer(), nullable=False),
+    sa.Column('directory_version', sa.Integer(), nullable=False),
+    sa.Column('memo', sa.Text(), nullable=True),
+    sa.Column('suggestions', sa.Text(), nullable=True),
+    sa.Column('computed_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['transaction_id'], ['transaction.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('suggestion_cache', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_suggestion_cache_transaction_id'), ['transaction_id'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('suggestion_cache', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_suggestion_cache_transaction_id'))
+
+    op.drop_table('suggestion_cache')
+    op.drop_table('data_version')
@@ -0,0 +1,39 @@
+"""Add learned match table
+
+Revision ID: b2e8f4a61c93
+Revises: a7c3d9e2f615
+Create Date: 2026-10-17 19:26:12.870315
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b2e8f4a61c93'
+down_revision = 'a7c3d9e2f615'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('learned_match',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('signature', sa.String(length=384), nullable=False),
+    sa.Column('match_type', sa.String(length=16), nullable=False),
+    sa.Column('match_id', sa.Integer(), nullable=False),
+    sa.Column('category', sa.String(length=64), nullable=True),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('learned_match', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_learned_match_signature'), ['signature'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('learned_match', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_learned_match_signature'))
+
+    op.drop_table('learned_match')
@@ -0,0 +1,65 @@
+"""Add payout run tables
+
+Revision ID: b6f1d9a4c302
+Revises: d83f5a2c7e90
+Create Date: 2026-10-18 01:12:27.418230
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6f1d9a4c302'
+down_revision = 'd83f5a2c7e90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('payout_run',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('start_date', sa.Date(), nullable=False),
+    sa.Column('end_date', sa.Date(), nullable=False),
+    sa.Column('payout_date', sa.Date(), nullable=False),
+    sa.Column('vat_rate', sa.Float(), nullable=False),
+    sa.Column('status', sa.String(length=32), nullable=False),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('payout_run_item',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('run_id', sa.Integer(), nullable=True),
+    sa.Column('landlord_id', sa.Integer(), nullable=False),
+    sa.Column('start_date', sa.Date(), nullable=False),
+    sa.Column('end_date', sa.Date(), nullable=False),
+    sa.Column('status', sa.String(length=32), nullable=False),
+    sa.Column('reason', sa.String(length=128), nullable=True),
+    sa.Column('rent_income', sa.BigInteger(), nullable=True),
+    sa.Column('expenses', sa.BigInteger(), nullable=True),
+    sa.Column('commission', sa.BigInteger(), nullable=True),
+    sa.Column('vat', sa.BigInteger(), nullable=True),
+    sa.Column('payout', sa.BigInteger(), nullable=True),
+    sa.Column('transaction_id', sa.Integer(), nullable=True),
+    sa.Column('processed_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['landlord_id'], ['landlord.id'], ),
+    sa.ForeignKeyConstraint(['run_id'], ['payout_run.id'], ),
+    sa.ForeignKeyConstraint(['transaction_id'], ['transaction.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('landlord_id', 'start_date', 'end_date')
+    )
+    with op.batch_alter_table('payout_run_item', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_payout_run_item_run_id'), ['run_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_payout_run_item_transaction_id'), ['transaction_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('payout_run_item', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_payout_run_item_transaction_id'))
+        batch_op.drop_index(batch_op.f('ix_payout_run_item_run_id'))
+
+    op.drop_table('payout_run_item')
+    op.drop_table('payout_run')
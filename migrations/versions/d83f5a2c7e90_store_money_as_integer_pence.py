@@ -0,0 +1,46 @@
+"""Store money as integer pence
+
+Revision ID: d83f5a2c7e90
+Revises: 5e7b0a3c9d26
+Create Date: 2026-10-17 22:36:18.904125
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd83f5a2c7e90'
+down_revision = '5e7b0a3c9d26'
+branch_labels = None
+depends_on = None
+
+MONEY_COLUMNS = [
+    ('account', 'balance', True),
+    ('transaction', 'amount', True),
+    ('property', 'rent_amount', True),
+    ('expense', 'amount', True),
+    ('posting', 'amount', False),
+    ('balance_discrepancy', 'cached_balance', True),
+    ('balance_discrepancy', 'ledger_balance', True),
+    ('balance_discrepancy', 'difference', True),
+]
+
+
+def upgrade():
+    # Scale to pence while the columns are still floating point, then change
+    # the type. Halves round away from zero, like app.money.to_pence; on
+    # PostgreSQL that needs numeric, as round() on double precision rounds to even.
+    numeric = '::numeric' if op.get_bind().dialect.name == 'postgresql' else ''
+    for table, column, nullable in MONEY_COLUMNS:
+        op.execute(f'UPDATE "{table}" SET {column} = round({column}{numeric} * 100) WHERE {column} IS NOT NULL')
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.alter_column(column, existing_type=sa.Float(), type_=sa.BigInteger(), existing_nullable=nullable,
+                                  postgresql_using=f'{column}::bigint')
+
+
+def downgrade():
+    for table, column, nullable in MONEY_COLUMNS:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.alter_column(column, existing_type=sa.BigInteger(), type_=sa.Float(), existing_nullable=nullable)
+        op.execute(f'UPDATE "{table}" SET {column} = {column} / 100.0 WHERE {column} IS NOT NULL')
@@ -0,0 +1,64 @@
+"""Add import fingerprint to transaction
+
+Revision ID: e1f3b7d84a09
+Revises: c5a90e4f7b21
+Create Date: 2026-10-17 15:21:49.603377
+
+"""
+from collections import Counter
+import hashlib
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e1f3b7d84a09'
+down_revision = 'c5a90e4f7b21'
+branch_labels = None
+depends_on = None
+
+
+def _normalize(value):
+    return ''.join((value or '').upper().split())
+
+
+def upgrade():
+    with op.batch_alter_table('transaction', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('import_fingerprint', sa.String(length=64), nullable=True))
+        batch_op.create_index(batch_op.f('ix_transaction_import_fingerprint'), ['import_fingerprint'], unique=True)
+
+    # Fingerprint existing bank lines the same way the importer does, so
+    # overlapping exports uploaded after the upgrade are recognised.
+    connection = op.get_bind()
+    account = sa.table('account', sa.column('id', sa.Integer), sa.column('name', sa.String))
+    transaction = sa.table('transaction',
+        sa.column('id', sa.Integer),
+        sa.column('date', sa.Date),
+        sa.column('amount', sa.Float),
+        sa.column('description', sa.String),
+        sa.column('reference_code', sa.String),
+        sa.column('account_id', sa.Integer),
+        sa.column('parent_transaction_id', sa.Integer),
+        sa.column('import_fingerprint', sa.String)
+    )
+    bank_account_id = connection.execute(sa.select(account.c.id).where(account.c.name == 'Master Bank Account')).scalar()
+    if bank_account_id is None:
+        return
+    rows = connection.execute(
+        sa.select(transaction.c.id, transaction.c.date, transaction.c.amount, transaction.c.description, transaction.c.reference_code)
+        .where(transaction.c.account_id == bank_account_id, transaction.c.parent_transaction_id.is_(None),
+               transaction.c.date.isnot(None), transaction.c.amount.isnot(None))
+        .order_by(transaction.c.id)
+    ).fetchall()
+    occurrences = Counter()
+    for row_id, date, amount, description, reference_code in rows:
+        key = f'{bank_account_id}|{date.isoformat()}|{amount:.2f}|{_normalize(description)}|{_normalize(reference_code)}'
+        occurrences[key] += 1
+        fingerprint = hashlib.sha256(f'{key}|{occurrences[key]}'.encode('utf-8')).hexdigest()
+        connection.execute(transaction.update().where(transaction.c.id == row_id).values(import_fingerprint=fingerprint))
+
+
+def downgrade():
+    with op.batch_alter_table('transaction', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_transaction_import_fingerprint'))
+        batch_op.drop_column('import_fingerprint')